@@ -0,0 +1,71 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Peak memory of integrating the fluxes of one spacecraft-day of SSJ data
+import argparse
+import multiprocessing
+import resource
+import sys
+
+import numpy as np
+
+from ssjlatbin.fluxcalculations import integrate_flux,integrate_fluxes
+from ssjlatbin.benchmark import synthetic_ssj_day
+
+SOFT_CHANNELS = [10,11,12,13,14,15,16,17]
+HARD_CHANNELS = [0,1,2,3,4,5,6,7,8]
+ALL_CHANNELS = [0,1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16,17]
+CHANNEL_SETS = [(channels,fluxtype)
+                    for channels in [SOFT_CHANNELS,HARD_CHANNELS,ALL_CHANNELS]
+                    for fluxtype in ['energy','number']]
+
+def _peak_rss_mb():
+    #ru_maxrss is kilobytes on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss/1024.**2 if sys.platform == 'darwin' else maxrss/1024.
+
+def _run(mode,n_times,n_days,queue):
+    data = synthetic_ssj_day('2005-01-01',cadence_s=86400./n_times)
+    species = [(data[var],data[var+'_STD']) for var in ['ELE_DIFF_ENERGY_FLUX','ION_DIFF_ENERGY_FLUX']]
+    del data
+    baseline_mb = _peak_rss_mb()
+    out = np.empty((n_times,len(CHANNEL_SETS)))
+    for i_day in range(n_days):
+        for diff_flux,diff_flux_rel_uncert in species:
+            if mode == 'per_column':
+                #One integration per column, each re-reading (copying)
+                #the variables, as _read_ssj_file used to
+                for channels,fluxtype in CHANNEL_SETS:
+                    integrate_flux(diff_flux.copy(),channels,fluxtype,
+                                   diff_flux_rel_uncert=diff_flux_rel_uncert.copy(),
+                                   uncertainty_tolerance=100.)
+            elif mode == 'batched':
+                integrate_fluxes(diff_flux,CHANNEL_SETS,
+                                 diff_flux_rel_uncert=diff_flux_rel_uncert,
+                                 uncertainty_tolerance=100.)
+            elif mode == 'batched_out':
+                integrate_fluxes(diff_flux,CHANNEL_SETS,
+                                 diff_flux_rel_uncert=diff_flux_rel_uncert,
+                                 uncertainty_tolerance=100.,
+                                 out=out)
+    queue.put(_peak_rss_mb()-baseline_mb)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--n_times',type=int,default=86400,
+                        help='Samples per spacecraft-day')
+    parser.add_argument('--n_days',type=int,default=3)
+    args = parser.parse_args()
+
+    #Each mode runs in a fresh process so peak RSS is not shared
+    ctx = multiprocessing.get_context('spawn')
+    for mode in ['per_column','batched','batched_out']:
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run,args=(mode,args.n_times,args.n_days,queue))
+        proc.start()
+        peak_mb = queue.get()
+        proc.join()
+        print('{}: peak RSS above inputs {:.1f} MB per spacecraft-day ({} samples)'.format(mode,
+                                                                                        peak_mb,
+                                                                                        args.n_times))
+
+if __name__ == '__main__':
+    main()
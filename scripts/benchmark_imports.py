@@ -0,0 +1,20 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Benchmark of the time to import each module of ssjlatbin in a new process
+import argparse
+
+from ssjlatbin.benchmark import import_times,PUBLIC_MODULES
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('modules',nargs='*',default=PUBLIC_MODULES,
+                        help='Modules of ssjlatbin to import (default all)')
+    parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+
+    results = import_times(['ssjlatbin.'+module for module in args.modules],repeat=args.repeat)
+    for result in results:
+        print('{:28s} {:7.1f} ms  {}'.format(result['module'],1e3*result['seconds'],
+                                             ' '.join(result['lazy_imported'])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Benchmark of the latitude binning in ssjlatbin.latbin_pandas
+import argparse
+import timeit
+
+import pandas as pd
+
+from ssjlatbin.latbin_pandas import (latbin_codes,_latbin_select,
+                                     latbin_categories,bin_by_latitude)
+from ssjlatbin.benchmark import synthetic_orbit_numbered_dataframe
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days',type=int,nargs='+',default=[1,7,30])
+    parser.add_argument('--delta_lat',type=float,default=2.)
+    parser.add_argument('--max_lat',type=float,default=80.)
+    parser.add_argument('--repeat',type=int,default=3)
+    args = parser.parse_args()
+
+    config = {'latbin':{'delta_lat':args.delta_lat,'max_lat':args.max_lat}}
+    categories = latbin_categories(args.delta_lat,args.max_lat)
+    for n_days in args.days:
+        df = synthetic_orbit_numbered_dataframe(n_days)
+        codes = latbin_codes(df,args.delta_lat,args.max_lat)
+        selected = _latbin_select(df,args.delta_lat,args.max_lat)
+        fast = pd.Categorical.from_codes(codes,categories=categories,ordered=True)
+        if not fast.equals(selected):
+            raise RuntimeError('latbin_codes does not match np.select binning')
+
+        t_select = min(timeit.repeat(lambda: _latbin_select(df,args.delta_lat,args.max_lat),
+                                     number=1,repeat=args.repeat))
+        t_codes = min(timeit.repeat(lambda: latbin_codes(df,args.delta_lat,args.max_lat),
+                                    number=1,repeat=args.repeat))
+        t_bin = min(timeit.repeat(lambda: bin_by_latitude(df,config),
+                                  number=1,repeat=args.repeat))
+        print(('{} days ({} samples, {} bins): np.select {:.3f} s, '
+               +'latbin_codes {:.3f} s ({:.1f}x), '
+               +'bin_by_latitude {:.3f} s').format(n_days,len(df),len(categories),
+                                                  t_select,t_codes,
+                                                  t_select/t_codes,t_bin))
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@ setup(name='ssjlatbin',
       install_requires=['numpy','netCDF4','matplotlib','pandas','pyarrow','logbook','cdflib','toml','geospacepy'],
       packages=['ssjlatbin'],
       package_dir={'ssjlatbin' : 'ssjlatbin'},
+      entry_points={'console_scripts':['ssjlatbin-build=ssjlatbin.cli:main']},
       license='LICENSE.txt',
       zip_safe = False,
       classifiers = [
@@ -0,0 +1,346 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Benchmark each stage of processing on synthetic SSJ files,
+saving the timings and peak memory as JSON"""
+import argparse
+import datetime,os,sys,time
+import json
+import platform
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.netcdf import datetime64_to_ms_since_0AD
+from ssjlatbin.tools import derivative
+
+ORBIT_PERIOD_S = 101.*60.
+INCLINATION = 98.8
+#Orbit phase is counted from this time so orbits continue from one synthetic day to the next
+ORBIT_EPOCH = np.datetime64('2000-01-01T00:00:00','ns')
+N_CHANNELS = 19
+
+#Configuration for the benchmark, the same processing settings as
+#scripts/default_config.toml
+BENCHMARK_CONFIG = {'soft_channels':[10,11,12,13,14,15,16,17],
+                    'hard_channels':[0,1,2,3,4,5,6,7,8],
+                    'all_channels':list(range(18)),
+                    'dataframevar_to_filevar':{'glats':'SC_GEOCENTRIC_LAT',
+                                               'glons':'SC_GEOCENTRIC_LON',
+                                               'mlats':'SC_AACGM_LAT',
+                                               'mlts':'SC_AACGM_LTIME'},
+                    'calculation':{'uncertainty_tolerance':100},
+                    'latbin':{'delta_lat':2,'max_lat':80},
+                    'io':{'cdf_or_nc':'nc',
+                          'ssj_nc_version':'1.1.4',
+                          'ssj_cdf_version':'1.1.4'}}
+
+def synthetic_orbit(dts):
+    """Geographic and (approximate) magnetic coordinates of a spacecraft
+    in a circular polar orbit at datetime64 times dts"""
+    t_s = (dts-ORBIT_EPOCH).astype('timedelta64[ns]').astype(np.int64)/1e9
+    phase = 2*np.pi*t_s/ORBIT_PERIOD_S
+    glats = np.degrees(np.arcsin(np.sin(np.radians(INCLINATION))*np.sin(phase)))
+    glons = np.mod(np.degrees(phase)-360.*t_s/86400.,360.)
+    mlats = np.clip(glats+8.*np.cos(np.radians(glons)),-90.,90.)
+    ut_hours = np.mod(t_s/3600.,24.)
+    mlts = np.mod(ut_hours+glons/15.,24.)
+    return glats,glons,mlats,mlts
+
+def synthetic_ssj_day(date,cadence_s=1.,seed=0):
+    """Variables of one synthetic spacecraft day of SSJ data (as dict of
+    file variable name to array, with Epoch as datetime64), with
+    differential fluxes which are higher in the auroral zones"""
+    dts = (np.datetime64(date,'D').astype('datetime64[ns]')
+            +(np.arange(0.,86400.,cadence_s)*1e9).astype('timedelta64[ns]'))
+    glats,glons,mlats,mlts = synthetic_orbit(dts)
+    rng = np.random.default_rng(seed+int(np.datetime64(date,'D').astype(np.int64)))
+    auroral = np.exp(-((np.abs(mlats)-67.)/5.)**2)[:,np.newaxis]
+    data = {'Epoch':dts,
+            'SC_GEOCENTRIC_LAT':glats,
+            'SC_GEOCENTRIC_LON':glons,
+            'SC_AACGM_LAT':mlats,
+            'SC_AACGM_LTIME':mlts}
+    for species,scale in [('ELE',1e8),('ION',1e6)]:
+        diff_flux = scale*(1.+100.*auroral)*rng.lognormal(0.,1.,(dts.size,N_CHANNELS))
+        diff_flux[rng.random(diff_flux.shape)<.01] = np.nan
+        data[species+'_DIFF_ENERGY_FLUX'] = diff_flux
+        data[species+'_DIFF_ENERGY_FLUX_STD'] = rng.uniform(.05,1.5,(dts.size,N_CHANNELS))
+    return data
+
+def synthetic_ssjfn(dmsp_number,date,filetype,version='1.1.4'):
+    date = pd.Timestamp(date)
+    return 'dmsp-f{:02d}_ssj_precipitating-electrons-ions_{}{:02d}{:02d}_v{}.{}'.format(dmsp_number,
+                                                                                      date.year,
+                                                                                      date.month,
+                                                                                      date.day,
+                                                                                      version,filetype)
+
+def _write_nc(fn,data):
+    from netCDF4 import Dataset
+    with Dataset(fn,'w') as ds:
+        ds.createDimension('Epoch',data['Epoch'].size)
+        ds.createDimension('channel',N_CHANNELS)
+        for key,arr in data.items():
+            if key == 'Epoch':
+                arr = datetime64_to_ms_since_0AD(arr)
+            dims = ('Epoch',) if arr.ndim==1 else ('Epoch','channel')
+            var = ds.createVariable(key,'f8',dims)
+            var[:] = arr
+
+def _write_cdf(fn,data):
+    try:
+        from cdflib.cdfwrite import CDF
+    except ImportError:
+        raise ImportError('cdflib is needed to write synthetic CDF files')
+    #CDF_EPOCH is milliseconds since 0000-01-01 (year 0 has 366 days)
+    ms_from_0AD_to_1970 = (np.datetime64('1970-01-01','ms')-np.datetime64('0001-01-01','ms')).astype(np.int64)+366*86400000
+    cdf = CDF(fn,cdf_spec={'Majority':'Row_major'},delete=True)
+    for key,arr in data.items():
+        if key == 'Epoch':
+            arr = arr.astype('datetime64[ms]').astype(np.int64).astype(float)+ms_from_0AD_to_1970
+            data_type = CDF.CDF_EPOCH
+        else:
+            data_type = CDF.CDF_DOUBLE
+        var_spec = {'Variable':key,'Data_Type':data_type,'Num_Elements':1,
+                    'Rec_Vary':True,'Dim_Sizes':list(arr.shape[1:])}
+        cdf.write_var(var_spec,var_attrs={},var_data=arr)
+    cdf.close()
+
+def write_synthetic_ssj_files(data_dir,dmsp_number,dt_start,n_days,filetype='nc',cadence_s=1.):
+    """Write n_days synthetic SSJ files starting on dt_start to data_dir/year,
+    named like the CDAWeb files so io.ssjfn finds them. netCDF files have the
+    layout read by netcdf.ReadOnlyConvertedNC, CDF files (filetype 'cdf', needs cdflib)
+    have CDF_EPOCH Epoch. Returns the list of files written"""
+    if filetype not in ['cdf','nc']:
+        raise ValueError(f'Invalid filetype {filetype}, valid options cdf or nc')
+    fns = []
+    for i_day in range(n_days):
+        date = np.datetime64(dt_start,'D')+np.timedelta64(i_day,'D')
+        year_dir = os.path.join(data_dir,str(pd.Timestamp(date).year))
+        os.makedirs(year_dir,exist_ok=True)
+        fn = os.path.join(year_dir,synthetic_ssjfn(dmsp_number,date,filetype))
+        data = synthetic_ssj_day(date,cadence_s=cadence_s,seed=dmsp_number)
+        if filetype == 'nc':
+            _write_nc(fn,data)
+        else:
+            _write_cdf(fn,data)
+        fns.append(fn)
+    return fns
+
+def synthetic_orbit_numbered_dataframe(n_days,cadence_s=1.):
+    """Make a dataframe with the same columns as
+    cdf.get_orbit_numbered_ssj_range_dataframe for a spacecraft
+    in a circular polar orbit (without reading or writing files)"""
+    dts = (np.datetime64('2005-01-01','ns')
+            +(np.arange(0.,n_days*86400.,cadence_s)*1e9).astype('timedelta64[ns]'))
+    glats,glons,mlats,mlts = synthetic_orbit(dts)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({'glats':glats,
+                       'glons':glons,
+                       'mlats':mlats,
+                       'mlts':mlts,
+                       'ele_total_energy':rng.lognormal(-2.,2.,dts.size)},
+                      index=pd.DatetimeIndex(dts))
+    df['time'] = df.index
+    t_s = (dts-ORBIT_EPOCH).astype(np.int64)/1e9
+    df['orbit_number'] = np.floor(t_s/ORBIT_PERIOD_S)
+    df['orbit_start_time'] = df.groupby('orbit_number')['time'].transform('min')
+    df['dglats'] = derivative(glats)
+    return df
+
+class StageTimer(object):
+    """Run benchmark stages, recording time, throughput and
+    (if trace_memory) peak memory allocated while the stage runs"""
+    def __init__(self,trace_memory=True):
+        self.trace_memory = trace_memory
+        self.results = []
+
+    def run(self,stage,n_days,n_samples,func,*args,**kwargs):
+        t0 = time.perf_counter()
+        result = func(*args,**kwargs)
+        seconds = time.perf_counter()-t0
+        peak_mb = None
+        if self.trace_memory:
+            #A second run, since tracing slows allocation down
+            del result
+            tracemalloc.start()
+            result = func(*args,**kwargs)
+            peak_mb = tracemalloc.get_traced_memory()[1]/1024.**2
+            tracemalloc.stop()
+        self.results.append({'stage':stage,
+                             'n_days':n_days,
+                             'n_samples':int(n_samples),
+                             'seconds':seconds,
+                             'samples_per_s':n_samples/seconds if seconds>0 else None,
+                             'peak_memory_mb':peak_mb})
+        print('{:>24} {:>4} days: {:8.3f} s {:12.0f} samples/s{}'.format(stage,n_days,seconds,
+                                n_samples/seconds if seconds>0 else np.inf,
+                                '' if peak_mb is None else ' peak {:.1f} MB'.format(peak_mb)))
+        return result
+
+def _read_day_variables(fn,config):
+    """Read what _reduce_ssj_file reads from a file, without calculating anything"""
+    from ssjlatbin.cdf import _define_ssj_dataframe_contents
+    from ssjlatbin.reader import open_ssj_file,LazySSJFile
+    dataframevar_to_filevar,diff_flux_filevar_to_dataframevars = _define_ssj_dataframe_contents(config)
+    file = LazySSJFile(open_ssj_file(fn))
+    data = {'Epoch':file['Epoch']}
+    for filevar in dataframevar_to_filevar.values():
+        data[filevar] = file[filevar]
+    for filevar,dfvar_to_channel_set in diff_flux_filevar_to_dataframevars.items():
+        channels = sorted(set(c for channels,fluxtype in dfvar_to_channel_set.values() for c in channels))
+        data[filevar] = file.read(filevar,channels=channels)
+        data[filevar+'_STD'] = file.read(filevar+'_STD',channels=channels)
+    return data
+
+def _integrate_day(data,config):
+    from ssjlatbin.cdf import _define_ssj_dataframe_contents
+    from ssjlatbin.fluxcalculations import integrate_fluxes
+    _,diff_flux_filevar_to_dataframevars = _define_ssj_dataframe_contents(config)
+    integral_fluxes = []
+    for filevar,dfvar_to_channel_set in diff_flux_filevar_to_dataframevars.items():
+        channel_sets = list(dfvar_to_channel_set.values())
+        channels = sorted(set(c for channels,fluxtype in channel_sets for c in channels))
+        integral_fluxes.append(integrate_fluxes(data[filevar],channel_sets,
+                                                diff_flux_rel_uncert=data[filevar+'_STD'],
+                                                uncertainty_tolerance=config['calculation']['uncertainty_tolerance'],
+                                                channel_numbers=channels))
+    return integral_fluxes
+
+def _each(func,items,*args):
+    return [func(item,*args) for item in items]
+
+def _orbit_numbered(df,dt_start):
+    from ssjlatbin.cdf import _number_orbits,_orbit_start_time
+    df = df.copy()
+    df['orbit_number'] = _number_orbits(df,dt_start,'glats')
+    df['orbit_start_time'] = _orbit_start_time(df)
+    df['dglats'] = derivative(df['glats'].values)
+    return df.dropna().sort_index()
+
+def run_benchmarks(days,work_dir,filetype='nc',cadence_s=1.,trace_memory=True,dmsp_number=16):
+    """Write synthetic files for the largest number of days, then time each
+    stage on the first n_days files for each n_days in days. Returns a list
+    of results (dicts with stage, n_days, n_samples, seconds,
+    samples_per_s and peak_memory_mb)"""
+    from ssjlatbin.cdf import _reduce_ssj_file,_number_orbits
+    from ssjlatbin import latbin,latbin_pandas
+
+    config = json.loads(json.dumps(BENCHMARK_CONFIG))
+    config['io']['cdf_or_nc'] = filetype
+    config['io'][f'ssj_{filetype}_root_dir'] = os.path.join(work_dir,'data')
+    config['io']['parquet_root_dir'] = os.path.join(work_dir,'parquet')
+    os.makedirs(config['io']['parquet_root_dir'],exist_ok=True)
+    dt_start = datetime.datetime(2005,1,1)
+
+    t0 = time.perf_counter()
+    fns = write_synthetic_ssj_files(config['io'][f'ssj_{filetype}_root_dir'],dmsp_number,
+                                    dt_start,max(days),filetype=filetype,cadence_s=cadence_s)
+    print('Wrote {} synthetic {} files in {:.1f} s'.format(len(fns),filetype,time.perf_counter()-t0))
+
+    timer = StageTimer(trace_memory=trace_memory)
+    for n_days in sorted(days):
+        day_fns = fns[:n_days]
+        n_samples = n_days*int(np.ceil(86400./cadence_s))
+        datas = timer.run('read_file',n_days,n_samples,_each,_read_day_variables,day_fns,config)
+        timer.run('integrate_flux',n_days,n_samples,_each,_integrate_day,datas,config)
+        del datas
+        dfs = timer.run('reduce_file',n_days,n_samples,_each,_reduce_ssj_file,day_fns,config)
+        df = pd.concat(dfs)
+        del dfs
+        timer.run('number_orbits',n_days,n_samples,_number_orbits,df,dt_start,'glats')
+        df = _orbit_numbered(df,dt_start)
+        timer.run('bin_by_latitude_numpy',n_days,n_samples,latbin.bin_by_latitude,df,
+                  ['ele_total_energy','ion_total_energy'],
+                  delta_lat=config['latbin']['delta_lat'],max_lat=config['latbin']['max_lat'])
+        binneddf = timer.run('bin_by_latitude_pandas',n_days,n_samples,
+                             latbin_pandas.bin_by_latitude,df,config)
+        parquet_fn = os.path.join(config['io']['parquet_root_dir'],f'latbin_{n_days}days.parquet')
+        timer.run('parquet_write',n_days,n_samples,binneddf.to_parquet,parquet_fn)
+    return timer.results
+
+#Modules of the package timed by import_times
+PUBLIC_MODULES = ['binstats','cache','cdf','cli','dataset','export','fileindex',
+                  'fluxcalculations','grid','io','latbin','latbin_pandas','manifest',
+                  'metrics','netcdf','online','pipeline','reader','sketch','solar','tools']
+
+#Slow to import dependencies which should only be imported when they are used
+LAZY_DEPENDENCIES = ['netCDF4','pycdflib','logbook','pyarrow.parquet','pyarrow.dataset',
+                     'matplotlib','geospacepy']
+
+_IMPORT_SCRIPT = """import json,sys,time
+t0=time.perf_counter()
+import {module}
+t=time.perf_counter()-t0
+print(json.dumps({{'seconds':t,'lazy_imported':[m for m in {lazy} if m in sys.modules]}}))"""
+
+def import_times(modules=None,repeat=3):
+    """Cold start import time of each module (ssjlatbin. is prepended to the
+    names in PUBLIC_MODULES), the fastest of repeat imports each in a new
+    Python process, and which of LAZY_DEPENDENCIES the import loaded.
+    The time of importing the interpreter itself is not included"""
+    import subprocess
+    if modules is None:
+        modules = ['ssjlatbin.'+module for module in PUBLIC_MODULES]
+    results = []
+    for module in modules:
+        script = _IMPORT_SCRIPT.format(module=module,lazy=LAZY_DEPENDENCIES)
+        runs = []
+        for i_repeat in range(repeat):
+            output = subprocess.run([sys.executable,'-c',script],check=True,
+                                    capture_output=True,text=True).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+        results.append({'module':module,
+                        'seconds':min(run['seconds'] for run in runs),
+                        'lazy_imported':runs[0]['lazy_imported']})
+    return results
+
+def _package_version():
+    try:
+        from importlib.metadata import version
+        return version('ssjlatbin')
+    except Exception:
+        return 'unknown'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days',type=int,nargs='+',default=[1,7],
+                        help='Numbers of days of data to benchmark (default 1 7)')
+    parser.add_argument('--filetype',choices=['nc','cdf'],default='nc')
+    parser.add_argument('--cadence_s',type=float,default=1.,
+                        help='Seconds between synthetic samples (default 1, as SSJ)')
+    parser.add_argument('--no_memory',action='store_true',
+                        help='Do not measure peak memory (which runs each stage twice)')
+    parser.add_argument('--work_dir',default=None,
+                        help='Directory for the synthetic files (default a temporary directory)')
+    parser.add_argument('--output',default='ssjlatbin_benchmark.json',
+                        help='JSON file for the results')
+    parser.add_argument('--import_times',action='store_true',
+                        help='Also time importing each module in a new process')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = tmp_dir if args.work_dir is None else args.work_dir
+        results = run_benchmarks(args.days,work_dir,filetype=args.filetype,
+                                 cadence_s=args.cadence_s,trace_memory=not args.no_memory)
+
+    report = {'ssjlatbin_version':_package_version(),
+              'date':datetime.datetime.now().isoformat(),
+              'python':platform.python_version(),
+              'platform':platform.platform(),
+              'numpy':np.__version__,
+              'pandas':pd.__version__,
+              'filetype':args.filetype,
+              'cadence_s':args.cadence_s,
+              'results':results}
+    if args.import_times:
+        report['import_times'] = import_times()
+    with open(args.output,'w') as f:
+        json.dump(report,f,indent=1)
+    print('Results saved to {}'.format(args.output))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import json
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.latbin_pandas import (define_latbins,latbin_categories,latbin_codes,
+                                     ORBIT_QUARTERS)
+from ssjlatbin.metrics import get_metrics,timed
+
+#Sufficient statistics stored for each variable in each bin of each orbit
+#(columns are named variable_statistic)
+BIN_STATISTICS = ['count','sum','sumsq','min','max']
+
+#Time of each sample is stored as seconds since the start of its orbit
+TIME_OFFSET_VAR = 'time_offset_s'
+
+#Columns of orbit numbered dataframes which are not binned
+NOT_BINNED = ['time','orbit_start_time','orbit_number']
+
+#Key of the Parquet metadata with the latitude bins of a statistics file
+PARQUET_METADATA_KEY = b'ssjlatbin_bin_statistics'
+
+def _latbin_bounds(delta_lat,max_lat):
+    """Orbit quarter (index into ORBIT_QUARTERS) and lower and upper latitude
+    of each latitude bin, in the same order as latbin_categories"""
+    lat_bin_edges = define_latbins(delta_lat,max_lat)
+    quarters,lowers,uppers = [],[],[]
+    for i_quarter,(hemi,asc_desc) in enumerate(ORBIT_QUARTERS):
+        edges = lat_bin_edges[hemi][asc_desc]
+        quarters.append(np.full((len(edges)-1,),i_quarter))
+        lowers.append(np.minimum(edges[:-1],edges[1:]))
+        uppers.append(np.maximum(edges[:-1],edges[1:]))
+    return np.concatenate(quarters),np.concatenate(lowers),np.concatenate(uppers)
+
+def _reduce_by_key(key,columns):
+    """Group rows by integer key. columns is a list of (array,operation) with
+    operation 'sum', 'min' or 'max'. Returns the sorted unique keys and
+    the reduction of each column for each key"""
+    order = np.argsort(key,kind='stable')
+    sorted_key = key[order]
+    is_first = np.concatenate([[True],sorted_key[1:]!=sorted_key[:-1]]) if key.size>0 else np.zeros((0,),dtype=bool)
+    starts = np.flatnonzero(is_first)
+    reduced = []
+    for values,operation in columns:
+        ufunc = {'sum':np.add,'min':np.minimum,'max':np.maximum}[operation]
+        if starts.size == 0:
+            reduced.append(np.zeros((0,)))
+        else:
+            reduced.append(ufunc.reduceat(values[order],starts))
+    return sorted_key[starts],reduced
+
+def _statistics_dataframe(orbit_start_times,categories,n_bins,keys,columns):
+    """Dataframe indexed like the output of latbin_pandas.bin_by_latitude
+    from flat (orbit,bin) keys"""
+    index = pd.MultiIndex.from_arrays([pd.DatetimeIndex(orbit_start_times[keys//n_bins]),
+                                       pd.Categorical.from_codes(keys%n_bins,categories=categories,
+                                                                 ordered=True)],
+                                      names=['orbit_start_time','latbin'])
+    return pd.DataFrame(columns,index=index)
+
+def _check_statistics_columns(statsdf):
+    variables = []
+    for column in statsdf.columns:
+        variable,statistic = column.rsplit('_',1)
+        if statistic not in BIN_STATISTICS:
+            raise ValueError('Column {} is not a bin statistic'.format(column))
+        if variable not in variables:
+            variables.append(variable)
+    return variables
+
+@timed('bin_statistics')
+def bin_statistics(orbit_numbered_ssj_dataframe,config,latvar='glats',variables=None):
+    """Bin each orbit into the latitude bins of latbin_pandas.bin_by_latitude
+    (set by [latbin] delta_lat and max_lat), but instead of the mean
+    keep the sufficient statistics (count of finite values, sum, sum of
+    squares, minimum and maximum) of every variable, from which the mean and
+    standard deviation in these or any coarser bins can be calculated
+    (see coarsen_bin_statistics and bin_statistics_to_binned).
+
+    variables defaults to every numeric column. The time of each sample is
+    kept as seconds since the start of the orbit (time_offset_s).
+    Bins with no data have no row."""
+    delta_lat=config['latbin']['delta_lat']
+    max_lat=config['latbin']['max_lat']
+    df = orbit_numbered_ssj_dataframe
+    if variables is None:
+        variables = [column for column in df.columns
+                        if column not in NOT_BINNED and pd.api.types.is_numeric_dtype(df[column])]
+
+    categories = latbin_categories(delta_lat,max_lat)
+    n_bins = len(categories)
+    codes = latbin_codes(df,delta_lat,max_lat,latvar=latvar)
+    orbit_start_times,orbit_index = np.unique(df['orbit_start_time'].values.astype('datetime64[ns]'),
+                                              return_inverse=True)
+    in_bin = codes>=0
+    key = orbit_index.ravel()[in_bin]*n_bins+codes[in_bin]
+
+    time_offset_s = ((df.index.values.astype('datetime64[ns]')-df['orbit_start_time'].values.astype('datetime64[ns]'))
+                        .astype(np.int64)/1e9)
+    columns = []
+    for variable in variables+[TIME_OFFSET_VAR]:
+        if variable == TIME_OFFSET_VAR:
+            y = time_offset_s[in_bin]
+        else:
+            y = df[variable].values.astype(float)[in_bin]
+        finite = np.isfinite(y)
+        y_zeroed = np.where(finite,y,0.)
+        columns += [(finite.astype(np.int64),'sum'),
+                    (y_zeroed,'sum'),
+                    (y_zeroed**2,'sum'),
+                    (np.where(finite,y,np.inf),'min'),
+                    (np.where(finite,y,-np.inf),'max')]
+    keys,reduced = _reduce_by_key(key,columns)
+
+    statscolumns = {}
+    for i_var,variable in enumerate(variables+[TIME_OFFSET_VAR]):
+        count = reduced[i_var*5]
+        statscolumns[variable+'_count'] = count
+        statscolumns[variable+'_sum'] = reduced[i_var*5+1]
+        statscolumns[variable+'_sumsq'] = reduced[i_var*5+2]
+        statscolumns[variable+'_min'] = np.where(count>0,reduced[i_var*5+3],np.nan)
+        statscolumns[variable+'_max'] = np.where(count>0,reduced[i_var*5+4],np.nan)
+
+    get_metrics().count('orbits_binned',orbit_start_times.size)
+    return _statistics_dataframe(orbit_start_times,categories,n_bins,keys,statscolumns)
+
+def coarse_latbin_map(fine_delta_lat,fine_max_lat,delta_lat,max_lat):
+    """Code of the coarse latitude bin (delta_lat,max_lat) containing each
+    fine latitude bin (fine_delta_lat,fine_max_lat), -1 for fine bins
+    above max_lat. Raises ValueError if the coarse bin edges are not
+    also edges of the fine bins"""
+    fine_quarter,fine_lower,fine_upper = _latbin_bounds(fine_delta_lat,fine_max_lat)
+    quarter,lower,upper = _latbin_bounds(delta_lat,max_lat)
+    fine_edges = np.unique(np.concatenate([fine_lower,fine_upper]))
+    edges = np.unique(np.concatenate([lower,upper]))
+    is_fine_edge = np.isclose(edges[:,np.newaxis],fine_edges[np.newaxis,:],rtol=0.,atol=1e-9).any(axis=1)
+    if not np.all(is_fine_edge):
+        raise ValueError(('Latitude bins of width {} up to {} '.format(delta_lat,max_lat)
+                          +'do not evenly divide into bins of width {} up to {}'.format(fine_delta_lat,
+                                                                                         fine_max_lat)))
+    fine_center = (fine_lower+fine_upper)/2
+    coarse_codes = np.full(fine_center.shape,-1,dtype=np.int64)
+    for i_fine in range(fine_center.size):
+        contains = np.flatnonzero((quarter==fine_quarter[i_fine])
+                                  & (lower<fine_center[i_fine]) & (upper>fine_center[i_fine]))
+        if contains.size>0:
+            coarse_codes[i_fine] = contains[0]
+    return coarse_codes
+
+def coarsen_bin_statistics(statsdf,fine_delta_lat,fine_max_lat,delta_lat,max_lat):
+    """Combine bin statistics (from bin_statistics with latitude bins
+    fine_delta_lat and fine_max_lat) into coarser latitude bins delta_lat and
+    max_lat, whose edges must also be edges of the fine bins (e.g. any
+    multiple of fine_delta_lat, with max_lat a multiple of delta_lat and
+    no more than fine_max_lat). No SSJ data is read"""
+    variables = _check_statistics_columns(statsdf)
+    coarse_codes = coarse_latbin_map(fine_delta_lat,fine_max_lat,delta_lat,max_lat)
+    categories = latbin_categories(delta_lat,max_lat)
+    n_bins = len(categories)
+
+    fine_categories = latbin_categories(fine_delta_lat,fine_max_lat)
+    fine_codes = pd.Categorical(statsdf.index.get_level_values('latbin'),categories=fine_categories).codes
+    if np.any(fine_codes<0):
+        raise ValueError(('Bin statistics are not for latitude bins of width {} '.format(fine_delta_lat)
+                          +'up to {}'.format(fine_max_lat)))
+    codes = coarse_codes[fine_codes]
+    orbit_start_times,orbit_index = np.unique(statsdf.index.get_level_values('orbit_start_time').values,
+                                              return_inverse=True)
+    in_bin = codes>=0
+    key = orbit_index.ravel()[in_bin]*n_bins+codes[in_bin]
+
+    operations = {'count':'sum','sum':'sum','sumsq':'sum','min':'min','max':'max'}
+    columns,names = [],[]
+    for variable in variables:
+        for statistic in BIN_STATISTICS:
+            values = statsdf[variable+'_'+statistic].values[in_bin]
+            if statistic == 'min':
+                values = np.where(np.isnan(values),np.inf,values)
+            elif statistic == 'max':
+                values = np.where(np.isnan(values),-np.inf,values)
+            columns.append((values,operations[statistic]))
+            names.append(variable+'_'+statistic)
+    keys,reduced = _reduce_by_key(key,columns)
+    statscolumns = dict(zip(names,reduced))
+    for variable in variables:
+        no_data = statscolumns[variable+'_count']==0
+        for statistic in ['min','max']:
+            statscolumns[variable+'_'+statistic][no_data] = np.nan
+    return _statistics_dataframe(orbit_start_times,categories,n_bins,keys,statscolumns)
+
+def bin_statistics_to_binned(statsdf,ddof=0,extra_statistics=('std',)):
+    """Mean of each variable in each bin (as from latbin_pandas.bin_by_latitude,
+    with the mean time of the samples as column time), from bin statistics.
+    extra_statistics can include 'std', 'var', 'count', 'min' and 'max',
+    added as columns variable_statistic. The variance is the sum of squared
+    deviations divided by count-ddof"""
+    variables = _check_statistics_columns(statsdf)
+    binned = {}
+    for variable in variables:
+        count = statsdf[variable+'_count'].values.astype(float)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            mean = statsdf[variable+'_sum'].values/count
+            var = (statsdf[variable+'_sumsq'].values-count*mean**2)/(count-ddof)
+        var = np.where(count-ddof>0,np.maximum(var,0.),np.nan)
+        if variable == TIME_OFFSET_VAR:
+            orbit_start_times = statsdf.index.get_level_values('orbit_start_time').values.astype('datetime64[ns]')
+            binned['time'] = orbit_start_times+(mean*1e9).round().astype(np.int64).astype('timedelta64[ns]')
+            continue
+        binned[variable] = mean
+        for statistic in extra_statistics:
+            if statistic == 'std':
+                binned[variable+'_std'] = np.sqrt(var)
+            elif statistic == 'var':
+                binned[variable+'_var'] = var
+            elif statistic in ['count','min','max']:
+                binned[variable+'_'+statistic] = statsdf[variable+'_'+statistic].values
+            else:
+                raise ValueError('Unknown statistic {}'.format(statistic))
+    return pd.DataFrame(binned,index=statsdf.index)
+
+def write_bin_statistics(statsdf,path,delta_lat,max_lat):
+    """Write bin statistics to Parquet, with their latitude bins
+    in the file metadata (see read_bin_statistics)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pa.Table.from_pandas(statsdf)
+    metadata = dict(table.schema.metadata or {})
+    metadata[PARQUET_METADATA_KEY] = json.dumps({'delta_lat':delta_lat,'max_lat':max_lat}).encode('utf-8')
+    pq.write_table(table.replace_schema_metadata(metadata),path)
+
+def read_bin_statistics(path):
+    """Read bin statistics written by write_bin_statistics, returning
+    the dataframe and the delta_lat and max_lat of its latitude bins"""
+    import pyarrow.parquet as pq
+    table = pq.read_table(path)
+    latbins = json.loads(table.schema.metadata[PARQUET_METADATA_KEY].decode('utf-8'))
+    statsdf = table.to_pandas()
+    return statsdf,latbins['delta_lat'],latbins['max_lat']
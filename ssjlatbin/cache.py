@@ -0,0 +1,101 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import os
+import hashlib
+from collections import OrderedDict
+
+from ssjlatbin.io import config_hash
+
+#Increment when the contents of the dataframe read from an SSJ file
+#change, so Parquet files cached by older versions are not used
+REDUCED_CACHE_VERSION = 1
+
+class SSJDayCache(object):
+    """Least recently used cache of the dataframes read from SSJ files
+    (one spacecraft day each), with a bound on the total memory used
+    by the cached dataframes.
+
+    Cached dataframes are shared with the caller, and must not be 
+    modified in place"""
+
+    def __init__(self,max_bytes=512*1024**2):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._dfs = OrderedDict()
+        self._df_nbytes = {}
+
+    @staticmethod
+    def key(ssjfn,config):
+        """Cache key for a file, which changes if the file is modified
+        or the configuration used to read it changes"""
+        stat = os.stat(ssjfn)
+        return (os.path.abspath(ssjfn),stat.st_mtime_ns,stat.st_size,config_hash(config))
+
+    def __len__(self):
+        return len(self._dfs)
+
+    def __contains__(self,key):
+        return key in self._dfs
+
+    def get(self,key):
+        """Get a cached dataframe (marking it most recently used),
+        or None if it is not cached"""
+        if key not in self._dfs:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._dfs.move_to_end(key)
+        return self._dfs[key]
+
+    def put(self,key,df):
+        """Cache a dataframe, evicting least recently used dataframes 
+        until the cache fits in max_bytes. Dataframes larger than
+        max_bytes are not cached"""
+        df_nbytes = int(df.memory_usage(deep=True).sum())
+        if df_nbytes > self.max_bytes:
+            return
+        if key in self._dfs:
+            self.evict(key)
+        while self._dfs and self.nbytes+df_nbytes > self.max_bytes:
+            self.evict(next(iter(self._dfs)))
+        self._dfs[key] = df
+        self._df_nbytes[key] = df_nbytes
+        self.nbytes += df_nbytes
+
+    def evict(self,key):
+        del self._dfs[key]
+        self.nbytes -= self._df_nbytes.pop(key)
+
+    def clear(self):
+        self._dfs.clear()
+        self._df_nbytes.clear()
+        self.nbytes = 0
+
+def reduced_cache_path(ssjfn,config):
+    """Path of the Parquet file which caches the dataframe read from SSJ file
+    ssjfn, in the [io] reduced_cache_dir directory (None if that is not set). 
+    The name includes a hash of the source file's path, size and modification 
+    time and of the configuration used to read it, so a cached dataframe
+    is never used after any of those change"""
+    cache_dir = config['io'].get('reduced_cache_dir')
+    if not cache_dir:
+        return None
+    stat = os.stat(ssjfn)
+    key = '{}|{}|{}|{}|{}'.format(REDUCED_CACHE_VERSION,
+                                  os.path.abspath(ssjfn),
+                                  stat.st_size,
+                                  stat.st_mtime_ns,
+                                  config_hash(config))
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    basename = os.path.splitext(os.path.basename(ssjfn))[0]
+    return os.path.join(cache_dir,'{}_{}.parquet'.format(basename,key_hash[:16]))
+
+def write_reduced_cache(ssjdf,cachefn):
+    """Write a dataframe read from an SSJ file to its Parquet cache file,
+    via a temporary file so other processes never read a partial file"""
+    os.makedirs(os.path.dirname(cachefn),exist_ok=True)
+    tmpfn = '{}.{}.tmp'.format(cachefn,os.getpid())
+    ssjdf.to_parquet(tmpfn)
+    os.replace(tmpfn,cachefn)
@@ -4,99 +4,152 @@
 import numpy as np
 import pandas as pd
 import datetime,os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from ssjlatbin.io import ssjfn
-from ssjlatbin.fluxcalculations import integrate_flux
-from ssjlatbin.tools import median_date,derivative
+from ssjlatbin.fileindex import available_days
+from ssjlatbin.fluxcalculations import integrate_fluxes
+from ssjlatbin.tools import median_date,derivative,datetime64arr2jd,equator_crossings
+from ssjlatbin.cache import SSJDayCache,reduced_cache_path,write_reduced_cache
 
-from functools import partial
-from pycdflib.cdf import ReadOnlyCDF
-from ssjlatbin.netcdf import ReadOnlyConvertedNC
+from ssjlatbin.reader import open_ssj_file,LazySSJFile
+from ssjlatbin.solar import solar_zenith_angle
+from ssjlatbin.metrics import get_metrics,timed,LazyLogger
+
+log = LazyLogger('cdf')
 
-from geospacepy.satplottools import simple_passes
-from geospacepy.sun import solar_zenith_angle
-from geospacepy.special_datetime import datetimearr2jd
 
 def _define_ssj_dataframe_contents(config):
     #Define variables to load from CDF/netCDF into dataframe which are already 1D
-    dataframevar_to_filevar = config['dataframevar_to_filevar']
+    dataframevar_to_filevar = dict(config['dataframevar_to_filevar'])
 
     soft_channels = config['soft_channels']
     hard_channels = config['hard_channels']
     all_channels = config['all_channels']
 
-    #Define functions for getting total particle flux
-    #from channel-by-channel flux
-    totaling_functions = {}
+    #Define the integrated fluxes to calculate from
+    #channel-by-channel flux
+    channel_sets = {}
     for channels,key in [(soft_channels,'soft'),(hard_channels,'hard'),(all_channels,'total')]:
         for fluxtype in ['energy','number']:
-            totaling_functions[key+'_'+fluxtype] = partial(integrate_flux,
-                                                            channels=channels,
-                                                            energy_or_number=fluxtype)
+            channel_sets[key+'_'+fluxtype] = (channels,fluxtype)
 
-    #Define variables which are not 1D in the CDF/netCDF, along with a function that makes them 1D
-    #so they can be added to the dataframe
-    #(in this case the variables are [n_times x 19] and the function integrates along some or all of the 19 columns)
+    #Define variables which are not 1D in the CDF/netCDF, along with the dataframe
+    #variables which are calculated from them
+    #(in this case the variables are [n_times x 19] and the dataframe variables
+    #are integrals along some or all of the 19 columns)
+    diff_flux_filevar_to_dataframevars = {}
     for diff_flux_var,key in [('ELE_DIFF_ENERGY_FLUX','ele'),('ION_DIFF_ENERGY_FLUX','ion')]:
-        for func_key,totalling_func in totaling_functions.items(): 
-            dataframevar_to_filevar[key+'_'+func_key] = (diff_flux_var,totalling_func) 
-    return dataframevar_to_filevar
+        diff_flux_filevar_to_dataframevars[diff_flux_var] = {key+'_'+func_key:channel_set 
+                                                for func_key,channel_set in channel_sets.items()}
+    return dataframevar_to_filevar,diff_flux_filevar_to_dataframevars
 
 def _read_ssj_file(ssjfn,config):
-    """Read one spacecraft day of DMSP SSJ data into a dataframe"""
-    startdt = datetime.datetime.now()
+    """Read one spacecraft day of DMSP SSJ data into a dataframe.
+    If the [io] reduced_cache_dir setting is set, the dataframe is cached
+    there as Parquet and later reads of the same (unchanged) file with the 
+    same configuration load it from there instead"""
+    cachefn = reduced_cache_path(ssjfn,config)
+    if cachefn is not None and os.path.exists(cachefn):
+        get_metrics().count('reduced_cache_hits')
+        return pd.read_parquet(cachefn)
+    ssjdf = _reduce_ssj_file(ssjfn,config)
+    if cachefn is not None:
+        write_reduced_cache(ssjdf,cachefn)
+    return ssjdf
 
-    dataframevar_to_filevar = _define_ssj_dataframe_contents(config)
-    
+def _uncertainty_tolerance(config):
     if 'uncertainty_tolerance' not in config['calculation']:
-        uncertainty_tolerance = None
         print(config['calculation'])
-    else:
-        uncertainty_tolerance = config['calculation']['uncertainty_tolerance']
+        return None
+    return config['calculation']['uncertainty_tolerance']
 
-    ext = os.path.splitext(ssjfn)[-1]
-    if ext == '.nc':
-        file = ReadOnlyConvertedNC(ssjfn)
-    elif ext == '.cdf':
-        file = ReadOnlyCDF(ssjfn)
-    else:
-        raise ValueError('Unexpected file extension {}'.format(ext))
-
-    #read timestamps
-    dts=file['Epoch']
-    #read variables
-    data = {}
-    for dfvar,filevar_or_tup in dataframevar_to_filevar.items():
-        if isinstance(filevar_or_tup,tuple):
-            filevar = filevar_or_tup[0]
-            to_1D_func = filevar_or_tup[1]
+def ssj_dataframe(dts,data,read_diff_flux,config):
+    """Dataframe of SSJ data indexed by the times dts, with the 1D variables
+    in data (dict of dataframe variable name to array), the integrated fluxes
+    and the solar zenith angle. read_diff_flux(filevar,channels) returns
+    the columns channels of a 2D file variable (ELE_DIFF_ENERGY_FLUX, 
+    ION_DIFF_ENERGY_FLUX or their _STD uncertainties)"""
+    metrics = get_metrics()
+    dataframevar_to_filevar,diff_flux_filevar_to_dataframevars = _define_ssj_dataframe_contents(config)
+    uncertainty_tolerance = _uncertainty_tolerance(config)
+    data = dict(data)
+
+    #read the channels which are used from each differential flux 
+    #variable and calculate all integrated fluxes from it together
+    for filevar,dfvar_to_channel_set in diff_flux_filevar_to_dataframevars.items():
+        channel_sets = list(dfvar_to_channel_set.values())
+        channels = sorted(set(c for channels,fluxtype in channel_sets for c in channels))
+        with metrics.timer('read'):
+            diff_flux = read_diff_flux(filevar,channels)
             if uncertainty_tolerance is None: #No uncertainty filtering
-                data[dfvar]=to_1D_func(file[filevar])
+                diff_flux_rel_uncert = None
             else:
-                data[dfvar]=to_1D_func(file[filevar],
-                                        diff_flux_rel_uncert=file[filevar+'_STD'],
-                                        uncertainty_tolerance=uncertainty_tolerance)
-        else:
-            filevar = filevar_or_tup
-            data[dfvar]=file[filevar]
+                diff_flux_rel_uncert = read_diff_flux(filevar+'_STD',channels)
+        integral_fluxes = integrate_fluxes(diff_flux,
+                                           channel_sets,
+                                           diff_flux_rel_uncert=diff_flux_rel_uncert,
+                                           uncertainty_tolerance=uncertainty_tolerance,
+                                           channel_numbers=channels)
+        for k,dfvar in enumerate(dfvar_to_channel_set):
+            data[dfvar]=integral_fluxes[:,k]
 
     data['time']=dts
-    data['solar_zenith_angle']=np.degrees(solar_zenith_angle(datetimearr2jd(dts),
-                                                    data['glats'],
-                                                    data['glons']))
-    ssjdf = pd.DataFrame(data,index=dts)
+    sza_cadence_s = config['calculation'].get('solar_zenith_angle_cadence_s',0)
+    with metrics.timer('solar_zenith_angle'):
+        data['solar_zenith_angle']=np.degrees(solar_zenith_angle(datetime64arr2jd(dts),
+                                                        data['glats'],
+                                                        data['glons'],
+                                                        cadence_s=sza_cadence_s))
+    return pd.DataFrame(data,index=dts)
+
+def _reduce_ssj_file(ssjfn,config):
+    """Read one spacecraft day of DMSP SSJ data from the CDF or netCDF
+    file into a dataframe, calculating the integrated fluxes"""
+    metrics = get_metrics()
+    startdt = datetime.datetime.now()
+
+    dataframevar_to_filevar,diff_flux_filevar_to_dataframevars = _define_ssj_dataframe_contents(config)
+
+    #Only the variables needed for the dataframe are read, each only once
+    file = LazySSJFile(open_ssj_file(ssjfn),float32=config['io'].get('read_float32',False))
+
+    with metrics.timer('read'):
+        #read timestamps
+        dts=file['Epoch']
+        #read variables
+        data = {}
+        for dfvar,filevar in dataframevar_to_filevar.items():
+            data[dfvar]=file[filevar]
+    metrics.count('files_read')
+    metrics.count('samples_read',len(dts))
+
+    ssjdf = ssj_dataframe(dts,data,lambda filevar,channels: file.read(filevar,channels=channels),config)
     
     enddt = datetime.datetime.now()
     deltat = (enddt-startdt).total_seconds()
-    print('Read {} took {} seconds'.format(ssjfn,deltat))
+    log.debug('Read {} took {} seconds'.format(ssjfn,deltat))
+    return ssjdf
+
+def _read_ssj_file_cached(ssjfn,config,cache=None):
+    """Read one spacecraft day of DMSP SSJ data into a dataframe,
+    or get it from cache (an SSJDayCache) if it has already been read"""
+    if cache is None:
+        return _read_ssj_file(ssjfn,config)
+    key = cache.key(ssjfn,config)
+    ssjdf = cache.get(key)
+    if ssjdf is None:
+        ssjdf = _read_ssj_file(ssjfn,config)
+        cache.put(key,ssjdf)
     return ssjdf
 
-def _read_current_previous_next_ssj_files(prevfn,currfn,nextfn,config):
+def _read_current_previous_next_ssj_files(prevfn,currfn,nextfn,config,cache=None):
     """Read three consecutive spacecraft-days of data"""
 
-    prevdf = _read_ssj_file(prevfn,config)
-    currdf = _read_ssj_file(currfn,config)
-    nextdf = _read_ssj_file(nextfn,config)
+    prevdf = _read_ssj_file_cached(prevfn,config,cache=cache)
+    currdf = _read_ssj_file_cached(currfn,config,cache=cache)
+    nextdf = _read_ssj_file_cached(nextfn,config,cache=cache)
         
     if median_date(prevdf) != median_date(currdf)-datetime.timedelta(days=1):
         raise ValueError('Date of {} != date of {} - 1 day'.format(prevfn,
@@ -109,45 +162,101 @@ def _read_current_previous_next_ssj_files(prevfn,currfn,nextfn,config):
     return ssjdf
 
 
-def _number_orbits(df,reference_date,latvar):
+@timed('number_orbits')
+def _number_orbits(df,reference_date,latvar,return_state=False,direction=None):
     """Find all equator crossings using latitudes in dataframe column latvar,
     marking each orbit with a integer, with orbit 0 being the first orbit
-    ending after 00:00 UT of date refrence_date."""
+    ending after 00:00 UT of date refrence_date. 
+    Orbits start at equator crossings into the hemisphere direction
+    ('north' or 'south'), or by default whichever type of crossing happens first.
+    If return_state, also return the state needed to continue 
+    the numbering with _extend_orbit_numbers"""
     lats = df[latvar].values
-    eqxinginds = simple_passes(lats,half_or_full_orbit='full')
+    entered_north,entered_south = equator_crossings(lats)
+    if direction is None:
+        if len(entered_south)==0 or (len(entered_north)>0 and entered_north[0]<entered_south[0]):
+            direction = 'north'
+        else:
+            direction = 'south'
+    eqxinginds = entered_north if direction=='north' else entered_south
     if isinstance(reference_date,datetime.datetime):
         refdate = reference_date.date()
     else:
         refdate = reference_date
 
+    #Find the first sample on the reference date which is in an orbit
+    #(between the first and last equator crossings)
     xing_zero = None
-    for ixing,(ind_st,ind_ed) in enumerate(zip(eqxinginds[:-1],eqxinginds[1:])):
-        xing_dates = df.iloc[ind_st:ind_ed].index.date
-        if np.any([xing_date==refdate for xing_date in xing_dates]):
-            xing_zero = ixing
-            break
+    if len(eqxinginds)>1:
+        first_ind,last_ind = eqxinginds[0],eqxinginds[-1]
+        times = df.index.values
+        refday_start = np.datetime64(refdate,'D')
+        refday_end = refday_start+np.timedelta64(1,'D')
+        if df.index.is_monotonic_increasing:
+            ind = max(np.searchsorted(times,refday_start,side='left'),first_ind)
+            on_refdate = ind<last_ind and times[ind]<refday_end
+        else:
+            in_orbit_on_refdate = np.logical_and(times[first_ind:last_ind]>=refday_start,
+                                                 times[first_ind:last_ind]<refday_end)
+            ind = first_ind+np.argmax(in_orbit_on_refdate)
+            on_refdate = np.any(in_orbit_on_refdate)
+        if on_refdate:
+            xing_zero = np.searchsorted(eqxinginds,ind,side='right')-1
     if xing_zero is None:
         raise RuntimeError(('No data on {}'.format(reference_date)
                             +'in dataframe with dates {}'.format(df.index)))
     
-    orbit_number = np.full_like(lats,np.nan)
-    for ixing,(ind_st,ind_ed) in enumerate(zip(eqxinginds[:-1],eqxinginds[1:])):
-        orbit_number[ind_st:ind_ed] = ixing-xing_zero
+    orbit_number = np.full(lats.shape,np.nan)
+    orbit_number[eqxinginds[0]:eqxinginds[-1]] = np.repeat(np.arange(len(eqxinginds)-1)-xing_zero,
+                                                           np.diff(eqxinginds))
 
+    if return_state:
+        return orbit_number,_orbit_numbering_state(lats,orbit_number,direction)
     return orbit_number
 
+def _orbit_numbering_state(lats,orbit_number,direction):
+    """The latitude and orbit number of the last sample, and the direction of 
+    the equator crossing that starts an orbit ('north' or 'south'). Samples
+    after the last crossing have NaN orbit number but are in the next orbit"""
+    last_orbit_number = orbit_number[-1]
+    if np.isnan(last_orbit_number):
+        last_orbit_number = np.nanmax(orbit_number)+1
+    return {'lat':float(lats[-1]),
+            'orbit_number':float(last_orbit_number),
+            'direction':direction}
+
+@timed('number_orbits')
+def _extend_orbit_numbers(df,latvar,state):
+    """Number the orbits of df, which is the data immediately following
+    (in time) data numbered by _number_orbits or a previous call of this function,
+    using only the state returned by that call rather than re-scanning the 
+    earlier data. Unlike _number_orbits, samples after the last equator 
+    crossing get the number of the (incomplete) orbit they are in.
+    Returns the orbit numbers and the new state"""
+    lats = df[latvar].values
+    if len(lats)==0:
+        return np.full(lats.shape,np.nan),state
+    entered_north,entered_south = equator_crossings(lats,previous_lat=state['lat'])
+    eqxinginds = entered_north if state['direction']=='north' else entered_south
+    new_orbit = np.zeros(lats.shape,dtype=np.int64)
+    new_orbit[eqxinginds] = 1
+    orbit_number = state['orbit_number']+np.cumsum(new_orbit)
+    return orbit_number,_orbit_numbering_state(lats,orbit_number,state['direction'])
+
 def _orbit_start_time(df):
     """Get a Series of the same length as the original data frame df.
     which has the first value from the time index for each orbit"""
     return df.groupby('orbit_number')['time'].transform('min')
 
-def get_orbit_numbered_ssj_dataframe(dmsp_number,dt,config):
+def get_orbit_numbered_ssj_dataframe(dmsp_number,dt,config,cache=None):
     """Get a dataframe of the SSJ data for one day, but ensuring the full orbit's data
-    from the first and last orbits of the day is present from the previous and next days' data"""
+    from the first and last orbits of the day is present from the previous and next days' data.
+    If cache (an SSJDayCache) is passed, files which were already read for
+    another day are not read again"""
     prevfn = ssjfn(dmsp_number,dt-datetime.timedelta(days=1),config)
     currfn = ssjfn(dmsp_number,dt,config)
     nextfn = ssjfn(dmsp_number,dt+datetime.timedelta(days=1),config)
-    df = _read_current_previous_next_ssj_files(prevfn,currfn,nextfn,config)
+    df = _read_current_previous_next_ssj_files(prevfn,currfn,nextfn,config,cache=cache)
     df['orbit_number'] = _number_orbits(df,dt,'glats')
     df['orbit_start_time'] = _orbit_start_time(df)
     df['dglats'] = derivative(df['glats'].values)
@@ -158,20 +267,62 @@ def get_orbit_numbered_ssj_dataframe(dmsp_number,dt,config):
                                          df['orbit_number']<=np.nanmax(day_orbits))
     return df[on_day_whole_orbits].dropna().sort_index()
 
-def get_orbit_numbered_ssj_range_dataframe(dmsp_number,dt_start,dt_end,config):
-    """Get a dataframe of SSJ data for an arbitrary continuous time range"""
-    dt = dt_start-datetime.timedelta(days=1)
-    dfs = []
-    while dt<dt_end:
+def iter_orbit_numbered_ssj_dataframes(dmsp_number,dt_start,dt_end,config,cache=None):
+    """Generate (date,dataframe) for each day from dt_start up to (not including) dt_end,
+    with the dataframe as from get_orbit_numbered_ssj_dataframe.
+    Each file is read only once because the previous, current and next
+    days' data are kept in an SSJDayCache (sized by the [io] day_cache_max_mb
+    setting if cache is not passed). Only days with a file are generated,
+    and days where the file for an adjacent day is missing are skipped"""
+    if cache is None:
+        max_mb = config['io'].get('day_cache_max_mb',512)
+        cache = SSJDayCache(max_bytes=max_mb*1024**2)
+    for date in available_days(dmsp_number,config,dt_start,dt_end):
+        dt = datetime.datetime.combine(date,datetime.time())
         try:
-            dfs.append(_read_ssj_file(ssjfn(dmsp_number,dt,config),config))
+            yield dt,get_orbit_numbered_ssj_dataframe(dmsp_number,dt,config,cache=cache)
         except IOError:
-            print(f'File not found for date {dt}')
-        dt+=datetime.timedelta(days=1)
+            print(f'File not found for date adjacent to {dt}')
+
+def _read_ssj_day(dmsp_number,dt,config):
+    """Read one spacecraft day of DMSP SSJ data, returning None
+    if the file is not found"""
+    try:
+        return _read_ssj_file(ssjfn(dmsp_number,dt,config),config)
+    except IOError:
+        print(f'File not found for date {dt}')
+        return None
+
+def _read_ssj_days(dmsp_number,dts,config):
+    """Read several spacecraft days of DMSP SSJ data, in a pool of 
+    processes if the [io] n_workers setting is greater than one. Returns a
+    list of dataframes in the same order as dts (None where the file 
+    was not found)
+
+    Processes are used rather than threads because the HDF5 library
+    under netCDF4 is not thread safe"""
+    n_workers = config['io'].get('n_workers',1)
+    if n_workers <= 1:
+        return [_read_ssj_day(dmsp_number,dt,config) for dt in dts]
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        #map returns results in the order of dts
+        return list(executor.map(_read_ssj_day,repeat(dmsp_number),dts,repeat(config)))
+
+def get_orbit_numbered_ssj_range_dataframe(dmsp_number,dt_start,dt_end,config,direction=None):
+    """Get a dataframe of SSJ data for an arbitrary continuous time range
+    (reading only the days which have a file). Orbits start at equator
+    crossings into the hemisphere direction ('north' or 'south'), by default
+    whichever type of crossing is first; pass manifest.ORBIT_DIRECTION for
+    the same orbits as the Parquet dataset"""
+    dts = [datetime.datetime.combine(date,datetime.time()) 
+            for date in available_days(dmsp_number,config,
+                                       dt_start-datetime.timedelta(days=1),dt_end)]
+
+    dfs = [df for df in _read_ssj_days(dmsp_number,dts,config) if df is not None]
         
     df = pd.concat(dfs)
-    df['orbit_number'] = _number_orbits(df,dt_start,'glats')
+    df['orbit_number'] = _number_orbits(df,dt_start,'glats',direction=direction)
     df['orbit_start_time'] = _orbit_start_time(df)
     df['dglats'] = derivative(df['glats'].values)
     return df.dropna().sort_index()
-
@@ -0,0 +1,194 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Build the latitude binned SSJ dataset for several spacecraft and a date range.
+
+Orbits start at equator crossings into one hemisphere (--direction, north
+by default) so the orbits of separately processed chunks line up. The
+notebooks' cdf.get_orbit_numbered_ssj_range_dataframe starts orbits at
+whichever type of crossing comes first unless it is passed the same
+direction, so its orbits can be half an orbit out from the dataset's"""
+import argparse
+import datetime,os,sys,time
+import traceback
+from concurrent.futures import ProcessPoolExecutor,as_completed
+
+import numpy as np
+
+from ssjlatbin.io import read_config
+from ssjlatbin.pipeline import write_latbinned_parquet
+from ssjlatbin.manifest import update_latbinned_parquet,_shift_orbit_numbers,ORBIT_DIRECTION
+from ssjlatbin.metrics import Metrics,enable_metrics
+
+def work_units(dmsp_numbers,dt_start,dt_end,chunk_days):
+    """Split the build into (dmsp_number,chunk_start,chunk_end) units,
+    with chunks of chunk_days days (or the whole range if chunk_days is None)"""
+    units = []
+    for dmsp_number in dmsp_numbers:
+        chunk_start = dt_start
+        while chunk_start<dt_end:
+            if chunk_days is None:
+                chunk_end = dt_end
+            else:
+                chunk_end = min(chunk_start+datetime.timedelta(days=chunk_days),dt_end)
+            units.append((dmsp_number,chunk_start,chunk_end))
+            chunk_start = chunk_end
+    return units
+
+def _orbit_number_range(paths):
+    """First and last orbit numbers in latitude binned Parquet files,
+    or None if there are no files"""
+    import pyarrow.parquet as pq
+    if not paths:
+        return None
+    orbit_numbers = np.concatenate([pq.read_table(path,columns=['orbit_number'])['orbit_number'].to_numpy()
+                                    for path in paths])
+    return float(orbit_numbers.min()),float(orbit_numbers.max())
+
+def _build_unit(dmsp_number,chunk_start,chunk_end,config,incremental,direction=ORBIT_DIRECTION,
+                collect_metrics=False):
+    """Write the Parquet files for one unit, returning the files written,
+    the first and last orbit numbers in them, the time taken and the metrics
+    of the unit (as from Metrics.as_dict)"""
+    metrics = enable_metrics(collect_metrics)
+    metrics.reset()
+    t0 = time.perf_counter()
+    if incremental:
+        paths = update_latbinned_parquet(dmsp_number,chunk_start,chunk_end,config)
+    else:
+        #All chunks start orbits at the same type of equator crossing
+        #so the orbits either side of chunk boundaries match
+        paths = write_latbinned_parquet(dmsp_number,chunk_start,chunk_end,config,
+                                        direction=direction)
+    return paths,_orbit_number_range(paths),time.perf_counter()-t0,metrics.as_dict()
+
+def _shift_unit(paths,shift):
+    for path in paths:
+        _shift_orbit_numbers(path,shift)
+
+def chunk_orbit_number_shifts(unit_orbit_numbers,failed_units=()):
+    """Shift for the orbit numbers of each unit (dict of (dmsp_number,chunk_start,chunk_end)
+    to the first and last orbit numbers written, or None) so they continue
+    from the previous chunk of the same spacecraft, as in a build of the
+    whole range at once. Each chunk numbers its orbits from its own start.
+    The orbits of a unit in failed_units are not known, so the chunks of
+    its spacecraft after it are not shifted (and keep their own numbering)"""
+    shifts = {}
+    last_orbit_numbers = {}
+    stopped = set()
+    for unit in sorted(list(unit_orbit_numbers)+list(failed_units)):
+        dmsp_number = unit[0]
+        if unit in failed_units:
+            stopped.add(dmsp_number)
+        if dmsp_number in stopped or unit_orbit_numbers[unit] is None:
+            continue
+        first,last = unit_orbit_numbers[unit]
+        shift = 0.
+        if dmsp_number in last_orbit_numbers:
+            shift = last_orbit_numbers[dmsp_number]+1.-first
+        shifts[unit] = shift
+        last_orbit_numbers[dmsp_number] = last+shift
+    return shifts
+
+def _parse_date(datestr):
+    return datetime.datetime.strptime(datestr,'%Y-%m-%d')
+
+def _parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('config',
+                        help='Configuration TOML file (like scripts/default_config.toml)')
+    parser.add_argument('start',type=_parse_date,
+                        help='First day of orbits to bin (YYYY-MM-DD)')
+    parser.add_argument('end',type=_parse_date,
+                        help='Day after the last day of orbits to bin (YYYY-MM-DD)')
+    parser.add_argument('--spacecraft',type=int,nargs='+',default=[13,14,15,16,17,18],
+                        help='DMSP numbers (default 13 to 18)')
+    parser.add_argument('--chunk_days',type=int,default=30,
+                        help='Days in each unit of work (default 30)')
+    parser.add_argument('--processes',type=int,default=os.cpu_count(),
+                        help='Number of units processed at once (default number of CPUs)')
+    parser.add_argument('--output',default=None,
+                        help='Output directory (default [io] parquet_root_dir)')
+    parser.add_argument('--metrics',default=None,
+                        help=('Collect timings and counts of each processing stage and '
+                              +'write them to this file in the Prometheus text format'))
+    parser.add_argument('--incremental',action='store_true',
+                        help=('Only process new or changed days, using the manifest in the '
+                              +'output directory (each spacecraft is one unit of work)'))
+    parser.add_argument('--direction',choices=['north','south'],default=ORBIT_DIRECTION,
+                        help=('Start orbits at equator crossings into this hemisphere '
+                              +'(default {}, the only choice with --incremental)'.format(ORBIT_DIRECTION)))
+    return parser
+
+def main(argv=None):
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.incremental and args.direction != ORBIT_DIRECTION:
+        parser.error('--incremental datasets start orbits at {} crossings'.format(ORBIT_DIRECTION))
+    config = read_config(args.config)
+    if args.output is not None:
+        config['io']['parquet_root_dir'] = args.output
+    #Each unit is already run in its own process
+    config['io']['n_workers'] = 1
+
+    #The manifest makes the orbits straddling chunk boundaries consistent
+    #only when the days either side are processed by the same call
+    chunk_days = None if args.incremental else args.chunk_days
+    units = work_units(args.spacecraft,args.start,args.end,chunk_days)
+    print('Building {} units for DMSP F{} from {} to {} with {} processes'.format(
+            len(units),','.join([str(n) for n in args.spacecraft]),
+            args.start.date(),args.end.date(),args.processes))
+
+    t0 = time.perf_counter()
+    n_done,n_files,failed = 0,0,[]
+    unit_paths,unit_orbit_numbers,failed_units = {},{},set()
+    collect_metrics = args.metrics is not None
+    run_metrics = Metrics(enabled=True)
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {executor.submit(_build_unit,dmsp_number,chunk_start,chunk_end,
+                                   config,args.incremental,direction=args.direction,
+                                   collect_metrics=collect_metrics):(dmsp_number,chunk_start,chunk_end)
+                    for dmsp_number,chunk_start,chunk_end in units}
+        for future in as_completed(futures):
+            dmsp_number,chunk_start,chunk_end = futures[future]
+            n_done+=1
+            unit_str = 'F{:02d} {} to {}'.format(dmsp_number,chunk_start.date(),chunk_end.date())
+            try:
+                paths,orbit_numbers,unit_time,unit_metrics = future.result()
+            except Exception:
+                failed.append(unit_str)
+                failed_units.add(futures[future])
+                print('[{}/{}] {} failed:\n{}'.format(n_done,len(units),unit_str,
+                                                      traceback.format_exc()))
+                continue
+            n_files+=len(paths)
+            unit_paths[futures[future]] = paths
+            unit_orbit_numbers[futures[future]] = orbit_numbers
+            run_metrics.merge(unit_metrics)
+            print('[{}/{}] {}: {} files in {:.1f} s ({:.1f} s elapsed)'.format(n_done,len(units),
+                                                                              unit_str,len(paths),
+                                                                              unit_time,
+                                                                              time.perf_counter()-t0))
+
+        #Number the orbits of the whole range consecutively
+        #(the manifest already does this for incremental builds)
+        if not args.incremental:
+            shifts = chunk_orbit_number_shifts(unit_orbit_numbers,failed_units)
+            for dmsp_number in sorted(set([unit[0] for unit in failed_units])):
+                print(('Chunks of F{:02d} after its first failed unit were not renumbered '.format(dmsp_number)
+                       +'(each numbers its orbits from its own start)'))
+            renumbered = [executor.submit(_shift_unit,unit_paths[unit],shift)
+                            for unit,shift in shifts.items() if shift != 0.]
+            for future in renumbered:
+                future.result()
+
+    print('Wrote {} files in {:.1f} s'.format(n_files,time.perf_counter()-t0))
+    if collect_metrics:
+        print(run_metrics.summary())
+        run_metrics.write_prometheus(args.metrics)
+    if failed:
+        print('{} units failed: {}'.format(len(failed),', '.join(failed)))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,124 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Load parts of the latitude binned Parquet dataset (as written by
+pipeline.write_latbinned_parquet) without reading all of it: only the
+spacecraft and year directories, files and row groups which can match
+the time range and latitude bins requested are read"""
+import datetime,glob,os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from ssjlatbin.io import dataframe_to_latbinned_flux
+from ssjlatbin.latbin_pandas import latbin_categories
+
+def latbinned_dataset(config):
+    """Arrow dataset of the files under [io] parquet_root_dir, with
+    dmsp_number and year columns from the directory names"""
+    root_dir = config['io']['parquet_root_dir']
+    #Listing the files skips the manifest and partly written (.tmp) files
+    paths = sorted(glob.glob(os.path.join(root_dir,'dmsp_number=*','year=*','*.parquet')))
+    return ds.dataset(paths,format='parquet',partitioning='hive',partition_base_dir=root_dir)
+
+def latbinned_filter(dt_start=None,dt_end=None,dmsp_numbers=None,dawn_dusk=None,
+                     hemisphere=None,min_abs_lat=None,max_abs_lat=None,latbins=None):
+    """Filter expression selecting the orbits which start from dt_start up to
+    (not including) dt_end, of the spacecraft dmsp_numbers, in the latitude
+    bins on the dawn_dusk side ('dawn' or 'dusk') of hemisphere ('N' or 'S')
+    with absolute center latitude between min_abs_lat and max_abs_lat, and
+    with labels in latbins. None selects everything"""
+    conditions = []
+    if dt_start is not None:
+        conditions.append(ds.field('year')>=pd.Timestamp(dt_start).year)
+        conditions.append(ds.field('orbit_start_time')>=pa.scalar(pd.Timestamp(dt_start).to_pydatetime()))
+    if dt_end is not None:
+        conditions.append(ds.field('year')<=(pd.Timestamp(dt_end)-datetime.timedelta(microseconds=1)).year)
+        conditions.append(ds.field('orbit_start_time')<pa.scalar(pd.Timestamp(dt_end).to_pydatetime()))
+    if dmsp_numbers is not None:
+        conditions.append(ds.field('dmsp_number').isin(list(np.atleast_1d(dmsp_numbers))))
+    if dawn_dusk is not None:
+        if dawn_dusk not in ['dawn','dusk']:
+            raise ValueError('Invalid dawn_dusk {} (dawn or dusk)'.format(dawn_dusk))
+        conditions.append(ds.field('dawn_dusk')==(1 if dawn_dusk=='dawn' else -1))
+    if hemisphere is not None:
+        if hemisphere not in ['N','S']:
+            raise ValueError('Invalid hemisphere {} (N or S)'.format(hemisphere))
+        conditions.append(ds.field('bin_lat')>0 if hemisphere=='N' else ds.field('bin_lat')<0)
+    if min_abs_lat is not None:
+        conditions.append((ds.field('bin_lat')>=min_abs_lat) | (ds.field('bin_lat')<=-min_abs_lat))
+    if max_abs_lat is not None:
+        conditions.append((ds.field('bin_lat')<=max_abs_lat) & (ds.field('bin_lat')>=-max_abs_lat))
+    if latbins is not None:
+        #Select on the columns with row group statistics rather than the labels
+        latbin_conditions = []
+        for latbin in latbins:
+            dawn_dusk_,latstr = latbin.split('_')
+            latbin_conditions.append((ds.field('bin_lat')==float(latstr))
+                                     & (ds.field('dawn_dusk')==(1 if dawn_dusk_=='dawn' else -1)))
+        condition = latbin_conditions[0]
+        for latbin_condition in latbin_conditions[1:]:
+            condition = condition | latbin_condition
+        conditions.append(condition)
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+def load_latbinned(config,dt_start=None,dt_end=None,dmsp_numbers=None,variables=None,
+                   dawn_dusk=None,hemisphere=None,min_abs_lat=None,max_abs_lat=None,latbins=None):
+    """Read the latitude binned orbits selected as in latbinned_filter
+    (e.g. dawn_dusk='dawn',min_abs_lat=60 for only the dawn bins above 60
+    degrees), reading only the columns variables (by default all of them).
+    The filters are applied by the Arrow scanner, which skips files and
+    row groups whose statistics show they have no matching rows.
+
+    Returns a dataframe with the orbit_start_time / latitude bin MultiIndex
+    and columns of latbin_pandas.bin_by_latitude (the latbin categories are
+    those of the [latbin] settings in config), plus a dmsp_number column unless
+    dmsp_numbers is a single number, or None if no rows match"""
+    dataset = latbinned_dataset(config)
+    if len(dataset.files) == 0:
+        return None
+    columns = None
+    if variables is not None:
+        columns = ['orbit_start_time','latbin']+list(variables)
+        if not np.isscalar(dmsp_numbers):
+            columns.append('dmsp_number')
+    expression = latbinned_filter(dt_start=dt_start,dt_end=dt_end,dmsp_numbers=dmsp_numbers,
+                                  dawn_dusk=dawn_dusk,hemisphere=hemisphere,
+                                  min_abs_lat=min_abs_lat,max_abs_lat=max_abs_lat,latbins=latbins)
+    table = dataset.to_table(columns=columns,filter=expression)
+    if table.num_rows == 0:
+        return None
+    df = table.to_pandas(ignore_metadata=True)
+    #The partition column and the columns pipeline._write_parquet adds for filtering
+    df = df.drop(columns=['year','bin_lat','dawn_dusk'],errors='ignore')
+    if np.isscalar(dmsp_numbers):
+        df = df.drop(columns=['dmsp_number'],errors='ignore')
+
+    categories = latbin_categories(config['latbin']['delta_lat'],config['latbin']['max_lat'])
+    latbin = pd.Categorical(np.asarray(df['latbin'],dtype=str),categories=categories,ordered=True)
+    if np.any(latbin.codes<0):
+        raise ValueError(('Latitude bins {} in the dataset are not bins for '.format(np.unique(df['latbin'][latbin.codes<0]))
+                          +'delta_lat {} and max_lat {}'.format(config['latbin']['delta_lat'],
+                                                                config['latbin']['max_lat'])))
+    df['latbin'] = latbin
+    return df.set_index(['orbit_start_time','latbin']).sort_index()
+
+def load_latbinned_flux(config,fluxvar,dt_start=None,dt_end=None,dmsp_number=None,**filters):
+    """Read one flux variable of one spacecraft (see load_latbinned) as the
+    time, latitude and flux arrays of io.dataframe_to_latbinned_flux, with
+    a column for each latitude bin selected by filters"""
+    binneddf = load_latbinned(config,dt_start=dt_start,dt_end=dt_end,dmsp_numbers=dmsp_number,
+                              variables=[fluxvar],**filters)
+    if binneddf is None:
+        return None
+    #Only the selected bins become columns
+    latbins = binneddf.index.get_level_values('latbin').remove_unused_categories()
+    binneddf.index = pd.MultiIndex.from_arrays([binneddf.index.get_level_values('orbit_start_time'),
+                                                latbins],names=['orbit_start_time','latbin'])
+    return dataframe_to_latbinned_flux(binneddf,fluxvar)
@@ -0,0 +1,191 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import os
+import json
+
+import numpy as np
+import pyarrow as pa
+
+from ssjlatbin.io import dataframe_to_latbinned_fluxes
+
+#Rows of the .npy file copied at once when it is assembled
+COPY_CHUNK_ORBITS = 4096
+
+def _feature_format(path):
+    """Output format from the extension of path"""
+    ext = os.path.splitext(path)[1]
+    if ext == '.npy':
+        return 'npy'
+    elif ext in ['.arrow','.feather']:
+        return 'arrow'
+    raise ValueError(f'Unknown feature file extension {ext}, valid options .npy, .arrow or .feather')
+
+def metadata_path(path):
+    """Path of the JSON file with the metadata of a feature file"""
+    return path+'.json'
+
+def orbit_start_time_path(path):
+    """Path of the .npy file with the orbit start times of a .npy feature file"""
+    return os.path.splitext(path)[0]+'_orbit_start_time.npy'
+
+def write_latbinned_features(binneddfs,fluxvars,config,path,float32=True):
+    """Write latitude binned fluxes for ML as an (orbit,bin,variable) array
+    (as from io.dataframe_to_latbinned_fluxes) which can be memory mapped
+    by load_latbinned_features, with the metadata (flux variables,
+    latitude bin centers and dawn/dusk flags) in a JSON file alongside.
+
+    Parameters
+    ----------
+    binneddfs - iterable
+        Latitude binned dataframes of consecutive orbits
+        (e.g. from pipeline.iter_latbinned_orbits, or read from
+        the Parquet dataset), written one at a time
+    fluxvars - list
+        Flux columns to write, in the order of the last axis
+    config - dict
+        Configuration the dataframes were binned with
+    path - str
+        Output file, a NumPy .npy file (with the orbit start times in
+        another .npy file, see orbit_start_time_path) or an Arrow IPC file
+        (.arrow or .feather) with orbit_start_time and features columns
+        and a record batch for each dataframe
+    float32 - bool, optional
+        Write float32 (default) instead of float64 fluxes
+
+    Returns
+    -------
+    metadata - dict
+        The metadata written to the JSON file
+    """
+    fileformat = _feature_format(path)
+    dtype = np.dtype(np.float32 if float32 else np.float64)
+    os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+
+    n_orbits = 0
+    orbit_start_times = []
+    writer = None
+    lats,lats_dawn_dusk_flag = None,None
+    #Every file is written under a temporary name and moved into place once
+    #it is complete, and the temporary files are removed if anything fails
+    npy_tmppath = '{}.{}.npy.tmp'.format(path,os.getpid())
+    t_tmppath = '{}.{}.t.tmp'.format(path,os.getpid())
+    json_tmppath = '{}.{}.json.tmp'.format(path,os.getpid())
+    try:
+        with open(tmppath,'wb') as f:
+            try:
+                for binneddf in binneddfs:
+                    t,lats,lats_dawn_dusk_flag,fluxes = dataframe_to_latbinned_fluxes(binneddf,fluxvars,config,
+                                                                                     float32=float32)
+                    t = np.array(t,dtype='datetime64[ns]')
+                    n_orbits+=len(t)
+                    if fileformat == 'npy':
+                        #Rows are appended to a headerless file, and copied into
+                        #the .npy file once the number of orbits is known
+                        f.write(np.ascontiguousarray(fluxes).tobytes())
+                        orbit_start_times.append(t)
+                    else:
+                        features = pa.FixedSizeListArray.from_arrays(pa.array(fluxes.ravel()),
+                                                                     fluxes.shape[1]*fluxes.shape[2])
+                        batch = pa.record_batch([pa.array(t),features],
+                                                names=['orbit_start_time','features'])
+                        if writer is None:
+                            writer = pa.ipc.new_file(f,batch.schema)
+                        writer.write_batch(batch)
+            finally:
+                if writer is not None:
+                    writer.close()
+        if n_orbits == 0:
+            raise ValueError('No binned orbits to write to {}'.format(path))
+
+        metadata = {'format':fileformat,
+                    'shape':[n_orbits,len(lats),len(fluxvars)],
+                    'dtype':dtype.str,
+                    'fluxvars':list(fluxvars),
+                    'delta_lat':config['latbin']['delta_lat'],
+                    'max_lat':config['latbin']['max_lat'],
+                    'lats':lats.tolist(),
+                    'lats_dawn_dusk_flag':lats_dawn_dusk_flag.tolist()}
+
+        if fileformat == 'npy':
+            features = np.lib.format.open_memmap(npy_tmppath,mode='w+',dtype=dtype,
+                                                 shape=tuple(metadata['shape']))
+            rows = np.memmap(tmppath,dtype=dtype,mode='r',shape=tuple(metadata['shape']))
+            for i_start in range(0,n_orbits,COPY_CHUNK_ORBITS):
+                features[i_start:i_start+COPY_CHUNK_ORBITS] = rows[i_start:i_start+COPY_CHUNK_ORBITS]
+            features.flush()
+            del features,rows
+            with open(t_tmppath,'wb') as f:
+                np.save(f,np.concatenate(orbit_start_times))
+            os.replace(npy_tmppath,path)
+            os.replace(t_tmppath,orbit_start_time_path(path))
+        else:
+            os.replace(tmppath,path)
+
+        with open(json_tmppath,'w') as f:
+            json.dump(metadata,f,indent=1)
+        os.replace(json_tmppath,metadata_path(path))
+    finally:
+        for partial_path in [tmppath,npy_tmppath,t_tmppath,json_tmppath]:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+    return metadata
+
+def _read_metadata(path):
+    with open(metadata_path(path),'r') as f:
+        metadata = json.load(f)
+    metadata['lats'] = np.array(metadata['lats'])
+    metadata['lats_dawn_dusk_flag'] = np.array(metadata['lats_dawn_dusk_flag'])
+    return metadata
+
+def _arrow_batch_arrays(batch,metadata):
+    """Orbit start times and features of a record batch as numpy
+    arrays which share the memory of the batch"""
+    n_orbits,n_bins,n_vars = metadata['shape']
+    features = batch.column('features').values.to_numpy(zero_copy_only=True)
+    t = batch.column('orbit_start_time').to_numpy(zero_copy_only=True)
+    return t,features.reshape((len(batch),n_bins,n_vars))
+
+def load_latbinned_features(path):
+    """Memory map a file written by write_latbinned_features without
+    reading or copying the features.
+
+    Returns
+    -------
+    t - np.array
+        Orbit start times (datetime64[ns])
+    features - np.array or list
+        For .npy, a read-only memory mapped array of shape (orbits,bins,variables).
+        For Arrow, a list of such arrays, one for each record batch
+        (use np.concatenate to get one array in memory)
+    metadata - dict
+        Metadata from the JSON file, including lats and lats_dawn_dusk_flag arrays
+    """
+    metadata = _read_metadata(path)
+    if metadata['format'] == 'npy':
+        features = np.load(path,mmap_mode='r')
+        t = np.load(orbit_start_time_path(path),mmap_mode='r')
+        return t,features,metadata
+
+    reader = pa.ipc.open_file(pa.memory_map(path,'r'))
+    ts,features = [],[]
+    for i_batch in range(reader.num_record_batches):
+        t,batch_features = _arrow_batch_arrays(reader.get_batch(i_batch),metadata)
+        ts.append(t)
+        features.append(batch_features)
+    t = np.concatenate(ts) if ts else np.array([],dtype='datetime64[ns]')
+    return t,features,metadata
+
+def iter_latbinned_feature_batches(path,batch_size=1024):
+    """Generate (orbit start times, features) of up to batch_size orbits at a
+    time from a file written by write_latbinned_features. The arrays are
+    views of the memory mapped file (batches do not span Arrow record batches)"""
+    t,features,metadata = load_latbinned_features(path)
+    if metadata['format'] == 'npy':
+        features = [features]
+    i_orbit = 0
+    for batch_features in features:
+        for i_start in range(0,len(batch_features),batch_size):
+            batch_t = t[i_orbit+i_start:i_orbit+i_start+batch_size]
+            yield batch_t,batch_features[i_start:i_start+batch_size]
+        i_orbit+=len(batch_features)
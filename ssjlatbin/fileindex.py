@@ -0,0 +1,153 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import datetime,os,re
+import hashlib
+import json
+
+SSJ_FILENAME_REGEX = re.compile(r'^dmsp-f(\d{2})_ssj_precipitating-electrons-ions_'
+                                +r'(\d{4})(\d{2})(\d{2})_v(.+)\.(cdf|nc)$')
+
+FILE_INDEX_VERSION = 1
+DEFAULT_FILE_INDEX_DIR = os.path.join(os.path.expanduser('~'),'.cache','ssjlatbin')
+
+def parse_ssjfn(fname):
+    """Parse an SSJ filename into (dmsp_number,date,version,filetype),
+    or None if it is not an SSJ file"""
+    match = SSJ_FILENAME_REGEX.match(os.path.basename(fname))
+    if match is None:
+        return None
+    dmsp_number,year,month,day,version,filetype = match.groups()
+    return int(dmsp_number),datetime.date(int(year),int(month),int(day)),version,filetype
+
+class SSJFileIndex(object):
+    """Index of the SSJ files under a root directory by
+    (dmsp_number,date,version,filetype), built by one walk of the directory
+    tree. The index is saved to index_path (if not None) with the modification
+    time of every directory, and is only rebuilt when one of them changes
+    (files or subdirectories were added, removed or renamed). index_path
+    must be outside root_dir, since saving the index changes the
+    modification time of the directory it is in"""
+
+    def __init__(self,root_dir,index_path=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.index_path = index_path
+        self.files = {}
+        self.dir_mtimes = {}
+        if not self._load():
+            self.scan()
+
+    def _is_current(self):
+        for dirpath,mtime_ns in self.dir_mtimes.items():
+            try:
+                if os.stat(dirpath).st_mtime_ns != mtime_ns:
+                    return False
+            except OSError:
+                return False
+        return len(self.dir_mtimes)>0
+
+    def _load(self):
+        if self.index_path is None or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path,'r') as f:
+                saved = json.load(f)
+        except (OSError,ValueError):
+            return False
+        if saved.get('version')!=FILE_INDEX_VERSION or saved.get('root_dir')!=self.root_dir:
+            return False
+        self.dir_mtimes = saved['dir_mtimes']
+        if not self._is_current():
+            return False
+        self.files = {}
+        for dmsp_number,datestr,version,filetype,paths in saved['files']:
+            key = (dmsp_number,datetime.date.fromisoformat(datestr),version,filetype)
+            self.files[key] = paths
+        return True
+
+    def _save(self):
+        saved = {'version':FILE_INDEX_VERSION,
+                 'root_dir':self.root_dir,
+                 'dir_mtimes':self.dir_mtimes,
+                 'files':[[dmsp_number,date.isoformat(),version,filetype,paths]
+                            for (dmsp_number,date,version,filetype),paths in self.files.items()]}
+        tmppath = '{}.{}.tmp'.format(self.index_path,os.getpid())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)),exist_ok=True)
+            with open(tmppath,'w') as f:
+                json.dump(saved,f)
+            os.replace(tmppath,self.index_path)
+        except OSError as e:
+            print(f'Could not save SSJ file index to {self.index_path}: {e}')
+
+    def scan(self):
+        """Walk the directory tree, rebuilding the index"""
+        files,dir_mtimes = {},{}
+        for dirpath,dirnames,filenames in os.walk(self.root_dir):
+            dir_mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+            for filename in filenames:
+                key = parse_ssjfn(filename)
+                if key is not None:
+                    files.setdefault(key,[]).append(os.path.join(dirpath,filename))
+        self.files,self.dir_mtimes = files,dir_mtimes
+        if self.index_path is not None:
+            self._save()
+
+    def refresh(self):
+        """Rebuild the index if any directory has changed since it was built"""
+        if not self._is_current():
+            self.scan()
+
+    def paths(self,dmsp_number,date,version,filetype):
+        """All paths of the file for one spacecraft-day"""
+        if isinstance(date,datetime.datetime):
+            date = date.date()
+        return self.files.get((dmsp_number,date,version,filetype),[])
+
+    def available_days(self,dmsp_number,version,filetype,dt_start=None,dt_end=None):
+        """Sorted dates (datetime.date) with a file for a spacecraft,
+        optionally only the days which overlap the time from dt_start
+        up to (not including) dt_end"""
+        if isinstance(dt_start,datetime.datetime):
+            dt_start = dt_start.date()
+        if isinstance(dt_end,datetime.datetime):
+            if dt_end.time()==datetime.time():
+                dt_end = dt_end.date()
+            else:
+                dt_end = dt_end.date()+datetime.timedelta(days=1)
+        return sorted([date for (key_dmsp_number,date,key_version,key_filetype) in self.files
+                        if key_dmsp_number==dmsp_number and key_version==version
+                        and key_filetype==filetype
+                        and (dt_start is None or date>=dt_start)
+                        and (dt_end is None or date<dt_end)])
+
+    def spacecraft(self,version,filetype):
+        """Sorted DMSP numbers with at least one file"""
+        return sorted(set([key_dmsp_number for (key_dmsp_number,date,key_version,key_filetype) in self.files
+                            if key_version==version and key_filetype==filetype]))
+
+_FILE_INDEXES = {}
+
+def get_file_index(config):
+    """The SSJFileIndex of the [io] ssj_{cdf_or_nc}_root_dir directory,
+    shared by all calls in a process. It is saved to [io] file_index_path,
+    or by default a file in ~/.cache/ssjlatbin named by a hash of the root directory"""
+    filetype = config['io']['cdf_or_nc']
+    root_dir = config['io'][f'ssj_{filetype}_root_dir']
+    index_path = config['io'].get('file_index_path','')
+    if index_path == '':
+        root_hash = hashlib.sha1(os.path.abspath(root_dir).encode('utf-8')).hexdigest()
+        index_path = os.path.join(DEFAULT_FILE_INDEX_DIR,f'file_index_{root_hash[:16]}.json')
+    key = (os.path.abspath(root_dir),index_path)
+    if key not in _FILE_INDEXES:
+        _FILE_INDEXES[key] = SSJFileIndex(root_dir,index_path=index_path)
+    return _FILE_INDEXES[key]
+
+def available_days(dmsp_number,config,dt_start=None,dt_end=None):
+    """Dates with an SSJ file (of the configured type and version) for a spacecraft,
+    optionally only the days which overlap the time from dt_start up to
+    (not including) dt_end"""
+    filetype = config['io']['cdf_or_nc']
+    version = config['io'][f'ssj_{filetype}_version']
+    index = get_file_index(config)
+    index.refresh()
+    return index.available_days(dmsp_number,version,filetype,dt_start=dt_start,dt_end=dt_end)
@@ -3,12 +3,12 @@
 # Mar 2021
 import numpy as np
 import pandas as pd
-import datetime
-from dateutil.relativedelta import *
-from functools import partial
+import datetime,time
+from functools import partial,lru_cache
 
-from logbook import Logger
-log = Logger('fluxcalculations')
+from ssjlatbin.metrics import get_metrics,timed,LazyLogger
+
+log = LazyLogger('fluxcalculations')
 
 #Center energy of each channel in eV
 CHANNEL_ENERGIES = [ 30000.,  20400.,  13900.,   9450.,   6460.,   4400.,   3000.,
@@ -39,72 +39,216 @@ def _energy_or_number_check(energy_or_number):
     if energy_or_number not in ['energy','number']:
         raise ValueError('Invalid type of flux {}'.format(energy_or_number))
 
+CHANNEL_WIDTHS = _hardy_channel_widths()
+
+def _channel_conversion_factors(energy_or_number):
+    """Factor for each channel which converts differential energy flux
+    (eV/cm^2/s/sr/eV) into that channel's contribution to the integrated
+    number flux (#/m^2/s) or energy flux (mW/m^2)"""
+    _energy_or_number_check(energy_or_number)
+    channel_energies = np.array(CHANNEL_ENERGIES)
+    factors = CHANNEL_WIDTHS.flatten()/channel_energies*np.pi # #/cm^2/s/sr/eV -> #/cm^2/s
+    factors *= 1e4 # #/cm^2/s -> #/m^2/s
+    if energy_or_number == 'energy':
+        factors *= channel_energies*1.6e-19 # #/m^2/s -> J/m^2/s == W/m^2
+        factors *= 1e3 #W/m^/s -> mW/m^2/s
+    return factors
+
+#Computed once at import, the conversion factors do not depend on the data
+CHANNEL_CONVERSION_FACTORS = {energy_or_number:_channel_conversion_factors(energy_or_number)
+                                for energy_or_number in ['energy','number']}
+
+def flux_weight_matrix(channel_sets):
+    """Make a (19 x k) matrix which, when the (n_times x 19) differential
+    energy flux is multiplied by it, gives k integrated fluxes
+    
+    Parameters
+    ----------
+    channel_sets - list
+        List of k (channels,energy_or_number) tuples, where channels
+        is a list of channel indices (0-18) to integrate over and
+        energy_or_number is 'energy' or 'number'
+
+    Returns
+    -------
+    weights - np.array
+        Array of shape (19,k)
+    """
+    return _flux_weight_matrix(tuple((tuple(channels),energy_or_number) 
+                                        for channels,energy_or_number in channel_sets))
+
+@lru_cache(maxsize=None)
+def _flux_weight_matrix(channel_sets):
+    weights = np.zeros((len(CHANNEL_ENERGIES),len(channel_sets)))
+    for k,(channels,energy_or_number) in enumerate(channel_sets):
+        factors = CHANNEL_CONVERSION_FACTORS[energy_or_number]
+        channels = list(channels)
+        weights[channels,k] = factors[channels]
+    weights.setflags(write=False)
+    return weights
+
+#Number of rows of the differential flux processed at a time, the only
+#temporary arrays made while integrating are this many rows long
+CHUNK_SIZE = 8192
+
+def _zero_nonfinite(arr):
+    """Zero non-finite values of arr in place, so a NaN doesn't NaN 
+    the entire computation"""
+    np.copyto(arr,0.,where=np.logical_not(np.isfinite(arr)))
+
+def _check_out(out,n_times,k):
+    """Check a user supplied output buffer has k columns and room for 
+    n_times rows, and return the first n_times rows of it"""
+    if out.ndim != 2 or out.shape[0] < n_times or out.shape[1] != k:
+        raise ValueError(('Output array of shape {} '.format(out.shape)
+                          +'cannot hold integrated fluxes of shape {}'.format((n_times,k))))
+    return out[:n_times]
+
+def _integrate_chunks(diff_flux,weights,out,diff_flux_rel_uncert=None,uncertainty_tolerance=None,
+                        std_out=None):
+    """Integrate diff_flux (n_times x 19) into out (n_times x k) CHUNK_SIZE 
+    rows at a time, copying each chunk into a scratch buffer so the inputs are
+    never modified. If diff_flux_rel_uncert is passed the integrated flux
+    standard deviations are calculated and either stored in std_out, or 
+    (uncertainty_tolerance not None) used to zero too uncertain values of out.
+    Returns the number of values which were zeroed."""
+    n_times = diff_flux.shape[0]
+    scratch = np.empty((min(CHUNK_SIZE,n_times),diff_flux.shape[1]))
+    if diff_flux_rel_uncert is not None:
+        weights_squared = weights**2
+        if std_out is None:
+            std_scratch = np.empty((scratch.shape[0],weights.shape[1]))
+    n_too_uncert = 0
+    metrics = get_metrics()
+    uncert_seconds = 0.
+    for i_start in range(0,n_times,CHUNK_SIZE):
+        i_end = min(i_start+CHUNK_SIZE,n_times)
+        chunk = scratch[:i_end-i_start]
+        np.copyto(chunk,diff_flux[i_start:i_end])
+        _zero_nonfinite(chunk)
+        np.matmul(chunk,weights,out=out[i_start:i_end])
+        if diff_flux_rel_uncert is None:
+            continue
+
+        if metrics.enabled:
+            t_uncert = time.perf_counter()
+        #Sigma is given as relative error, make absolute
+        np.multiply(diff_flux_rel_uncert[i_start:i_end],diff_flux[i_start:i_end],out=chunk)
+        _zero_nonfinite(chunk)
+        chunk **= 2 #Uncertainties add in quadrature
+        if std_out is not None:
+            chunk_std = std_out[i_start:i_end]
+        else:
+            chunk_std = std_scratch[:i_end-i_start]
+        np.matmul(chunk,weights_squared,out=chunk_std)
+        np.sqrt(chunk_std,out=chunk_std)
+        if uncertainty_tolerance is not None:
+            #uncertainty tolerance is a percent
+            chunk_out = out[i_start:i_end]
+            with np.errstate(divide='ignore',invalid='ignore'):
+                too_uncert = chunk_std/chunk_out*100>=uncertainty_tolerance
+            chunk_out[too_uncert]=0.
+            n_too_uncert += np.count_nonzero(too_uncert)
+        if metrics.enabled:
+            uncert_seconds += time.perf_counter()-t_uncert
+    if diff_flux_rel_uncert is not None:
+        metrics.add_duration('uncertainty_filter',uncert_seconds)
+    return n_too_uncert
+
 def _integrated_flux_std(diff_flux,diff_flux_rel_uncert,channels,energy_or_number):
     """Calculate the appoximate standard deviation of a full or partial
     integration (over channel numbers 'channels') 
     of the differential energy or number flux"""
-    channel_energies = CHANNEL_ENERGIES
-    channel_width_energy = _hardy_channel_widths()
-
-    #Sigma is given as relative error, make absolute
-    sigma = diff_flux_rel_uncert*diff_flux  #Standard deviation of each channel
-
-    integral_flux_std = np.zeros((sigma.shape[0],1)).flatten()
-    #Make it so a NaN doesn't NaN the entire computation
-    for c in channels:
-        nn = np.logical_not(np.isfinite(sigma[:,c]))
-        sigma[nn,c] = 0. #Zero it out so it doesn't break the sum
-        ccs = sigma[:,c]/channel_energies[c]*channel_width_energy[c]*np.pi# #/cm^2/s/sr/eV -> #/cm^2/s
-        ccs *= 1e4 # #/cm^2/s -> #/m^2/s
-        if energy_or_number == 'energy':
-            ccs *= channel_energies[c]*1.6e-19 # #/m^2/s -> J/m^2/s == W/m^2
-            ccs *= 1e3 #W/m^/s -> mW/m^2/s
-        ccs = ccs**2. #Uncertainties add in quadrature
-        integral_flux_std = integral_flux_std + ccs.flatten()
-    return np.sqrt(integral_flux_std)
+    _energy_or_number_check(energy_or_number)
+    weights = flux_weight_matrix([(channels,energy_or_number)])
+    integral_flux = np.empty((diff_flux.shape[0],1))
+    integral_flux_std = np.empty((diff_flux.shape[0],1))
+    _integrate_chunks(diff_flux,weights,integral_flux,
+                        diff_flux_rel_uncert=diff_flux_rel_uncert,
+                        std_out=integral_flux_std)
+    return integral_flux_std[:,0]
 
 def _integrate_flux(diff_flux,channels,energy_or_number):
     """Calculate the total energy or number flux for a set of channels
     from the differential (channel-by-channel) energy flux
     """
     _energy_or_number_check(energy_or_number)
-        
-    channel_energies = CHANNEL_ENERGIES
-    channel_width_energy = _hardy_channel_widths()
-
-    #Integrate the flux across the chosen channels
-    integral_flux = np.zeros((diff_flux.shape[0],1)).flatten()
-
-    for c in channels:
-        #Make it so a NaN doesn't NaN the entire computation
-        nn = np.logical_not(np.isfinite(diff_flux[:,c]))
-        diff_flux[nn,c] = 0. #Zero it out so it doesn't break the sum
-        cc = diff_flux[:,c]/channel_energies[c]*channel_width_energy[c]*np.pi# #/cm^2/s/sr/eV -> #/cm^2/s
-        cc *= 1e4 # #/cm^2/s -> #/m^2/s
-        if energy_or_number == 'energy':
-            cc *= channel_energies[c]*1.6e-19 # #/m^2/s -> J/m^2/s == W/m^2
-            cc *= 1e3 #W/m^/s -> mW/m^2/s
-        #'Mean contribution from ssj channel %d was %.3f mW/m^2' % (c,np.nanmean(cc)) )
-        integral_flux = integral_flux + cc.flatten()
-            
-    return integral_flux
-
-def integrate_flux(diff_flux,channels,energy_or_number,diff_flux_rel_uncert=None,uncertainty_tolerance=None):
-    integral_flux = _integrate_flux(diff_flux,channels,energy_or_number)
+    weights = flux_weight_matrix([(channels,energy_or_number)])
+    integral_flux = np.empty((diff_flux.shape[0],1))
+    _integrate_chunks(diff_flux,weights,integral_flux)
+    return integral_flux[:,0]
+
+@timed('integrate_flux')
+def integrate_fluxes(diff_flux,channel_sets,diff_flux_rel_uncert=None,uncertainty_tolerance=None,
+                        out=None,channel_numbers=None):
+    """Calculate several integrated fluxes (energy or number flux
+    over different sets of channels) from the differential energy flux 
+    with one matrix multiplication. The input arrays are not modified.
+
+    Parameters
+    ----------
+    diff_flux - np.array
+        Differential energy flux, shape (n_times,19)
+    channel_sets - list
+        List of k (channels,energy_or_number) tuples (see flux_weight_matrix)
+    diff_flux_rel_uncert - np.array, optional
+        Relative uncertainty of diff_flux, shape (n_times,19)
+    uncertainty_tolerance - float, optional
+        Integrated fluxes with a percent uncertainty greater than or equal to
+        this are set to zero (only if diff_flux_rel_uncert is also passed)
+    out - np.array, optional
+        Float64 array of shape (n,k) with n>=n_times to store the result in, 
+        so the same array can be reused for days with different numbers 
+        of samples
+    channel_numbers - list, optional
+        If diff_flux (and diff_flux_rel_uncert) only have some of the
+        19 channels as columns, the channel number of each column
+
+    Returns
+    -------
+    integral_fluxes - np.array
+        Integrated fluxes, shape (n_times,k) (a view of out if passed)
+    """
+    weights = flux_weight_matrix(channel_sets)
+    if channel_numbers is not None:
+        channel_numbers = list(channel_numbers)
+        not_read = np.ones((weights.shape[0],),dtype=bool)
+        not_read[channel_numbers] = False
+        if np.any(weights[not_read,:]!=0.):
+            raise ValueError(('Channel sets {} need channels '.format(channel_sets)
+                              +'which are not in channel_numbers {}'.format(channel_numbers)))
+        weights = weights[channel_numbers,:]
+    n_times = diff_flux.shape[0]
+    if out is None:
+        integral_fluxes = np.empty((n_times,weights.shape[1]))
+    else:
+        integral_fluxes = _check_out(out,n_times,weights.shape[1])
+
     if diff_flux_rel_uncert is not None and uncertainty_tolerance is not None:
-        integral_flux_std = _integrated_flux_std(diff_flux,
-                                                diff_flux_rel_uncert,
-                                                channels,
-                                                energy_or_number)
-        #uncertainty tolerance is a percent
-        too_uncert = integral_flux_std/integral_flux*100>=uncertainty_tolerance
-        integral_flux[too_uncert]=0.
+        n_too_uncert = _integrate_chunks(diff_flux,weights,integral_fluxes,
+                                         diff_flux_rel_uncert=diff_flux_rel_uncert,
+                                         uncertainty_tolerance=uncertainty_tolerance)
         log.debug('Removed %d/%d flux values due to high uncertainty' % (
-                                                np.count_nonzero(too_uncert),
-                                                len(too_uncert)))
+                                                n_too_uncert,
+                                                integral_fluxes.size))
+        metrics = get_metrics()
+        metrics.count('flux_values_integrated',integral_fluxes.size)
+        metrics.count('flux_values_removed_uncertainty',n_too_uncert)
     else:
+        _integrate_chunks(diff_flux,weights,integral_fluxes)
         log.debug('Uncertainty not checked')
-    return integral_flux
+    return integral_fluxes
+
+def integrate_flux(diff_flux,channels,energy_or_number,diff_flux_rel_uncert=None,uncertainty_tolerance=None,
+                    out=None):
+    _energy_or_number_check(energy_or_number)
+    if out is not None:
+        out = out[:,np.newaxis]
+    integral_flux = integrate_fluxes(diff_flux,[(channels,energy_or_number)],
+                                     diff_flux_rel_uncert=diff_flux_rel_uncert,
+                                     uncertainty_tolerance=uncertainty_tolerance,
+                                     out=out)
+    return integral_flux[:,0]
 
 def average_particle_energy(integrated_energy_flux,integrated_number_flux):
     """Calculate the average particle energy (eV) for output from above function 
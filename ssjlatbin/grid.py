@@ -0,0 +1,231 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Bin SSJ data into a magnetic latitude x magnetic local time grid in each
+hemisphere, for all the data, each orbit or each time window"""
+import datetime,os
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.binstats import NOT_BINNED
+from ssjlatbin.cdf import _read_ssj_day
+from ssjlatbin.fileindex import available_days
+from ssjlatbin.metrics import get_metrics,timed
+from ssjlatbin.pipeline import iter_latbinned_orbits
+
+HEMISPHERES = ['N','S']
+
+GRID_INDEX = ['window_start','hemisphere','mlat','mlt']
+
+def grid_shape(config):
+    """Number of magnetic latitude and magnetic local time cells in each hemisphere"""
+    grid = config['grid']
+    n_mlat = (90.-grid['min_mlat'])/grid['delta_mlat']
+    n_mlt = 24./grid['delta_mlt']
+    if not (np.isclose(n_mlat,round(n_mlat)) and np.isclose(n_mlt,round(n_mlt))):
+        raise ValueError(('Grid cells of {} degrees from {} degrees '.format(grid['delta_mlat'],grid['min_mlat'])
+                          +'and {} hours MLT do not divide evenly'.format(grid['delta_mlt'])))
+    return int(round(n_mlat)),int(round(n_mlt))
+
+def grid_centers(config):
+    """Center absolute magnetic latitude and magnetic local time of the grid cells"""
+    n_mlat,n_mlt = grid_shape(config)
+    mlat_centers = config['grid']['min_mlat']+(np.arange(n_mlat)+.5)*config['grid']['delta_mlat']
+    mlt_centers = (np.arange(n_mlt)+.5)*config['grid']['delta_mlt']
+    return mlat_centers,mlt_centers
+
+def grid_cells(mlats,mlts,config):
+    """Flat index (hemisphere*n_mlat+i_mlat)*n_mlt+i_mlt of the grid cell of
+    each sample, or -1 if the sample is below [grid] min_mlat or not finite.
+    MLT wraps around, so 24 (or -1) is the same as 0 (or 23)"""
+    n_mlat,n_mlt = grid_shape(config)
+    mlats = np.asarray(mlats,dtype=float)
+    mlts = np.asarray(mlts,dtype=float)
+    valid = np.isfinite(mlats) & np.isfinite(mlts)
+    abs_mlats = np.where(valid,np.abs(mlats),-np.inf)
+    i_mlat = np.floor((abs_mlats-config['grid']['min_mlat'])/config['grid']['delta_mlat'])
+    valid &= (i_mlat>=0) & (i_mlat<=n_mlat) & (abs_mlats<=90.)
+    #The pole itself is in the last cell
+    i_mlat = np.where(valid,np.minimum(i_mlat,n_mlat-1),0)
+    i_mlt = np.floor(np.mod(np.where(valid,mlts,0.),24.)/config['grid']['delta_mlt'])
+    #mod can round up to 24 for tiny negative MLT
+    i_mlt = np.mod(i_mlt,n_mlt)
+    hemisphere = (mlats<0).astype(np.int64)
+    cells = (hemisphere*n_mlat+i_mlat.astype(np.int64))*n_mlt+i_mlt.astype(np.int64)
+    return np.where(valid,cells,-1)
+
+def _window_starts(df,window,range_start):
+    """Start time (as datetime64[ns]) of the window of each sample"""
+    times = df.index.values.astype('datetime64[ns]')
+    if window == 'orbit':
+        return df['orbit_start_time'].values.astype('datetime64[ns]')
+    elif window == '':
+        return np.full(times.shape,np.datetime64(pd.Timestamp(range_start),'ns'))
+    window_ns = pd.Timedelta(window).value
+    return ((times.astype(np.int64)//window_ns)*window_ns).astype('datetime64[ns]')
+
+@timed('bin_by_grid')
+def bin_by_grid(ssj_dataframe,config,window=None,range_start=None,variables=None):
+    """Count, sum and sum of squares (columns variable_count, variable_sum,
+    variable_sumsq, as in binstats.bin_statistics, so
+    binstats.bin_statistics_to_binned gives the mean and standard deviation
+    and grids of separate chunks can be added with merge_grid_statistics)
+    of each variable in each magnetic latitude ([grid] mlatvar)
+    x magnetic local time ([grid] mltvar) cell of each hemisphere, in one
+    pass over the data. Cells are [grid] delta_mlat degrees from [grid] min_mlat
+    and [grid] delta_mlt hours.
+
+    window ([grid] window by default) is 'orbit' for a grid for each orbit
+    (the dataframe needs orbit_start_time), a fixed pandas time interval
+    (e.g. '1D' or '27D', windows start at multiples of it since 1970) or ''
+    for one grid (starting at range_start, by default the first sample).
+    Returns a dataframe with one row per cell with data, indexed by window_start,
+    hemisphere, mlat and mlt (cell centers). variables defaults to every
+    numeric column"""
+    df = ssj_dataframe
+    if window is None:
+        window = config['grid'].get('window','')
+    if range_start is None and len(df)>0:
+        range_start = df.index[0]
+    mlatvar = config['grid'].get('mlatvar','mlats')
+    mltvar = config['grid'].get('mltvar','mlts')
+    if variables is None:
+        variables = [column for column in df.columns
+                        if column not in NOT_BINNED and pd.api.types.is_numeric_dtype(df[column])]
+    n_mlat,n_mlt = grid_shape(config)
+    n_cells = len(HEMISPHERES)*n_mlat*n_mlt
+
+    cells = grid_cells(df[mlatvar].values,df[mltvar].values,config)
+    in_grid = cells>=0
+    window_starts,window_index = np.unique(_window_starts(df,window,range_start)[in_grid],
+                                           return_inverse=True)
+    key = window_index.ravel()*n_cells+cells[in_grid]
+    n_keys = window_starts.size*n_cells
+
+    statistics = {}
+    for variable in variables:
+        y = df[variable].values.astype(float)[in_grid]
+        finite = np.isfinite(y)
+        y = np.where(finite,y,0.)
+        statistics[variable+'_count'] = np.bincount(key,weights=finite,minlength=n_keys).astype(np.int64)
+        statistics[variable+'_sum'] = np.bincount(key,weights=y,minlength=n_keys)
+        statistics[variable+'_sumsq'] = np.bincount(key,weights=y**2,minlength=n_keys)
+    has_data = np.bincount(key,minlength=n_keys)>0
+    keys = np.flatnonzero(has_data)
+    mlat_centers,mlt_centers = grid_centers(config)
+    cells = keys%n_cells
+    index = pd.MultiIndex.from_arrays([pd.DatetimeIndex(window_starts[keys//n_cells]),
+                                       np.array(HEMISPHERES)[cells//(n_mlat*n_mlt)],
+                                       mlat_centers[(cells//n_mlt)%n_mlat],
+                                       mlt_centers[cells%n_mlt]],
+                                      names=GRID_INDEX)
+    get_metrics().count('grid_cells_binned',keys.size)
+    return pd.DataFrame({name:values[keys] for name,values in statistics.items()},index=index)
+
+def merge_grid_statistics(griddfs):
+    """Combine grid statistics (from bin_by_grid) of several chunks of data,
+    adding the statistics of the same cell of the same window"""
+    griddfs = [griddf for griddf in griddfs if griddf is not None]
+    return pd.concat(griddfs).groupby(level=GRID_INDEX,sort=True).sum()
+
+def iter_grid_binned(dmsp_number,dt_start,dt_end,config,window=None,variables=None,direction=None):
+    """Generate grid statistics (as from bin_by_grid) of the data from dt_start
+    up to (not including) dt_end, reading one day at a time. Each window is
+    generated once, as soon as it is complete, so only the windows in
+    progress are kept in memory. Orbit windows are the orbits which start in
+    the range (see pipeline.iter_latbinned_orbits)"""
+    if window is None:
+        window = config['grid'].get('window','')
+    if window == 'orbit':
+        binner = lambda orbitdf,config,latvar: bin_by_grid(orbitdf,config,window='orbit',
+                                                           variables=variables)
+        yield from iter_latbinned_orbits(dmsp_number,dt_start,dt_end,config,
+                                         direction=direction,binner=binner)
+        return
+
+    dt_start = pd.Timestamp(dt_start)
+    dt_end = pd.Timestamp(dt_end)
+    pending = None
+    for date in available_days(dmsp_number,config,dt_start,dt_end):
+        daydf = _read_ssj_day(dmsp_number,datetime.datetime.combine(date,datetime.time()),config)
+        if daydf is None:
+            continue
+        daydf = daydf[(daydf.index>=dt_start) & (daydf.index<dt_end)]
+        daygriddf = bin_by_grid(daydf,config,window=window,range_start=dt_start,variables=variables)
+        pending = merge_grid_statistics([pending,daygriddf])
+        if window == '':
+            continue
+        #Windows which end before the next day are complete
+        day_end = pd.Timestamp(date)+pd.Timedelta(days=1)
+        window_ends = pending.index.get_level_values('window_start')+pd.Timedelta(window)
+        completed = window_ends<=day_end
+        if np.any(completed):
+            yield pending[completed]
+            pending = pending[~completed]
+    if pending is not None and len(pending)>0:
+        yield pending
+
+def grid_arrays(griddf,config,statistic='mean'):
+    """Dense arrays from grid statistics (as from bin_by_grid). Returns the
+    window start times, the center magnetic latitudes and MLTs of the cells
+    and a dictionary of arrays (window x hemisphere (N,S) x mlat x mlt) of
+    statistic ('mean', 'std', 'count', 'sum' or 'sumsq') of each variable
+    (NaN where there is no data)"""
+    n_mlat,n_mlt = grid_shape(config)
+    mlat_centers,mlt_centers = grid_centers(config)
+    window_starts,i_window = np.unique(griddf.index.get_level_values('window_start').values,
+                                       return_inverse=True)
+    i_hemisphere = pd.Index(HEMISPHERES).get_indexer(griddf.index.get_level_values('hemisphere'))
+    i_mlat = np.searchsorted(mlat_centers,griddf.index.get_level_values('mlat').values)
+    i_mlt = np.searchsorted(mlt_centers,griddf.index.get_level_values('mlt').values)
+
+    variables = [column[:-len('_count')] for column in griddf.columns if column.endswith('_count')]
+    arrays = {}
+    for variable in variables:
+        count = griddf[variable+'_count'].values.astype(float)
+        if statistic in ['count','sum','sumsq']:
+            values = griddf[variable+'_'+statistic].values.astype(float)
+        else:
+            with np.errstate(divide='ignore',invalid='ignore'):
+                mean = griddf[variable+'_sum'].values/count
+                var = np.maximum(griddf[variable+'_sumsq'].values/count-mean**2,0.)
+            if statistic == 'mean':
+                values = mean
+            elif statistic == 'std':
+                values = np.sqrt(var)
+            else:
+                raise ValueError('Unknown statistic {}'.format(statistic))
+        array = np.full((window_starts.size,len(HEMISPHERES),n_mlat,n_mlt),
+                        0. if statistic=='count' else np.nan)
+        array[i_window.ravel(),i_hemisphere,i_mlat,i_mlt] = values
+        arrays[variable] = array
+    return window_starts,mlat_centers,mlt_centers,arrays
+
+def write_grid_parquet(dmsp_number,dt_start,dt_end,config,path,window=None,variables=None):
+    """Write the grid statistics of the data from dt_start up to (not including)
+    dt_end (see iter_grid_binned) to one Parquet file, one row group at a
+    time, with one row per cell with data. Returns the number of rows written"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    n_rows = 0
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+    try:
+        for griddf in iter_grid_binned(dmsp_number,dt_start,dt_end,config,
+                                       window=window,variables=variables):
+            table = pa.Table.from_pandas(griddf.reset_index(),preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(tmppath,table.schema)
+            writer.write_table(table)
+            n_rows+=len(griddf)
+        if writer is not None:
+            writer.close()
+            writer = None
+            os.replace(tmppath,path)
+    finally:
+        #Never leave a partly written file behind
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+    return n_rows
@@ -2,9 +2,15 @@
 # Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
 # Mar 2021
 import datetime
-import glob
+import os
+import hashlib
+import json
 import toml
 import numpy as np
+import pandas as pd
+
+from ssjlatbin.fileindex import get_file_index
+from ssjlatbin.latbin_pandas import latbin_categories,latbin_centers
 
 def read_config(tomlfn):
     """Read the configuration file used by the rest of the application"""
@@ -12,9 +18,29 @@ def read_config(tomlfn):
         tomldict = toml.loads(f.read())
     return tomldict
 
+#Parts of the configuration which change the dataframe read from an SSJ file,
+#either top level keys or (section,key) tuples
+READ_CONFIG_KEYS = ['soft_channels','hard_channels','all_channels',
+                    'calculation','dataframevar_to_filevar',('io','read_float32')]
+
+def config_hash(config,keys=READ_CONFIG_KEYS):
+    """Hash (hex string) of the values of some keys of the configuration,
+    by default those which affect what is read from an SSJ file"""
+    relevant_config = {}
+    for key in keys:
+        if isinstance(key,tuple):
+            section,section_key = key
+            relevant_config['.'.join(key)] = config.get(section,{}).get(section_key)
+        else:
+            relevant_config[key] = config.get(key)
+    config_json = json.dumps(relevant_config,sort_keys=True,default=str)
+    return hashlib.sha1(config_json.encode('utf-8')).hexdigest()
+
 def ssjfn(dmsp_number,dt,config):
     """Find the full path to DMSP SSJ CDF or netCDF files by looking
-    recursively in directory set in config file
+    recursively in directory set in config file (using the index of the
+    directory from fileindex.get_file_index, which is rebuilt if it was
+    changed since the index was built)
     """
     filetype = config['io']['cdf_or_nc']
     if filetype not in ['cdf','nc']:
@@ -24,7 +50,11 @@ def ssjfn(dmsp_number,dt,config):
     fdir = config['io'][f'ssj_{filetype}_root_dir']
 
     fname = 'dmsp-f{:02d}_ssj_precipitating-electrons-ions_{}{:02d}{:02d}_v{}.{}'.format(dmsp_number,dt.year,dt.month,dt.day,version,filetype)
-    fullpath = glob.glob(fdir+'/**/'+fname,recursive=True)
+    index = get_file_index(config)
+    fullpath = index.paths(dmsp_number,dt,version,filetype)
+    if len(fullpath)==0 or not all([os.path.exists(path) for path in fullpath]):
+        index.refresh()
+        fullpath = index.paths(dmsp_number,dt,version,filetype)
     if len(fullpath)==0:
         raise IOError('No DMSP {} file {} found in {}'.format(filetype,fname,fdir))
     elif len(fullpath)>1:
@@ -107,6 +137,56 @@ def dataframe_to_latbinned_flux(binneddf,fluxvar):
             lats_dawn_dusk_flag[icol]=-1
         else:
             raise ValueError('Unexpected column name prefix {}'.format(dawn_dusk))
-        lats[icol]=np.float(latstr)
+        lats[icol]=float(latstr)
         fluxes[:,icol] = df2d[colname].values
-    return t,lats,lats_dawn_dusk_flag,fluxes
\ No newline at end of file
+    return t,lats,lats_dawn_dusk_flag,fluxes
+
+def dataframe_to_latbinned_fluxes(binneddf,fluxvars,config,float32=False):
+    """Extract time and latitude 1D arrays and a 3D array of several fluxes,
+    with a column for every latitude bin defined by the [latbin] settings
+    in config (NaN where an orbit has no data in a bin), so arrays from 
+    different dataframes line up.
+    
+    Parameters
+    ----------
+    binneddf - pd.DataFrame
+        Pandas dataframe with an orbit_start_time / latitude bin MultiIndex
+        (as returned by ssjlatbin.latbin_pandas.bin_by_latitude).
+    fluxvars - list
+        Types of flux to extract (e.g. ['ele_total_number','ion_total_number']) 
+        Must be valid column names for binneddf
+    config - dict
+        Configuration binneddf was binned with
+    float32 - bool, optional
+        Return fluxes as float32 instead of float64
+        
+    Returns
+    -------
+    t - np.array
+        Array of datetime.datetime objects, the orbit start times for
+        each row of the fluxes array
+    lats - np.array
+        Array of center latitudes for each latitude bin
+    lats_dawn_dusk_flag - np.array
+        Array of same size as lats with value 1 if the corresponding lat
+        is on the dawn side of the orbit, -1 if it is on the dusk side
+    fluxes - np.array
+        Array of flux values with shape (len(t),len(lats),len(fluxvars))
+    """
+    delta_lat=config['latbin']['delta_lat']
+    max_lat=config['latbin']['max_lat']
+    categories = latbin_categories(delta_lat,max_lat)
+    lats,lats_dawn_dusk_flag = latbin_centers(delta_lat,max_lat)
+
+    orbit_start_times = binneddf.index.get_level_values('orbit_start_time')
+    t,orbit_inds = np.unique(orbit_start_times.values,return_inverse=True)
+    latbins = binneddf.index.get_level_values('latbin')
+    bin_inds = pd.Categorical(latbins,categories=categories).codes
+    if np.any(bin_inds<0):
+        raise ValueError(('Latitude bins {} are not bins'.format(np.unique(latbins[bin_inds<0]))
+                         +' for delta_lat {} and max_lat {}'.format(delta_lat,max_lat)))
+
+    dtype = np.float32 if float32 else np.float64
+    fluxes = np.full((len(t),len(categories),len(fluxvars)),np.nan,dtype=dtype)
+    fluxes[orbit_inds,bin_inds,:] = binneddf[fluxvars].to_numpy(dtype=dtype)
+    return pd.DatetimeIndex(t).to_pydatetime(),lats,lats_dawn_dusk_flag,fluxes
@@ -3,7 +3,12 @@
 # Mar 2021
 import numpy as np
 import pandas as pd
-from dateutil.relativedelta import *
+
+from ssjlatbin.latbin_pandas import define_latbins,ORBIT_QUARTERS
+from ssjlatbin.metrics import get_metrics,timed,LazyLogger
+
+log = LazyLogger('latbin')
+
 def _dawn_dusk(hemi,asc_desc):
     """Determine if the spacecraft was in the dawn or
     dusk sector from which hemisphere it is in an whether
@@ -31,51 +36,97 @@ def _ascending_descending_masks(glats):
     masks['desc'] = dlat<0 #spacecraft is descending (going south)
     return masks
         
-def bin_by_latitude(orbit_numbered_ssj_dataframe,var_to_bin,latvar='glats',delta_lat=5,max_lat=80):
+def _lat_bin_index(lats,asc_desc_masks,lat_bin_edges):
+    """Column of binned_y (latitude bin index) for every sample,
+    -1 for samples which are not in any bin.
+
+    Bins with increasing edges are (lat_start,lat_end], bins with
+    decreasing edges are [lat_end,lat_start)"""
+    bin_index = np.full(lats.shape,-1,dtype=np.int64)
+    i_first_bin = 0
+    for hemi,asc_desc in ORBIT_QUARTERS:
+        edges = lat_bin_edges[hemi][asc_desc]
+        n_quarter_bins = len(edges)-1
+        inds = np.flatnonzero(asc_desc_masks[asc_desc])
+        if edges[-1] > edges[0]:
+            i_bin = np.searchsorted(edges,lats[inds],side='left')-1
+        else:
+            i_bin = n_quarter_bins-np.searchsorted(edges[::-1],lats[inds],side='right')
+        in_quarter = (i_bin>=0) & (i_bin<n_quarter_bins)
+        bin_index[inds[in_quarter]] = i_first_bin+i_bin[in_quarter]
+        i_first_bin += n_quarter_bins
+    return bin_index
+
+@timed('bin_by_latitude')
+def bin_by_latitude(orbit_numbered_ssj_dataframe,var_to_bin,latvar='glats',delta_lat=5,max_lat=80,
+                    verbose=False):
     """Extract each orbit as one row in an array, binning the data
     into latitude bins of width delta_lat degrees to get a constant
-    number of columns for each orbit"""
+    number of columns for each orbit
+
+    var_to_bin can be one column name, in which case binned_y has shape
+    (n_orbits,n_bins), or a list of column names, in which case binned_y has
+    shape (n_orbits,n_bins,len(var_to_bin)). The mean of each bin
+    ignores NaNs. If verbose, the start time of each orbit and any empty 
+    bins are logged."""
     df = orbit_numbered_ssj_dataframe
     glats = df['glats'].values
     asc_desc_masks = _ascending_descending_masks(glats)
     lats = df[latvar].values
-    y = df[var_to_bin].values
+    vars_to_bin = [var_to_bin] if isinstance(var_to_bin,str) else list(var_to_bin)
+    y = df[vars_to_bin].values.astype(float)
     if np.mod(max_lat*4./delta_lat,delta_lat)!=0:
         raise ValueError('Non-integer number of latitude bins with maxlat {}, delta lat {}'.format(max_lat,delta_lat))
     n_bins = int(np.round(max_lat*4./delta_lat))
-    orbitnums = np.unique(df['orbit_number'].values)
+    orbitnums,orbit_first_row,orbit_index = np.unique(df['orbit_number'].values,
+                                                      return_index=True,
+                                                      return_inverse=True)
+    orbit_index = orbit_index.ravel()
     n_orbits = orbitnums.size
-    binned_y = np.full((n_orbits,n_bins),np.nan)
     orbit_ts = np.full((n_orbits,),np.nan,dtype=object)
+    orbit_ts[:] = list(pd.to_datetime(df.index[orbit_first_row]))
+
+    lat_bin_edges = define_latbins(delta_lat,max_lat)
     bin_lats = np.full((n_bins,),np.nan)
     dawn_dusk_flag = np.full((n_bins),np.nan)
-    lat_bin_edges = {'N':{},'S':{}}
-    lat_bin_edges['N']['asc'] = np.arange(0,max_lat+delta_lat,delta_lat)
-    lat_bin_edges['N']['desc'] = np.arange(max_lat,0-delta_lat,-delta_lat)
-    lat_bin_edges['S']['desc'] = np.arange(0,-1*max_lat-delta_lat,-delta_lat)
-    lat_bin_edges['S']['asc'] = np.arange(-1*max_lat,0+delta_lat,delta_lat)
-    for i_orbit,orbitnum in enumerate(orbitnums):
-        orbit_mask = df['orbit_number']==orbitnum
-        orbit_ts[i_orbit]=pd.to_datetime(df[orbit_mask].index[0])
-        print("Orbit {}: {}".format(orbitnum,orbit_ts[i_orbit]))
-        i_lat_bin = 0
-        for hemi,asc_desc in [('N','asc'),('N','desc'),('S','desc'),('S','asc')]:
-            #Treat each quarter of the orbit individually
-            asc_desc_mask = asc_desc_masks[asc_desc]
-            for lat_start,lat_end in zip(lat_bin_edges[hemi][asc_desc][:-1],lat_bin_edges[hemi][asc_desc][1:]):
-                if i_orbit == 0: #Only need to do this once
-                    bin_lats[i_lat_bin]=(lat_start+lat_end)/2
-                    dawn_dusk_flag[i_lat_bin]=_dawn_dusk(hemi,asc_desc)
+    bin_descriptions = []
+    i_lat_bin = 0
+    for hemi,asc_desc in ORBIT_QUARTERS:
+        edges = lat_bin_edges[hemi][asc_desc]
+        for lat_start,lat_end in zip(edges[:-1],edges[1:]):
+            bin_lats[i_lat_bin]=(lat_start+lat_end)/2
+            dawn_dusk_flag[i_lat_bin]=_dawn_dusk(hemi,asc_desc)
+            bin_descriptions.append('{} {}-{}'.format(asc_desc,lat_start,lat_end))
+            i_lat_bin+=1
+
+    #Flatten (orbit,bin) into one key per sample so that the sum and 
+    #count of every bin of every orbit is one np.bincount
+    bin_index = _lat_bin_index(lats,asc_desc_masks,lat_bin_edges)
+    in_bin = bin_index>=0
+    key = orbit_index[in_bin]*n_bins+bin_index[in_bin]
+    y = y[in_bin]
+    n_keys = n_orbits*n_bins
+
+    binned_y = np.full((n_orbits,n_bins,len(vars_to_bin)),np.nan)
+    n_in_bin = np.bincount(key,minlength=n_keys).reshape(n_orbits,n_bins)
+    for i_var in range(len(vars_to_bin)):
+        finite = np.isfinite(y[:,i_var])
+        bin_sum = np.bincount(key[finite],weights=y[finite,i_var],minlength=n_keys)
+        bin_count = np.bincount(key[finite],minlength=n_keys)
+        bin_mean = np.full((n_keys,),np.nan)
+        has_data = bin_count>0
+        bin_mean[has_data] = bin_sum[has_data]/bin_count[has_data]
+        binned_y[:,:,i_var] = bin_mean.reshape(n_orbits,n_bins)
+
+    metrics = get_metrics()
+    metrics.count('orbits_binned',n_orbits)
+    metrics.count('empty_bins',np.count_nonzero(n_in_bin==0))
+    if verbose:
+        for i_orbit,orbitnum in enumerate(orbitnums):
+            log.info("Orbit {}: {}".format(orbitnum,orbit_ts[i_orbit]))
+            for i_lat_bin in np.flatnonzero(n_in_bin[i_orbit,:]==0):
+                log.info('No data {}'.format(bin_descriptions[i_lat_bin]))
 
-                if lat_start < lat_end:
-                    lat_mask = np.logical_and(lats>lat_start,lats<=lat_end)
-                else:
-                    lat_mask = np.logical_and(lats<lat_start,lats>=lat_end)
-                mask = (orbit_mask & asc_desc_mask & lat_mask)
-                if np.count_nonzero(mask)==0:
-                    print('No data {} {}-{}'.format(asc_desc,lat_start,lat_end))
-                
-                binned_y[i_orbit,i_lat_bin] = np.nanmean(y[mask])
-                i_lat_bin+=1
-                
+    if isinstance(var_to_bin,str):
+        binned_y = binned_y[:,:,0]
     return orbit_ts,bin_lats,dawn_dusk_flag,binned_y
@@ -1,6 +1,10 @@
 import numpy as np
 import pandas as pd
 
+from ssjlatbin.metrics import get_metrics,timed
+from ssjlatbin.sketch import (DEFAULT_RELATIVE_ACCURACY,reduce_sketches,
+                              sketch_values,sketch_quantiles)
+
 def _dawn_dusk(hemi,asc_desc):
     """Determine if the spacecraft was in the dawn or
     dusk sector from which hemisphere it is in an whether
@@ -29,45 +33,292 @@ def define_latbins(delta_lat,max_lat):
 def latbin_label(lat1,lat2,hemi,asc_desc):
     return _dawn_dusk(hemi,asc_desc)+'_{:.1f}'.format((lat1+lat2)/2)
 
-def bin_by_latitude(orbit_numbered_ssj_dataframe,config,latvar='glats'):
-    """Extract each orbit as one row in an array, binning the data
-    into latitude bins of width delta_lat degrees to get a constant
-    number of columns for each orbit"""
-    delta_lat=config['latbin']['delta_lat']
-    max_lat=config['latbin']['max_lat']
-    
-    df = orbit_numbered_ssj_dataframe.copy()
-    df['hemi']=pd.cut(df['glats'],[-91.,0.,91.],labels=['S','N'])
-    df['asc_desc']=pd.cut(df['dglats'],[-np.inf,0,np.inf],labels=['desc','asc'])
+#Order of the quarters of the orbit, this is also the order of the
+#latitude bin categories
+ORBIT_QUARTERS = [('N','asc'),('N','desc'),('S','desc'),('S','asc')]
 
-    categories = []
-    conditions = []
+def latbin_categories(delta_lat,max_lat):
+    """Ordered list of latitude bin labels (dawn/dusk and bin center)"""
     lat_bin_edges = define_latbins(delta_lat,max_lat)
-    lat_bin_centers = []
-    for hemi,asc_desc in [('N','asc'),('N','desc'),('S','desc'),('S','asc')]:
+    categories = []
+    for hemi,asc_desc in ORBIT_QUARTERS:
         edges = lat_bin_edges[hemi][asc_desc]
         for lat1,lat2 in zip(edges[:-1],edges[1:]):
-            lat_bin_centers.append((lat1+lat2)/2)
             categories.append(latbin_label(lat1,lat2,hemi,asc_desc))
+    return categories
+
+def latbin_centers(delta_lat,max_lat):
+    """Center latitudes and dawn/dusk flags (1 for dawn, -1 for dusk)
+    of the latitude bins, in the same order as latbin_categories"""
+    lat_bin_edges = define_latbins(delta_lat,max_lat)
+    centers,dawn_dusk_flags = [],[]
+    for hemi,asc_desc in ORBIT_QUARTERS:
+        edges = lat_bin_edges[hemi][asc_desc]
+        centers.append((edges[:-1]+edges[1:])/2)
+        flag = 1 if _dawn_dusk(hemi,asc_desc)=='dawn' else -1
+        dawn_dusk_flags.append(np.full((len(edges)-1,),flag))
+    return np.concatenate(centers),np.concatenate(dawn_dusk_flags)
+
+def _latbin_select(df,delta_lat,max_lat,latvar='glats'):
+    """Reference (slow) implementation of latbin_codes, one boolean mask
+    per bin combined with np.select. Kept to validate and benchmark
+    latbin_codes against."""
+    hemi=pd.cut(df['glats'],[-91.,0.,91.],labels=['S','N'])
+    asc_desc=pd.cut(df['dglats'],[-np.inf,0,np.inf],labels=['desc','asc'])
+
+    categories = []
+    conditions = []
+    lat_bin_edges = define_latbins(delta_lat,max_lat)
+    for hemi_,asc_desc_ in ORBIT_QUARTERS:
+        edges = lat_bin_edges[hemi_][asc_desc_]
+        for lat1,lat2 in zip(edges[:-1],edges[1:]):
+            categories.append(latbin_label(lat1,lat2,hemi_,asc_desc_))
             slat = np.nanmin([lat1,lat2])
             elat = np.nanmax([lat1,lat2])
             bin_mask = np.logical_and(df[latvar]>=slat,df[latvar]<elat)
-            hemi_mask = df['hemi']==hemi
-            asc_mask = df['asc_desc']==asc_desc
+            hemi_mask = hemi==hemi_
+            asc_mask = asc_desc==asc_desc_
             conditions.append((bin_mask & hemi_mask & asc_mask))
 
     #Returns an array with length the same number of rows as df
     #of strings which are the labels for latitude bins
-    latbinned = np.select(conditions,categories)
+    #(unmatched rows get '' which is not a category, i.e. NaN)
+    latbinned = np.select(conditions,categories,default='')
+    return pd.Categorical(latbinned,categories=categories,ordered=True)
+
+def latbin_codes(df,delta_lat,max_lat,latvar='glats'):
+    """Integer code of the latitude bin (position in latbin_categories)
+    of every row of df, or -1 if the row is not in any bin.
+
+    Hemisphere (from glats) and ascending/descending (from dglats)
+    select one quarter of the orbit, within which the bin is found
+    by a binary search of that quarter's bin edges, so this is a single
+    pass over the data regardless of the number of bins"""
+    glats = df['glats'].values
+    dglats = df['dglats'].values
+    lats = df[latvar].values
+
+    quarter = np.full(glats.shape,-1,dtype=np.int64)
+    north = (glats>0.) & (glats<=91.)
+    south = (glats>-91.) & (glats<=0.)
+    asc = dglats>0
+    desc = (dglats>-np.inf) & (dglats<=0) #NaN dglats are neither
+    for i_quarter,(hemi,asc_desc) in enumerate(ORBIT_QUARTERS):
+        hemi_mask = north if hemi=='N' else south
+        asc_desc_mask = asc if asc_desc=='asc' else desc
+        quarter[hemi_mask & asc_desc_mask] = i_quarter
+
+    codes = np.full(glats.shape,-1,dtype=np.int64)
+    lat_bin_edges = define_latbins(delta_lat,max_lat)
+    first_code = 0
+    for i_quarter,(hemi,asc_desc) in enumerate(ORBIT_QUARTERS):
+        edges = lat_bin_edges[hemi][asc_desc]
+        n_quarter_bins = len(edges)-1
+        in_quarter = np.flatnonzero(quarter==i_quarter)
+        #Bins are [min(lat1,lat2),max(lat1,lat2)), so search the edges
+        #in increasing order and count from the other end for
+        #quarters where latitude is decreasing bin to bin
+        increasing = edges[-1]>edges[0]
+        sorted_edges = edges if increasing else edges[::-1]
+        i_sorted = np.searchsorted(sorted_edges,lats[in_quarter],side='right')-1
+        in_bin = (i_sorted>=0) & (i_sorted<n_quarter_bins)
+        i_bin = i_sorted if increasing else n_quarter_bins-1-i_sorted
+        codes[in_quarter[in_bin]] = first_code+i_bin[in_bin]
+        first_code += n_quarter_bins
+    return codes
+
+#How the samples of each variable in each bin are combined ([latbin] aggregation)
+AGGREGATIONS = ['mean','median','quantiles','count']
+
+#Columns which are always averaged, whatever the aggregation
+MEAN_VARS = ['time','orbit_number']
+
+def quantile_column(variable,quantile):
+    """Name of the column of a quantile of variable (e.g. ele_total_energy_q50)"""
+    return '{}_q{:g}'.format(variable,100*quantile)
+
+def _aggregated_variables(df):
+    return [column for column in df.columns
+                if column not in MEAN_VARS+['orbit_start_time','latbin']
+                    and pd.api.types.is_numeric_dtype(df[column])]
+
+def _sketch_latbins(df,codes,n_bins,variables,relative_accuracy):
+    """Sketches of each variable in each bin of each orbit, with group
+    (orbit*n_bins+latbin code)*n_vars+variable (orbit is the position in
+    the returned orbit start times)"""
+    n_vars = len(variables)
+    in_bin = codes>=0
+    orbit_start_times,orbit_index = np.unique(df['orbit_start_time'].values[in_bin],
+                                              return_inverse=True)
+    bin_key = orbit_index.ravel()*n_bins+codes[in_bin]
+    groups,buckets,counts = [],[],[]
+    for i_var,variable in enumerate(variables):
+        var_groups,var_buckets,var_counts = sketch_values(bin_key*n_vars+i_var,
+                                                          df[variable].values[in_bin],
+                                                          relative_accuracy)
+        groups.append(var_groups)
+        buckets.append(var_buckets)
+        counts.append(var_counts)
+    return orbit_start_times,np.concatenate(groups),np.concatenate(buckets),np.concatenate(counts)
+
+def _sketch_quantile_dataframe(orbit_start_times,groups,buckets,counts,categories,variables,
+                               quantiles,relative_accuracy):
+    """Quantiles and counts of each variable (columns) in each bin of each
+    orbit (rows) from sketches as from _sketch_latbins"""
+    n_bins,n_vars = len(categories),len(variables)
+    groups,n,values = sketch_quantiles(groups,buckets,counts,quantiles,relative_accuracy)
+    bin_keys,row = np.unique(groups//n_vars,return_inverse=True)
+    column = groups%n_vars
+    binned = {}
+    for i_var,variable in enumerate(variables):
+        is_var = column==i_var
+        for i_quantile,quantile in enumerate(quantiles):
+            var_values = np.full(bin_keys.shape,np.nan)
+            var_values[row[is_var]] = values[is_var,i_quantile]
+            binned[quantile_column(variable,quantile)] = var_values
+        var_n = np.zeros(bin_keys.shape,dtype=np.int64)
+        var_n[row[is_var]] = n[is_var]
+        binned[variable+'_count'] = var_n
+    index = pd.MultiIndex.from_arrays([pd.DatetimeIndex(orbit_start_times[bin_keys//n_bins]),
+                                       pd.Categorical.from_codes(bin_keys%n_bins,categories=categories,
+                                                                 ordered=True)],
+                                      names=['orbit_start_time','latbin'])
+    return pd.DataFrame(binned,index=index)
+
+def latbin_sketches(orbit_numbered_ssj_dataframe,config,latvar='glats',variables=None,
+                    relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Approximate quantile sketches (see sketch.py) of each variable in each
+    latitude bin of each orbit, as a dataframe with one row per nonempty
+    sketch bucket (columns orbit_start_time, latbin, variable, bucket and count).
+    Sketches of the same orbits from different chunks of data can be
+    combined with merge_latbin_sketches"""
+    delta_lat=config['latbin']['delta_lat']
+    max_lat=config['latbin']['max_lat']
+    df = orbit_numbered_ssj_dataframe
+    if variables is None:
+        variables = _aggregated_variables(df)
+    n_vars = len(variables)
+    categories = latbin_categories(delta_lat,max_lat)
+    codes = latbin_codes(df,delta_lat,max_lat,latvar=latvar)
+    orbit_start_times,groups,buckets,counts = _sketch_latbins(df,codes,len(categories),
+                                                              variables,relative_accuracy)
+    return pd.DataFrame({'orbit_start_time':orbit_start_times[groups//(len(categories)*n_vars)],
+                         'latbin':pd.Categorical.from_codes((groups//n_vars)%len(categories),
+                                                            categories=categories,ordered=True),
+                         'variable':pd.Categorical.from_codes(groups%n_vars,categories=variables),
+                         'bucket':buckets,
+                         'count':counts})
+
+def merge_latbin_sketches(sketchdfs):
+    """Combine latitude bin sketches (from latbin_sketches, e.g. of several
+    chunks of the same orbits processed in parallel)"""
+    sketchdf = pd.concat(sketchdfs,ignore_index=True)
+    return sketchdf.groupby(['orbit_start_time','latbin','variable','bucket'],
+                            observed=True)['count'].sum().reset_index()
+
+def latbin_sketch_quantiles(sketchdf,quantiles,relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Approximate quantiles (columns variable_qNN, see quantile_column) and
+    number of finite samples (columns variable_count) of each variable
+    in each latitude bin of each orbit from latitude bin sketches
+    (from latbin_sketches or merge_latbin_sketches)"""
+    categories = sketchdf['latbin'].cat.categories
+    variable_codes,variables = pd.factorize(sketchdf['variable'],sort=True)
+    orbit_start_times,orbit_index = np.unique(sketchdf['orbit_start_time'].values,return_inverse=True)
+    groups = (orbit_index.ravel()*len(categories)+sketchdf['latbin'].cat.codes.values)*len(variables)+variable_codes
+    groups,buckets,counts = reduce_sketches(groups,sketchdf['bucket'].values,sketchdf['count'].values)
+    return _sketch_quantile_dataframe(orbit_start_times,groups,buckets,counts,categories,
+                                      list(variables),quantiles,relative_accuracy)
+
+def _binned_mean_vars(df):
+    """Mean time (and orbit number) of the samples in each bin"""
+    meandf = df[['orbit_start_time','latbin']+[var for var in MEAN_VARS if var in df.columns]].copy()
+    #Store the time as datetime64 for the averaging operation
+    meandf['time']=meandf['time'].values.astype('datetime64[ns]').astype(np.int64)
+    meandf = meandf.groupby(['orbit_start_time','latbin'],observed=True).mean()
+    meandf['time'] = pd.to_datetime(meandf['time'])
+    return meandf
+
+def _aggregate_exact(df,variables,aggregation,quantiles):
+    grouped = df[['orbit_start_time','latbin']+variables].groupby(['orbit_start_time','latbin'],
+                                                                  observed=True)
+    #The sketches approximate the lower quantile (a sample, not
+    #interpolated between samples) so the exact quantiles are too
+    if aggregation == 'median':
+        return grouped.quantile(.5,interpolation='lower')
+    elif aggregation == 'count':
+        return grouped.count()
+    aggdfs = [grouped.quantile(quantile,interpolation='lower').rename(columns=lambda variable:quantile_column(variable,quantile))
+                for quantile in quantiles]
+    aggdfs.append(grouped.count().add_suffix('_count'))
+    return pd.concat(aggdfs,axis=1)
+
+def _aggregate_sketch(df,codes,categories,variables,aggregation,quantiles,relative_accuracy):
+    if aggregation == 'median':
+        quantiles = [.5]
+    orbit_start_times,groups,buckets,counts = _sketch_latbins(df,codes,len(categories),
+                                                              variables,relative_accuracy)
+    aggdf = _sketch_quantile_dataframe(orbit_start_times,groups,buckets,counts,categories,
+                                       variables,quantiles,relative_accuracy)
+    if aggregation == 'median':
+        aggdf = aggdf.rename(columns={quantile_column(variable,.5):variable for variable in variables})
+    return aggdf
+
+@timed('bin_by_latitude')
+def bin_by_latitude(orbit_numbered_ssj_dataframe,config,latvar='glats'):
+    """Extract each orbit as one row in an array, binning the data
+    into latitude bins of width delta_lat degrees to get a constant
+    number of columns for each orbit.
+
+    [latbin] aggregation chooses how the samples in each bin are combined,
+    'mean' (default), 'median', 'count' (number of finite samples),
+    or 'quantiles' ([latbin] quantiles, as columns named by quantile_column,
+    plus variable_count). The median and quantiles are approximate
+    (within [latbin] quantile_relative_accuracy, see latbin_sketches)
+    unless [latbin] exact_quantiles is true. time (and orbit_number)
+    are always the mean"""
+    delta_lat=config['latbin']['delta_lat']
+    max_lat=config['latbin']['max_lat']
+    aggregation = config['latbin'].get('aggregation','mean')
+    if aggregation not in AGGREGATIONS:
+        raise ValueError('Unknown aggregation {} (one of {})'.format(aggregation,AGGREGATIONS))
+    
+    df = orbit_numbered_ssj_dataframe.copy()
 
     #The bins do have an order because we want them to plot in a particular
     #order
-    df['latbin']=pd.Categorical(latbinned,categories=categories,ordered=True)
-    
-    #Store the time as datetime64 for the averaging operation   
-    df['time']=df.index.values.astype(np.int64)
+    categories = latbin_categories(delta_lat,max_lat)
+    codes = latbin_codes(df,delta_lat,max_lat,latvar=latvar)
+    df['latbin']=pd.Categorical.from_codes(codes,categories=categories,ordered=True)
     
-    binneddf = df.groupby(['orbit_start_time','latbin']).mean() 
-    binneddf['time'] = pd.to_datetime(binneddf['time'])
-    return binneddf
+    if aggregation == 'mean':
+        #Store the time as datetime64 for the averaging operation   
+        df['time']=df.index.values.astype('datetime64[ns]').astype(np.int64)
+        
+        binneddf = df.groupby(['orbit_start_time','latbin']).mean() 
+        binneddf['time'] = pd.to_datetime(binneddf['time'])
+    else:
+        df['time'] = df.index.values
+        variables = _aggregated_variables(df)
+        quantiles = config['latbin'].get('quantiles',[.1,.5,.9])
+        if config['latbin'].get('exact_quantiles',False) or aggregation == 'count':
+            aggdf = _aggregate_exact(df,variables,aggregation,quantiles)
+        else:
+            relative_accuracy = config['latbin'].get('quantile_relative_accuracy',
+                                                     DEFAULT_RELATIVE_ACCURACY)
+            aggdf = _aggregate_sketch(df,codes,categories,variables,aggregation,
+                                      quantiles,relative_accuracy)
+        binneddf = _binned_mean_vars(df).join(aggdf)
+        if aggregation in ['median','count']:
+            #Same columns as the mean
+            binneddf = binneddf[[column for column in df.columns if column in binneddf.columns]]
+        count_columns = [column for column in binneddf.columns
+                            if column.endswith('_count') or (aggregation=='count' and column in variables)]
+        binneddf[count_columns] = binneddf[count_columns].fillna(0).astype(np.int64)
 
+    metrics = get_metrics()
+    if metrics.enabled:
+        n_orbits = binneddf.index.get_level_values('orbit_start_time').nunique()
+        metrics.count('orbits_binned',n_orbits)
+        #Depending on the pandas version, empty bins are missing or all NaN
+        metrics.count('empty_bins',n_orbits*len(categories)-binneddf['time'].notna().sum())
+    return binneddf
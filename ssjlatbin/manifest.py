@@ -0,0 +1,243 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import datetime,os
+import sqlite3
+
+from ssjlatbin.io import ssjfn,config_hash,READ_CONFIG_KEYS
+from ssjlatbin.fileindex import available_days
+from ssjlatbin.pipeline import (iter_latbinned_orbits,_iter_latbinned_days,
+                                latbinned_parquet_path,_write_parquet)
+
+MANIFEST_FILENAME = 'manifest.sqlite'
+
+#Parts of the configuration which change the latitude binned output
+LATBIN_CONFIG_KEYS = READ_CONFIG_KEYS+['latbin']
+
+#Orbits are always started at the same type of equator crossing so that
+#rebuilding part of the dataset gives the same orbits as the full build
+ORBIT_DIRECTION = 'north'
+
+MANIFEST_COLUMNS = ['source_path','version','mtime_ns','size','config_hash',
+                    'output_path','first_orbit_number','last_orbit_number','processed_at']
+
+class Manifest(object):
+    """Record of which spacecraft-days have been latitude binned into the
+    Parquet dataset, kept in an SQLite database next to the dataset.
+    Each row has the source file (path, version, modification time and size),
+    the hash of the configuration it was processed with, the output file
+    (None if there were no orbits starting on that day) and the numbers of
+    the first and last orbits in it"""
+
+    def __init__(self,path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)),exist_ok=True)
+        self.conn = sqlite3.connect(path,timeout=60.)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS processed_days (
+                                dmsp_number INTEGER NOT NULL,
+                                date TEXT NOT NULL,
+                                source_path TEXT NOT NULL,
+                                version TEXT NOT NULL,
+                                mtime_ns INTEGER NOT NULL,
+                                size INTEGER NOT NULL,
+                                config_hash TEXT NOT NULL,
+                                output_path TEXT,
+                                first_orbit_number REAL,
+                                last_orbit_number REAL,
+                                processed_at TEXT NOT NULL,
+                                PRIMARY KEY (dmsp_number,date))""")
+        self.conn.commit()
+
+    @classmethod
+    def for_config(cls,config):
+        """The manifest of the dataset in [io] parquet_root_dir"""
+        return cls(os.path.join(config['io']['parquet_root_dir'],MANIFEST_FILENAME))
+
+    def get(self,dmsp_number,date):
+        """The row for a spacecraft-day as a dict, or None if it has not been processed"""
+        cursor = self.conn.execute("""SELECT {} FROM processed_days
+                                      WHERE dmsp_number=? AND date=?""".format(','.join(MANIFEST_COLUMNS)),
+                                   (dmsp_number,date.isoformat()))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(MANIFEST_COLUMNS,row))
+
+    def days_with_orbits(self,dmsp_number,after=None):
+        """Rows (as dicts, with the date) of the processed days which have orbits,
+        in date order, only those after date after if it is passed"""
+        cursor = self.conn.execute("""SELECT date,{} FROM processed_days
+                                      WHERE dmsp_number=? AND date>? AND last_orbit_number IS NOT NULL
+                                      ORDER BY date""".format(','.join(MANIFEST_COLUMNS)),
+                                   (dmsp_number,'' if after is None else after.isoformat()))
+        return [dict(zip(['date']+MANIFEST_COLUMNS,row)) for row in cursor.fetchall()]
+
+    def set_orbit_numbers(self,dmsp_number,date,first_orbit_number,last_orbit_number):
+        """Change the recorded numbers of the first and last orbits of a spacecraft-day"""
+        self.conn.execute("""UPDATE processed_days SET first_orbit_number=?,last_orbit_number=?
+                             WHERE dmsp_number=? AND date=?""",
+                          (first_orbit_number,last_orbit_number,dmsp_number,date.isoformat()))
+        self.conn.commit()
+
+    def last_orbit_number_before(self,dmsp_number,date):
+        """Number of the last orbit in the latest processed day before date
+        which has orbits, or None"""
+        cursor = self.conn.execute("""SELECT last_orbit_number FROM processed_days
+                                      WHERE dmsp_number=? AND date<? AND last_orbit_number IS NOT NULL
+                                      ORDER BY date DESC LIMIT 1""",
+                                   (dmsp_number,date.isoformat()))
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def record(self,dmsp_number,date,source,config_hash,output_path,
+                first_orbit_number=None,last_orbit_number=None):
+        """Record that a spacecraft-day was processed from source (as returned by
+        source_info) and committed, so it is kept if a later step fails"""
+        self.conn.execute("""INSERT OR REPLACE INTO processed_days VALUES (?,?,?,?,?,?,?,?,?,?,?)""",
+                          (dmsp_number,date.isoformat(),
+                           source['source_path'],source['version'],
+                           source['mtime_ns'],source['size'],
+                           config_hash,output_path,
+                           first_orbit_number,last_orbit_number,
+                           datetime.datetime.now().isoformat()))
+        self.conn.commit()
+
+    def is_current(self,dmsp_number,date,source,config_hash):
+        """True if the spacecraft-day was processed from this version of its source
+        file with this configuration"""
+        row = self.get(dmsp_number,date)
+        if row is None:
+            return False
+        return all([row[key]==source[key] for key in ['source_path','version','mtime_ns','size']]
+                   +[row['config_hash']==config_hash])
+
+    def close(self):
+        self.conn.close()
+
+def source_info(dmsp_number,date,config):
+    """Path, version, modification time and size of the SSJ file for a
+    spacecraft-day, or None if there is no file"""
+    try:
+        path = ssjfn(dmsp_number,date,config)
+    except IOError:
+        return None
+    filetype = config['io']['cdf_or_nc']
+    stat = os.stat(path)
+    return {'source_path':os.path.abspath(path),
+            'version':config['io'][f'ssj_{filetype}_version'],
+            'mtime_ns':stat.st_mtime_ns,
+            'size':stat.st_size}
+
+def _contiguous_runs(dates):
+    """Split sorted dates into (first,last) of runs of consecutive days"""
+    runs = []
+    for date in dates:
+        if runs and date-runs[-1][1]==datetime.timedelta(days=1):
+            runs[-1][1] = date
+        else:
+            runs.append([date,date])
+    return [tuple(run) for run in runs]
+
+def _shift_orbit_numbers(path,shift):
+    """Add shift to the orbit numbers in a latitude binned Parquet file,
+    keeping its row groups"""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+    parquet_file = pq.ParquetFile(path)
+    i_column = parquet_file.schema_arrow.get_field_index('orbit_number')
+    try:
+        with pq.ParquetWriter(tmppath,parquet_file.schema_arrow) as writer:
+            for i_row_group in range(parquet_file.num_row_groups):
+                table = parquet_file.read_row_group(i_row_group)
+                table = table.set_column(i_column,'orbit_number',pc.add(table['orbit_number'],shift))
+                writer.write_table(table,row_group_size=table.num_rows)
+        os.replace(tmppath,path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+def _renumber_orbits(manifest,dmsp_number,after=None):
+    """Make the orbit numbers of the processed days after date after (by default
+    all processed days) continue from those before them, as in a build of the
+    whole dataset at once, shifting the numbers in the files of any days
+    which do not. The shift for each file is found from the file itself,
+    so renumbering which was interrupted is finished by the next call"""
+    import pyarrow.parquet as pq
+    previous = None
+    if after is not None:
+        previous = manifest.last_orbit_number_before(dmsp_number,after+datetime.timedelta(days=1))
+    for row in manifest.days_with_orbits(dmsp_number,after=after):
+        shift = 0. if previous is None else previous+1.-row['first_orbit_number']
+        if shift != 0.:
+            file_orbit_numbers = pq.read_table(row['output_path'],columns=['orbit_number'])['orbit_number']
+            file_shift = previous+1.-file_orbit_numbers.to_numpy().min()
+            if file_shift != 0.:
+                _shift_orbit_numbers(row['output_path'],file_shift)
+            manifest.set_orbit_numbers(dmsp_number,datetime.date.fromisoformat(row['date']),
+                                       row['first_orbit_number']+shift,row['last_orbit_number']+shift)
+        previous = row['last_orbit_number']+shift
+
+def update_latbinned_parquet(dmsp_number,dt_start,dt_end,config,latvar='glats'):
+    """Bring the latitude binned Parquet dataset (see pipeline.write_latbinned_parquet)
+    up to date for days from dt_start up to (not including) dt_end, processing
+    only days whose source file is new or changed, or which were processed with
+    a different configuration, according to the manifest. Because orbits cross
+    midnight, the days before and after each such day are also rewritten.
+    Orbits always start at equator crossings into the northern hemisphere,
+    and the orbit numbers of rewritten days continue from the last processed
+    day before them. If that changes the number of orbits before a later
+    processed day, the later days are renumbered (see _renumber_orbits), so
+    the orbits are numbered as if the whole dataset had been built at once.
+    Each day is recorded in the manifest as soon as its file is written, so an
+    interrupted update resumes where it stopped. dt_start and dt_end are
+    dates or datetimes. Returns the list of files written"""
+    start,end = [dt.date() if isinstance(dt,datetime.datetime) else dt for dt in [dt_start,dt_end]]
+    days = [start+datetime.timedelta(days=i) for i in range((end-start).days)]
+    hash_ = config_hash(config,LATBIN_CONFIG_KEYS)
+
+    manifest = Manifest.for_config(config)
+    try:
+        #Finish any renumbering interrupted in a previous update
+        _renumber_orbits(manifest,dmsp_number)
+        sources = {day:None for day in days}
+        for day in available_days(dmsp_number,config,start,end):
+            sources[day] = source_info(dmsp_number,day,config)
+        stale = [day for day in days if sources[day] is not None
+                    and not manifest.is_current(dmsp_number,day,sources[day],hash_)]
+        to_rewrite = sorted(set(day+datetime.timedelta(days=offset)
+                                    for day in stale for offset in [-1,0,1])
+                            & set(day for day in days if sources[day] is not None))
+
+        paths = []
+        for run_start,run_end in _contiguous_runs(to_rewrite):
+            run_end = run_end+datetime.timedelta(days=1)
+            binneddfs = iter_latbinned_orbits(dmsp_number,run_start,run_end,config,
+                                              latvar=latvar,direction=ORBIT_DIRECTION)
+            previous_orbit_number = manifest.last_orbit_number_before(dmsp_number,run_start)
+            orbit_number_offset = None
+            written = set()
+            for day,binneddf in _iter_latbinned_days(binneddfs):
+                orbit_numbers = binneddf['orbit_number']
+                if orbit_number_offset is None:
+                    #Orbit numbers from iter_latbinned_orbits start at 0 on run_start
+                    orbit_number_offset = 0. if previous_orbit_number is None \
+                                            else previous_orbit_number+1.-orbit_numbers.min()
+                binneddf['orbit_number'] = orbit_numbers+orbit_number_offset
+                path = latbinned_parquet_path(dmsp_number,day,config)
+                _write_parquet(binneddf,path)
+                manifest.record(dmsp_number,day,sources[day],hash_,path,
+                                float(binneddf['orbit_number'].min()),
+                                float(binneddf['orbit_number'].max()))
+                written.add(day)
+                paths.append(path)
+            #Days in the run with data but no orbits starting on them
+            for day in to_rewrite:
+                if run_start<=day<run_end and day not in written:
+                    path = latbinned_parquet_path(dmsp_number,day,config)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    manifest.record(dmsp_number,day,sources[day],hash_,None)
+            _renumber_orbits(manifest,dmsp_number,after=run_end-datetime.timedelta(days=1))
+    finally:
+        manifest.close()
+    return paths
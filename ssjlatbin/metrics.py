@@ -0,0 +1,153 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import functools
+import json
+import re
+import time
+from collections import defaultdict
+
+class LazyLogger(object):
+    """A logbook Logger which is only created (and logbook only imported)
+    when something is first logged"""
+    def __init__(self,name):
+        self.name = name
+        self._logger = None
+
+    def __getattr__(self,attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        if self._logger is None:
+            from logbook import Logger
+            self._logger = Logger(self.name)
+        return getattr(self._logger,attr)
+
+log = LazyLogger('metrics')
+
+class _NullTimer(object):
+    """Timer used when metrics are disabled, which does nothing"""
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer(object):
+    def __init__(self,metrics,stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc_info):
+        self.metrics.add_duration(self.stage,time.perf_counter()-self.t0)
+        return False
+
+class Metrics(object):
+    """Total durations and number of calls of processing stages, and counts
+    (samples read, flux values removed by the uncertainty tolerance, orbits,
+    empty bins, ...) for one process. When disabled, timer returns a shared
+    do-nothing context manager and count returns immediately, so the
+    instrumentation costs one attribute lookup per call"""
+
+    def __init__(self,enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.durations = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counts = defaultdict(int)
+
+    def timer(self,stage):
+        """Context manager adding the time spent in the block to stage"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self,stage)
+
+    def add_duration(self,stage,seconds,calls=1):
+        if not self.enabled:
+            return
+        self.durations[stage]+=seconds
+        self.calls[stage]+=calls
+
+    def count(self,name,n=1):
+        if not self.enabled:
+            return
+        self.counts[name]+=int(n)
+
+    def as_dict(self):
+        return {'durations':dict(self.durations),
+                'calls':dict(self.calls),
+                'counts':dict(self.counts)}
+
+    def merge(self,metrics_dict):
+        """Add the metrics (as from as_dict) of another process"""
+        for stage,seconds in metrics_dict['durations'].items():
+            self.durations[stage]+=seconds
+        for stage,calls in metrics_dict['calls'].items():
+            self.calls[stage]+=calls
+        for name,n in metrics_dict['counts'].items():
+            self.counts[name]+=n
+
+    def summary(self):
+        lines = ['{}: {:.3f} s in {} calls'.format(stage,self.durations[stage],self.calls[stage])
+                    for stage in sorted(self.durations)]
+        lines += ['{}: {}'.format(name,self.counts[name]) for name in sorted(self.counts)]
+        return '\n'.join(lines)
+
+    def log_summary(self):
+        log.info('Metrics:\n{}'.format(self.summary()))
+
+    def dump(self,path):
+        """Write the metrics to a JSON file"""
+        with open(path,'w') as f:
+            json.dump(self.as_dict(),f,indent=1)
+
+    def to_prometheus(self,prefix='ssjlatbin'):
+        """The metrics in the Prometheus text exposition format"""
+        lines = ['# HELP {}_stage_seconds_total Time spent in each processing stage'.format(prefix),
+                 '# TYPE {}_stage_seconds_total counter'.format(prefix)]
+        lines += ['{}_stage_seconds_total{{stage="{}"}} {!r}'.format(prefix,stage,self.durations[stage])
+                    for stage in sorted(self.durations)]
+        lines += ['# HELP {}_stage_calls_total Number of times each processing stage ran'.format(prefix),
+                  '# TYPE {}_stage_calls_total counter'.format(prefix)]
+        lines += ['{}_stage_calls_total{{stage="{}"}} {}'.format(prefix,stage,self.calls[stage])
+                    for stage in sorted(self.calls)]
+        for name in sorted(self.counts):
+            metric = '{}_{}_total'.format(prefix,re.sub(r'[^a-zA-Z0-9_]','_',name))
+            lines += ['# TYPE {} counter'.format(metric),
+                      '{} {}'.format(metric,self.counts[name])]
+        return '\n'.join(lines)+'\n'
+
+    def write_prometheus(self,path,prefix='ssjlatbin'):
+        """Write the metrics to a file in the Prometheus text format
+        (e.g. for the node exporter textfile collector)"""
+        with open(path,'w') as f:
+            f.write(self.to_prometheus(prefix=prefix))
+
+#Metrics of this process, disabled until enable_metrics is called
+METRICS = Metrics(enabled=False)
+
+def get_metrics():
+    return METRICS
+
+def enable_metrics(enabled=True):
+    """Turn collection of metrics on (or off) for this process"""
+    METRICS.enabled = enabled
+    return METRICS
+
+def timed(stage):
+    """Decorator adding the time spent in the function to stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not METRICS.enabled:
+                return func(*args,**kwargs)
+            with METRICS.timer(stage):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
@@ -2,31 +2,86 @@ import datetime,os
 from collections.abc import Mapping #base class used by ReadOnlyCDF
 
 import numpy as np
-from netCDF4 import Dataset
-from dateutil.relativedelta import relativedelta
+
+#Milliseconds from 0001-01-01 to 1970-01-01 (the numpy datetime64 epoch)
+_MS_FROM_1AD_TO_1970 = (datetime.datetime(1970,1,1)-datetime.datetime(1,1,1))//datetime.timedelta(milliseconds=1)
+
+def ms_since_0AD_to_datetime64(ms_since_0AD):
+    """Vectorized equivalent of ReadOnlyConvertedNC._ms_since_0AD_to_datetime, 
+    converting an array of milliseconds since 0 AD to datetime64[ns]
+    using only integer arithmetic on numpy arrays"""
+    ms_since_0AD = np.asarray(ms_since_0AD,dtype=np.float64)
+    #Python datetimes (and timedelta(seconds=...)) have microsecond resolution
+    whole_ms = np.floor(ms_since_0AD)
+    us_since_1AD = whole_ms.astype(np.int64)*1000+np.round((ms_since_0AD-whole_ms)*1000.).astype(np.int64)
+    us_since_1970 = us_since_1AD-_MS_FROM_1AD_TO_1970*1000
+    dts_plus_1year = us_since_1970.astype('datetime64[us]').astype('datetime64[ns]')
+
+    #Subtract one calendar year as relativedelta(years=1) does, i.e. same month, 
+    #day and time of day in the previous year, with Feb 29 becoming Feb 28
+    months = dts_plus_1year.astype('datetime64[M]')
+    days = dts_plus_1year.astype('datetime64[D]')
+    time_of_day = dts_plus_1year-days
+    day_of_month = days-months.astype('datetime64[D]')
+    prev_year_months = months-np.timedelta64(12,'M')
+    month_start = prev_year_months.astype('datetime64[D]')
+    month_length = (prev_year_months+np.timedelta64(1,'M')).astype('datetime64[D]')-month_start
+    day_of_month = np.minimum(day_of_month,month_length-np.timedelta64(1,'D'))
+    return (month_start+day_of_month).astype('datetime64[ns]')+time_of_day
+
+def datetime64_to_ms_since_0AD(dts):
+    """Inverse of ms_since_0AD_to_datetime64, converting datetime64 to 
+    the milliseconds since 0 AD Epoch of converted netCDF files 
+    (for writing synthetic files). Feb 29 cannot be represented, since 
+    ms_since_0AD_to_datetime64 never returns it"""
+    dts = np.asarray(dts,dtype='datetime64[ns]')
+    months = dts.astype('datetime64[M]')
+    days = dts.astype('datetime64[D]')
+    time_of_day = dts-days
+    day_of_month = days-months.astype('datetime64[D]')
+    dts_plus_1year = (months+np.timedelta64(12,'M')).astype('datetime64[D]')+day_of_month+time_of_day
+    us_since_1970 = dts_plus_1year.astype('datetime64[us]').astype(np.int64)
+    return (us_since_1970+_MS_FROM_1AD_TO_1970*1000)/1000.
 
 class ReadOnlyConvertedNC(Mapping):
     """Class providing dict-like reading syntax for 
     NetCDF files which were created from CDF files 
-    using the NASA cdf_to_netcdf tool"""
+    using the NASA cdf_to_netcdf tool
+
+    Epoch is returned as a datetime64[ns] array, or if epoch_type is
+    'datetime' as an object array of datetime.datetime"""
 
-    def __init__(self,fn):
+    def __init__(self,fn,epoch_type='datetime64'):
+        if epoch_type not in ['datetime64','datetime']:
+            raise ValueError(f'Invalid epoch_type {epoch_type}, valid options datetime64 or datetime')
         self.fn=fn
+        self.epoch_type=epoch_type
+        #Imported here so importing this module (e.g. for the epoch conversions) is fast
+        from netCDF4 import Dataset
         self.ds = Dataset(fn,'r')
+        #Read bare numpy arrays rather than masked arrays
+        self.ds.set_auto_mask(False)
         self._keys = list(self.ds.variables.keys())
-        self.epocharr_to_datetime = np.vectorize(self._ms_since_0AD_to_datetime)
             
     @staticmethod
     def _ms_since_0AD_to_datetime(ms_since_0AD):
         """CDF files which have been converted to netCDF using 
         the NASA cdf_to_netcdf tool appear to convert EPOCH CDF type
         into a float64 variable which is milliseconds since 0 AD"""
+        from dateutil.relativedelta import relativedelta
         
         dt_1AD = datetime.datetime(1,1,1,0,0) #0 AD is not defined as a Python datetime
         s_since_0AD=ms_since_0AD/1000.
 
         return dt_1AD+datetime.timedelta(seconds=s_since_0AD)-relativedelta(years=1)
 
+    def epocharr_to_datetime(self,ms_since_0AD):
+        """Convert Epoch (milliseconds since 0 AD) to the type set by epoch_type"""
+        dts = ms_since_0AD_to_datetime64(ms_since_0AD)
+        if self.epoch_type == 'datetime':
+            return dts.astype('datetime64[us]').astype(object)
+        return dts
+
     def __str__(self):
         keystr = '\n'.join([key for key in self])
         return f'Converted CDF NetCDF File {self.fn} with variables:\n{keystr}'
@@ -41,9 +96,19 @@ class ReadOnlyConvertedNC(Mapping):
         return self._keys.__iter__()
 
     def __getitem__(self,key):
-        """netCDF4 Datasets return masked arrays, so the .data is required 
-        to get at the bare numpy array"""
-        if key=='Epoch':
-            return self.epocharr_to_datetime(self.ds['Epoch'][:].data)    
+        return self.read(key)
+
+    def read(self,key,time_slice=None,channels=None):
+        """Read a variable, optionally only some times (time_slice, a slice of the first
+        dimension) and for 2D variables only some columns (channels, a list of indices).
+        Masking is disabled on the Dataset, so netCDF4 returns bare numpy arrays
+        without first making masked arrays"""
+        time_slice = slice(None) if time_slice is None else time_slice
+        var = self.ds[key]
+        if channels is None:
+            arr = var[time_slice]
         else:
-            return self.ds[key][:].data
\ No newline at end of file
+            arr = var[time_slice,list(channels)]
+        if key=='Epoch':
+            return self.epocharr_to_datetime(arr)
+        return np.asarray(arr)
@@ -0,0 +1,135 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Latitude bin SSJ data as it arrives, in chunks of any size, emitting
+each orbit as soon as it is complete"""
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.cdf import ssj_dataframe,_define_ssj_dataframe_contents,_extend_orbit_numbers
+from ssjlatbin.latbin_pandas import bin_by_latitude
+from ssjlatbin.manifest import ORBIT_DIRECTION
+
+class OnlineOrbitBinner(object):
+    """Incremental version of pipeline.iter_latbinned_orbits for data which
+    arrives a little at a time. Each chunk pushed is integrated
+    (see cdf.ssj_dataframe) and its equator crossings found, continuing from
+    the end of the previous chunk, and the orbits it completes are latitude
+    binned (as from latbin_pandas.bin_by_latitude) and returned. Only the
+    samples of the orbit in progress are kept, as a list of the pieces
+    pushed, which are combined only once the orbit is complete, so the
+    work done by each push does not grow with the number of pushes in
+    an orbit.
+
+    The samples before the first equator crossing into hemisphere direction
+    are not part of a complete orbit and are dropped. The first complete
+    orbit is numbered first_orbit_number.
+
+    The binner can be pickled, or saved with save and restored with load,
+    to resume after a restart. Samples no later than the last sample
+    already pushed are ignored, so chunks can be pushed again safely.
+
+    Parameters
+    ----------
+    config - dict
+        Configuration (as from io.read_config)
+    latvar - str, optional
+        Latitude variable to bin by
+    direction - str, optional
+        Orbits start at equator crossings into this hemisphere ('north' or
+        'south'), the same as the Parquet dataset by default
+    first_orbit_number - int, optional
+        Number of the first complete orbit
+    """
+    def __init__(self,config,latvar='glats',direction=ORBIT_DIRECTION,first_orbit_number=0):
+        if direction not in ['north','south']:
+            raise ValueError('Invalid direction {} (north or south)'.format(direction))
+        self.config = config
+        self.latvar = latvar
+        self.first_orbit_number = first_orbit_number
+        #Orbit numbering continues from this state (see cdf._extend_orbit_numbers),
+        #samples before the first crossing are in orbit first_orbit_number-1
+        self.orbit_state = {'lat':np.nan,
+                            'orbit_number':float(first_orbit_number-1),
+                            'direction':direction}
+        self.incomplete = []
+        self.incomplete_orbit_number = None
+        self.last_time = None
+
+    def _chunk_dataframe(self,chunk):
+        """Dataframe (as from cdf.ssj_dataframe) of a chunk of SSJ file variables"""
+        dataframevar_to_filevar,_ = _define_ssj_dataframe_contents(self.config)
+        dts = np.asarray(chunk['Epoch'],dtype='datetime64[ns]')
+        data = {dfvar:np.asarray(chunk[filevar]) for dfvar,filevar in dataframevar_to_filevar.items()}
+        read_diff_flux = lambda filevar,channels: np.asarray(chunk[filevar])[:,channels]
+        return ssj_dataframe(dts,data,read_diff_flux,self.config)
+
+    def _complete_orbit(self,next_lat):
+        """Dataframe of the samples of the orbit in progress, with the columns
+        added by pipeline._completed_orbits, once the next orbit has started
+        (with a sample at geographic latitude next_lat)"""
+        orbitdf = pd.concat(self.incomplete)
+        orbitdf['orbit_number'] = self.incomplete_orbit_number
+        orbitdf['orbit_start_time'] = orbitdf['time'].min()
+        #As tools.derivative of the orbit and the samples after it
+        orbitdf['dglats'] = np.diff(np.append(orbitdf['glats'].values,next_lat))
+        return orbitdf
+
+    def push(self,chunk):
+        """Add a chunk of data, a dict-like of SSJ file variables (Epoch as
+        datetime64, the 1D variables in [dataframevar_to_filevar] and the
+        differential fluxes and their uncertainties, n_times x 19) with
+        samples in time order. Returns the latitude binned orbits completed by
+        the chunk, or None if it did not complete an orbit"""
+        df = self._chunk_dataframe(chunk)
+        if self.last_time is not None:
+            df = df[df.index>self.last_time]
+        if len(df) == 0:
+            return None
+        self.last_time = df.index[-1]
+
+        #Orbits are found from geographic latitude, as in pipeline.iter_latbinned_orbits
+        orbit_number,self.orbit_state = _extend_orbit_numbers(df,'glats',self.orbit_state)
+        starts = np.flatnonzero(np.concatenate([[True],orbit_number[1:]!=orbit_number[:-1]]))
+        ends = np.concatenate([starts[1:],[len(df)]])
+        completed = []
+        for start,end in zip(starts,ends):
+            if orbit_number[start] != self.incomplete_orbit_number:
+                if self.incomplete:
+                    completed.append(self._complete_orbit(df['glats'].values[start]))
+                self.incomplete = []
+                self.incomplete_orbit_number = orbit_number[start]
+            #Samples before the first complete orbit are not kept
+            if self.incomplete_orbit_number >= self.first_orbit_number:
+                self.incomplete.append(df.iloc[start:end])
+
+        if not completed:
+            return None
+        completed = pd.concat(completed).dropna().sort_index()
+        if len(completed) == 0:
+            return None
+        return bin_by_latitude(completed,self.config,latvar=self.latvar)
+
+    @property
+    def n_incomplete_samples(self):
+        """Number of samples of the orbit in progress held in memory"""
+        return sum([len(piece) for piece in self.incomplete])
+
+    def save(self,path):
+        """Save the binner to path (via a temporary file, so a crash
+        while saving leaves the previous save intact)"""
+        tmppath = '{}.{}.tmp'.format(path,os.getpid())
+        with open(tmppath,'wb') as f:
+            pickle.dump(self,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmppath,path)
+
+    @classmethod
+    def load(cls,path):
+        """Restore a binner saved with save"""
+        with open(path,'rb') as f:
+            binner = pickle.load(f)
+        if not isinstance(binner,cls):
+            raise TypeError('{} does not contain an {}'.format(path,cls.__name__))
+        return binner
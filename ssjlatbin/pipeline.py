@@ -0,0 +1,239 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import datetime,os
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.cdf import (_read_ssj_day,_number_orbits,_extend_orbit_numbers,
+                           _orbit_start_time)
+from ssjlatbin.latbin_pandas import bin_by_latitude
+from ssjlatbin.binstats import (bin_statistics,coarsen_bin_statistics,
+                                read_bin_statistics,write_bin_statistics)
+from ssjlatbin.fileindex import available_days
+from ssjlatbin.metrics import timed
+from ssjlatbin.tools import derivative
+
+def _completed_orbits(df,orbit_number,current_orbit):
+    """Split a dataframe of consecutive samples into the samples of orbits
+    which are complete and the samples of the incomplete orbit current_orbit.
+    Samples with NaN orbit number (before the first equator crossing)
+    are in neither"""
+    df = df.copy()
+    df['orbit_number'] = orbit_number
+    df['orbit_start_time'] = _orbit_start_time(df)
+    df['dglats'] = derivative(df['glats'].values)
+    completed = df[df['orbit_number']<current_orbit]
+    incomplete = df[df['orbit_number']==current_orbit]
+    return completed,incomplete.drop(columns=['orbit_number','orbit_start_time','dglats'])
+
+def iter_latbinned_orbits(dmsp_number,dt_start,dt_end,config,latvar='glats',direction=None,
+                          binner=bin_by_latitude):
+    """Generate latitude binned dataframes (as from latbin_pandas.bin_by_latitude)
+    for the orbits which start from dt_start up to (not including) dt_end,
+    reading one day of data at a time.
+
+    Only the current day and the samples of the orbit in progress at the
+    end of the previous day are kept in memory, so memory use does not
+    depend on the length of the time range. Orbits are numbered as in
+    cdf.get_orbit_numbered_ssj_range_dataframe (orbit 0 is the first orbit
+    with data on dt_start), and each generated dataframe has the orbits
+    which were completed by one day of data. The day before dt_start and
+    the day dt_end are read for the orbits which cross midnight.
+    Orbits start at equator crossings into the hemisphere direction
+    ('north' or 'south'), by default whichever is first in the data read.
+    binner is called as binner(orbits,config,latvar=latvar) to bin the
+    orbits (e.g. binstats.bin_statistics)"""
+    dt_start = datetime.datetime.combine(dt_start,datetime.time())
+    dt_end = datetime.datetime.combine(dt_end,datetime.time())
+    dates = available_days(dmsp_number,config,dt_start-datetime.timedelta(days=1),
+                           dt_end+datetime.timedelta(days=1))
+    to_number = []
+    state = None
+    incomplete = None
+    for date in dates:
+        daydf = _read_ssj_day(dmsp_number,datetime.datetime.combine(date,datetime.time()),config)
+        if daydf is None:
+            continue
+
+        if state is None:
+            #Number the first orbits relative to the first day read
+            #which is not before dt_start
+            to_number.append(daydf)
+            if daydf.index[-1]<pd.Timestamp(dt_start):
+                continue
+            df = pd.concat(to_number)
+            to_number = None
+            reference_date = max(dt_start.date(),df.index[0].date())
+            orbit_number,state = _number_orbits(df,reference_date,'glats',
+                                                  return_state=True,direction=direction)
+            #Samples after the last equator crossing are in the next (incomplete) orbit
+            is_numbered = np.flatnonzero(np.isfinite(orbit_number))
+            orbit_number[is_numbered[-1]+1:] = state['orbit_number']
+        else:
+            day_orbit_number,state = _extend_orbit_numbers(daydf,'glats',state)
+            df = pd.concat([incomplete,daydf])
+            orbit_number = np.concatenate([incomplete_orbit_number,day_orbit_number])
+
+        completed,incomplete = _completed_orbits(df,orbit_number,state['orbit_number'])
+        incomplete_orbit_number = np.full((len(incomplete),),state['orbit_number'])
+
+        completed = completed.dropna().sort_index()
+        in_range = np.logical_and(completed['orbit_start_time']>=pd.Timestamp(dt_start),
+                                  completed['orbit_start_time']<pd.Timestamp(dt_end))
+        completed = completed[in_range]
+        if len(completed)>0:
+            yield binner(completed,config,latvar=latvar)
+
+def latbinned_parquet_path(dmsp_number,date,config):
+    """Path of the Parquet file with the latitude binned orbits which start on date.
+    Files are partitioned by spacecraft and year under [io] parquet_root_dir"""
+    return os.path.join(config['io']['parquet_root_dir'],
+                        f'dmsp_number={dmsp_number}',
+                        f'year={date.year}',
+                        'dmsp-f{:02d}_ssj_latbin_{}{:02d}{:02d}.parquet'.format(dmsp_number,
+                                                                              date.year,
+                                                                              date.month,
+                                                                              date.day))
+
+def _latbin_columns(latbins):
+    """Signed center latitude and dawn/dusk flag (1 for dawn, -1 for dusk)
+    of each latitude bin label (as from latbin_pandas.latbin_label)"""
+    categories = pd.Series(latbins.categories)
+    dawn_dusk = np.where(categories.str.startswith('dawn').values,1,-1).astype(np.int8)
+    bin_lat = categories.str.split('_').str[1].astype(float).values
+    return bin_lat[latbins.codes],dawn_dusk[latbins.codes]
+
+@timed('parquet_write')
+def _write_parquet(binneddf,path):
+    """Write via a temporary file so a partially written file is never read.
+
+    bin_lat and dawn_dusk columns are added, and the rows are sorted by
+    latitude bin then orbit with one row group for each quarter of the
+    orbit (hemisphere and dawn/dusk), so the row group statistics let
+    dataset.load_latbinned skip the quarters a filter excludes"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+    latbins = pd.Categorical(binneddf.index.get_level_values('latbin'))
+    binneddf = binneddf.copy()
+    binneddf['bin_lat'],binneddf['dawn_dusk'] = _latbin_columns(latbins)
+    order = np.lexsort((binneddf.index.get_level_values('orbit_start_time').values,latbins.codes))
+    binneddf = binneddf.iloc[order]
+    table = pa.Table.from_pandas(binneddf)
+    quarter = (binneddf['bin_lat'].values<0)*2+(binneddf['dawn_dusk'].values<0)
+    starts = np.flatnonzero(np.concatenate([[True],quarter[1:]!=quarter[:-1]]))
+    ends = np.concatenate([starts[1:],[len(binneddf)]])
+    try:
+        with pq.ParquetWriter(tmppath,table.schema) as writer:
+            for start,end in zip(starts,ends):
+                writer.write_table(table.slice(start,end-start),row_group_size=end-start)
+        os.replace(tmppath,path)
+    finally:
+        #Never leave a partly written file behind
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+def _iter_latbinned_days(binneddfs):
+    """Regroup a sequence of latitude binned dataframes of consecutive orbits
+    into one dataframe per day of orbit start time, generating (date,dataframe)"""
+    day_binneddfs = []
+    day = None
+    for binneddf in binneddfs:
+        orbit_start_dates = binneddf.index.get_level_values('orbit_start_time').normalize()
+        for orbit_start_date in orbit_start_dates.unique():
+            if day is not None and orbit_start_date.date()!=day:
+                yield day,pd.concat(day_binneddfs)
+                day_binneddfs = []
+            day = orbit_start_date.date()
+            day_binneddfs.append(binneddf[orbit_start_dates==orbit_start_date])
+    if day_binneddfs:
+        yield day,pd.concat(day_binneddfs)
+
+def write_latbinned_parquet(dmsp_number,dt_start,dt_end,config,latvar='glats',direction=None):
+    """Latitude bin the orbits starting from dt_start up to (not including) dt_end
+    and write them to a Parquet dataset with one file per day of orbit start time
+    (see latbinned_parquet_path), streaming the data one day at a time
+    (see iter_latbinned_orbits). Returns the list of files written"""
+    paths = []
+    binneddfs = iter_latbinned_orbits(dmsp_number,dt_start,dt_end,config,
+                                      latvar=latvar,direction=direction)
+    for day,binneddf in _iter_latbinned_days(binneddfs):
+        path = latbinned_parquet_path(dmsp_number,day,config)
+        _write_parquet(binneddf,path)
+        paths.append(path)
+    return paths
+
+def bin_statistics_root_dir(config):
+    """[io] bin_statistics_root_dir, by default next to (not inside) the
+    latitude binned dataset so the two are never read as one dataset"""
+    root_dir = config['io'].get('bin_statistics_root_dir','')
+    if not root_dir:
+        root_dir = os.path.normpath(config['io']['parquet_root_dir'])+'_bin_statistics'
+    return root_dir
+
+def bin_statistics_parquet_path(dmsp_number,date,config):
+    """Path of the Parquet file with the latitude bin statistics of the orbits
+    which start on date (partitioned like latbinned_parquet_path)"""
+    return os.path.join(bin_statistics_root_dir(config),
+                        f'dmsp_number={dmsp_number}',
+                        f'year={date.year}',
+                        'dmsp-f{:02d}_ssj_latbin_stats_{}{:02d}{:02d}.parquet'.format(dmsp_number,
+                                                                                    date.year,
+                                                                                    date.month,
+                                                                                    date.day))
+
+@timed('parquet_write')
+def _write_bin_statistics_parquet(statsdf,path,config):
+    os.makedirs(os.path.dirname(path),exist_ok=True)
+    tmppath = '{}.{}.tmp'.format(path,os.getpid())
+    try:
+        write_bin_statistics(statsdf,tmppath,config['latbin']['delta_lat'],config['latbin']['max_lat'])
+        os.replace(tmppath,path)
+    finally:
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+def write_bin_statistics_parquet(dmsp_number,dt_start,dt_end,config,latvar='glats',direction=None):
+    """Like write_latbinned_parquet, but writes the sufficient statistics of
+    each variable in each latitude bin (see binstats.bin_statistics), from
+    which any coarser latitude bins can be derived without reading the
+    SSJ files again (see read_bin_statistics_parquet).
+    Returns the list of files written"""
+    paths = []
+    statsdfs = iter_latbinned_orbits(dmsp_number,dt_start,dt_end,config,
+                                     latvar=latvar,direction=direction,
+                                     binner=bin_statistics)
+    for day,statsdf in _iter_latbinned_days(statsdfs):
+        path = bin_statistics_parquet_path(dmsp_number,day,config)
+        _write_bin_statistics_parquet(statsdf,path,config)
+        paths.append(path)
+    return paths
+
+def read_bin_statistics_parquet(dmsp_number,dt_start,dt_end,config,delta_lat=None,max_lat=None):
+    """Read the latitude bin statistics of the orbits starting from dt_start
+    up to (not including) dt_end written by write_bin_statistics_parquet,
+    combined into latitude bins delta_lat and max_lat (which must divide
+    evenly into the stored bins, by default the stored bins are returned).
+    Use binstats.bin_statistics_to_binned for the mean and standard deviation"""
+    dt_start = pd.Timestamp(dt_start).to_pydatetime()
+    dt_end = pd.Timestamp(dt_end).to_pydatetime()
+    statsdfs = []
+    date = dt_start.date()
+    while datetime.datetime.combine(date,datetime.time())<dt_end:
+        path = bin_statistics_parquet_path(dmsp_number,date,config)
+        if os.path.exists(path):
+            statsdf,fine_delta_lat,fine_max_lat = read_bin_statistics(path)
+            orbit_start_times = statsdf.index.get_level_values('orbit_start_time')
+            statsdf = statsdf[(orbit_start_times>=pd.Timestamp(dt_start))
+                              & (orbit_start_times<pd.Timestamp(dt_end))]
+            if delta_lat is not None or max_lat is not None:
+                statsdf = coarsen_bin_statistics(statsdf,fine_delta_lat,fine_max_lat,
+                                                 fine_delta_lat if delta_lat is None else delta_lat,
+                                                 fine_max_lat if max_lat is None else max_lat)
+            statsdfs.append(statsdf)
+        date += datetime.timedelta(days=1)
+    if not statsdfs:
+        return None
+    return pd.concat(statsdfs)
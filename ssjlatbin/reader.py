@@ -0,0 +1,73 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+from ssjlatbin.netcdf import ReadOnlyConvertedNC
+
+def open_ssj_file(ssjfn):
+    """Open a DMSP SSJ CDF or netCDF file with the reader for its extension.
+    pycdflib is imported here (and netCDF4 by ReadOnlyConvertedNC) so only
+    the library for the files actually read is ever imported"""
+    ext = os.path.splitext(ssjfn)[-1]
+    if ext == '.nc':
+        return ReadOnlyConvertedNC(ssjfn)
+    elif ext == '.cdf':
+        from pycdflib.cdf import ReadOnlyCDF
+        return ReadOnlyCDF(ssjfn)
+    else:
+        raise ValueError('Unexpected file extension {}'.format(ext))
+
+class LazySSJFile(Mapping):
+    """Dict-like access to the variables of an open SSJ file (ReadOnlyCDF or
+    ReadOnlyConvertedNC) which reads each variable from the file at most
+    once, and only when it is first accessed.
+
+    Parameters
+    ----------
+    file - ReadOnlyCDF or ReadOnlyConvertedNC
+        The open file
+    time_slice - slice, optional
+        Only read these times (first dimension) of each variable
+    float32 - bool, optional
+        Return floating point variables (other than Epoch) as float32
+    """
+    def __init__(self,file,time_slice=None,float32=False):
+        self.file = file
+        self.time_slice = slice(None) if time_slice is None else time_slice
+        self.float32 = float32
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.file)
+
+    def __contains__(self,key):
+        return key in self.file
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __getitem__(self,key):
+        return self.read(key)
+
+    def read(self,key,channels=None):
+        """Read a variable, or if channels (list of column indices) is passed
+        only those columns of a 2D variable"""
+        cache_key = (key,None if channels is None else tuple(channels))
+        if cache_key not in self._cache:
+            self._cache[cache_key] = self._read(key,channels)
+        return self._cache[cache_key]
+
+    def _read(self,key,channels):
+        if isinstance(self.file,ReadOnlyConvertedNC):
+            #Read only part of the variable from the file
+            arr = self.file.read(key,time_slice=self.time_slice,channels=channels)
+        else:
+            arr = self.file[key][self.time_slice]
+            if channels is not None:
+                arr = arr[:,list(channels)]
+        if self.float32 and key != 'Epoch' and np.issubdtype(arr.dtype,np.floating):
+            arr = arr.astype(np.float32,copy=False)
+        return arr
@@ -0,0 +1,88 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+"""Mergeable approximate quantiles of many groups of values at once.
+
+Each value is counted in a logarithmically spaced bucket, so a quantile
+read from the bucket counts is within relative_accuracy of the true value
+(the 'lower' quantile of the values, as numpy.quantile(...,method='lower')).
+The number of buckets of a group depends only on the range of its values
+(not the number of values) and the bucket counts of the same group from
+different chunks of data are merged by adding them"""
+import numpy as np
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+
+#Values smaller in magnitude than this are counted as zero
+MIN_INDEXABLE = 1e-12
+
+#Added to the bucket number of positive values (and subtracted for negative)
+#so bucket indexes sort in the same order as values, with zero as bucket 0
+_BUCKET_OFFSET = 1<<30
+
+def _log_gamma(relative_accuracy):
+    if not 0<relative_accuracy<1:
+        raise ValueError('Relative accuracy {} is not between 0 and 1'.format(relative_accuracy))
+    return np.log((1+relative_accuracy)/(1-relative_accuracy))
+
+def bucket_index(values,relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Bucket of each (finite) value, increasing with value"""
+    values = np.asarray(values,dtype=float)
+    magnitude = np.abs(values)
+    is_zero = magnitude<MIN_INDEXABLE
+    k = np.ceil(np.log(np.where(is_zero,1.,magnitude))/_log_gamma(relative_accuracy))
+    k = k.astype(np.int64)+_BUCKET_OFFSET
+    return np.where(is_zero,0,np.where(values>0,k,-k))
+
+def bucket_value(buckets,relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Value represented by each bucket (within relative_accuracy of
+    every value counted in it)"""
+    buckets = np.asarray(buckets,dtype=np.int64)
+    gamma = (1+relative_accuracy)/(1-relative_accuracy)
+    k = np.where(buckets==0,0,np.abs(buckets)-_BUCKET_OFFSET)
+    magnitude = 2*np.exp(k*_log_gamma(relative_accuracy))/(gamma+1)
+    return np.where(buckets==0,0.,np.sign(buckets)*magnitude)
+
+def reduce_sketches(groups,buckets,counts):
+    """Add up the counts of the same bucket of the same group, returning
+    (groups,buckets,counts) sorted by group then bucket"""
+    groups = np.asarray(groups,dtype=np.int64)
+    buckets = np.asarray(buckets,dtype=np.int64)
+    counts = np.asarray(counts,dtype=np.int64)
+    if groups.size == 0:
+        return groups,buckets,counts
+    order = np.lexsort((buckets,groups))
+    groups,buckets,counts = groups[order],buckets[order],counts[order]
+    is_first = np.concatenate([[True],(groups[1:]!=groups[:-1]) | (buckets[1:]!=buckets[:-1])])
+    starts = np.flatnonzero(is_first)
+    return groups[starts],buckets[starts],np.add.reduceat(counts,starts)
+
+def sketch_values(groups,values,relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Sketch the values of each group (integer group of each value),
+    ignoring NaN and infinite values. Returns (groups,buckets,counts)
+    as from reduce_sketches"""
+    values = np.asarray(values,dtype=float)
+    finite = np.isfinite(values)
+    groups = np.asarray(groups,dtype=np.int64)[finite]
+    buckets = bucket_index(values[finite],relative_accuracy)
+    return reduce_sketches(groups,buckets,np.ones(buckets.shape,dtype=np.int64))
+
+def sketch_quantiles(groups,buckets,counts,quantiles,relative_accuracy=DEFAULT_RELATIVE_ACCURACY):
+    """Quantiles of each group from sketches sorted by group then bucket
+    (as from reduce_sketches). Returns the groups, the number of values
+    in each group and an array (groups x quantiles) of quantiles"""
+    quantiles = np.atleast_1d(np.asarray(quantiles,dtype=float))
+    if np.any((quantiles<0) | (quantiles>1)):
+        raise ValueError('Quantiles {} are not between 0 and 1'.format(quantiles))
+    if groups.size == 0:
+        return groups,np.zeros((0,),dtype=np.int64),np.zeros((0,quantiles.size))
+    starts = np.flatnonzero(np.concatenate([[True],groups[1:]!=groups[:-1]]))
+    cumulative = np.cumsum(counts)
+    n = np.add.reduceat(counts,starts)
+    before = cumulative[starts]-counts[starts]
+    values = np.zeros((starts.size,quantiles.size))
+    for i_quantile,quantile in enumerate(quantiles):
+        rank = np.floor(quantile*(n-1)).astype(np.int64)
+        #First bucket of the group with more than rank values up to and including it
+        i_bucket = np.searchsorted(cumulative,before+rank,side='right')
+        values[:,i_quantile] = bucket_value(buckets[i_bucket],relative_accuracy)
+    return groups[starts],n,values
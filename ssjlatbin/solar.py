@@ -0,0 +1,72 @@
+# (C) 2021 University of Colorado AES-CCAR-SEDA (Space Environment Data Analysis) Group
+# Written by Liam Kilcommons - University of Colorado, Boulder - Colorado Center for Astrodynamics Research
+import numpy as np
+
+#Julian date of the J2000 epoch (noon on 2000-01-01)
+JD_J2000 = 2451545.0
+
+def solar_position_almanac(jds):
+    """Apparent solar right ascension and declination (radians) for
+    an array of julian dates, using the 'Low precision formulas for the Sun'
+    of the Astronomical Almanac (same as geospacepy.sun.solar_position_almanac,
+    better than 1' from 1950 to 2050)"""
+    jd2000 = jds-JD_J2000
+
+    #Solar mean longitude and mean anomaly (degrees)
+    L = np.mod(280.460+.9856474*jd2000,360.)
+    g_rad = np.radians(np.mod(357.528+0.9856003*jd2000,360.))
+
+    #Solar ecliptic longitude (degrees) and obliquity of the ecliptic
+    lam = L+1.915*np.sin(g_rad)+.020*np.sin(2*g_rad)
+    lam_r = np.radians(lam)
+    epsilon_r = np.radians(23.439-.0000004*jd2000)
+
+    t = np.tan(epsilon_r/2)**2.
+    f = 180./np.pi
+    alpha = lam-f*t*np.sin(2.*lam_r)+(f/2.)*t**2*np.sin(4*lam_r)
+    delta_r = np.arcsin(np.sin(epsilon_r)*np.sin(lam_r))
+    return np.radians(alpha),delta_r
+
+def greenwich_mean_sidereal_time(jds):
+    """Greenwich mean sidereal time (radians) for an array of julian dates
+    (same as geospacepy.sun.greenwich_mean_siderial_time)"""
+    t_ut1 = (jds-JD_J2000)/36525.
+    theta_GST_s = 67310.54841+(876600.*3600.+8640184.812866)*t_ut1+.093104*t_ut1**2-6.2e-6*t_ut1**3
+    theta_GST = np.mod(np.mod(theta_GST_s,86400.)/240.,360.)
+    return np.radians(theta_GST)
+
+def sun_vector(jds):
+    """Unit vector towards the sun in earth fixed (geographic) cartesian
+    coordinates, as a tuple of x,y,z arrays"""
+    sra,sdec = solar_position_almanac(jds)
+    #Longitude of the subsolar point
+    sslon = sra-greenwich_mean_sidereal_time(jds)
+    cos_sdec = np.cos(sdec)
+    return cos_sdec*np.cos(sslon),cos_sdec*np.sin(sslon),np.sin(sdec)
+
+def solar_zenith_angle(jds,glats,glons,cadence_s=None):
+    """Solar zenith angle (radians) for arrays of julian dates,
+    geographic latitudes and longitudes, equivalent to
+    geospacepy.sun.solar_zenith_angle. If cadence_s is set, the direction of
+    the sun is calculated every cadence_s seconds and linearly interpolated
+    to jds if they are sorted (the sun moves 0.004 degrees per second
+    relative to the earth, so the interpolation error is tiny for
+    cadences of a minute or so)"""
+    jds = np.asarray(jds,dtype=float)
+    if cadence_s is None or cadence_s<=0 or jds.size<2 or np.any(np.diff(jds)<0):
+        sun_x,sun_y,sun_z = sun_vector(jds)
+    else:
+        cadence_days = cadence_s/86400.
+        n_coarse = int(np.ceil((jds[-1]-jds[0])/cadence_days))+1
+        coarse_jds = jds[0]+np.arange(n_coarse)*cadence_days
+        coarse_sun = sun_vector(coarse_jds)
+        sun_x,sun_y,sun_z = [np.interp(jds,coarse_jds,component) for component in coarse_sun]
+        #Interpolated vectors are slightly shorter than unit vectors
+        norm = np.sqrt(sun_x**2+sun_y**2+sun_z**2)
+        sun_x,sun_y,sun_z = sun_x/norm,sun_y/norm,sun_z/norm
+
+    lam = np.radians(glats)
+    phi = np.radians(glons)
+    cos_lam = np.cos(lam)
+    cossza = np.sin(lam)*sun_z+cos_lam*(np.cos(phi)*sun_x+np.sin(phi)*sun_y)
+    return np.arccos(np.clip(cossza,-1.,1.))
@@ -13,4 +13,25 @@ def derivative(y):
     duplicated to keep the array the same size"""
     dy = np.diff(y)
     dy = np.concatenate([dy,np.array([dy[0]])],axis=0) #make same length as timeseries
-    return dy
\ No newline at end of file
+    return dy
+
+#Julian date of 1970-01-01 00:00 UT, the numpy datetime64 epoch
+JD_1970 = 2440587.5
+
+def datetime64arr2jd(dts):
+    """Julian dates from an array of datetime64 
+    (or datetime.datetime, which are converted to datetime64)"""
+    ns_since_1970 = np.asarray(dts,dtype='datetime64[ns]').astype(np.int64)
+    return ns_since_1970/86400e9+JD_1970
+
+def equator_crossings(lats,previous_lat=np.nan):
+    """Find the indices where the spacecraft entered the northern hemisphere
+    (latitude went from negative to zero or positive) and where it entered the
+    southern hemisphere (positive to zero or negative), as in
+    geospacepy.satplottools.simple_passes. If previous_lat, the latitude
+    just before lats[0], is passed, index 0 can also be a crossing"""
+    lats = np.concatenate([[previous_lat],lats])
+    before,after = lats[:-1],lats[1:]
+    entered_north = np.flatnonzero((before<0.) & (after>=0.))
+    entered_south = np.flatnonzero((before>0.) & (after<=0.))
+    return entered_north,entered_south
@@ -0,0 +1,15 @@
+import copy
+
+import pytest
+
+from ssjlatbin.benchmark import BENCHMARK_CONFIG
+
+@pytest.fixture
+def config(tmp_path):
+    """Benchmark configuration with the synthetic netCDF files, file index
+    and Parquet dataset under tmp_path"""
+    config = copy.deepcopy(BENCHMARK_CONFIG)
+    config['io']['ssj_nc_root_dir'] = str(tmp_path/'data')
+    config['io']['file_index_path'] = str(tmp_path/'file_index.json')
+    config['io']['parquet_root_dir'] = str(tmp_path/'parquet')
+    return config
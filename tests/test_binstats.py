@@ -0,0 +1,65 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ssjlatbin.benchmark import synthetic_orbit_numbered_dataframe
+from ssjlatbin.binstats import (bin_statistics,coarsen_bin_statistics,bin_statistics_to_binned,
+                                write_bin_statistics,read_bin_statistics)
+from ssjlatbin.latbin_pandas import bin_by_latitude,latbin_codes,latbin_categories
+
+VARIABLES = ['ele_total_energy','mlats']
+
+def _latbin_config(config,delta_lat,max_lat):
+    config = copy.deepcopy(config)
+    config['latbin'] = {'delta_lat':delta_lat,'max_lat':max_lat}
+    return config
+
+@pytest.fixture
+def df():
+    df = synthetic_orbit_numbered_dataframe(1,cadence_s=10.)
+    df.loc[df.index[::7],'ele_total_energy'] = np.nan
+    return df
+
+@pytest.fixture
+def fine_statsdf(df,config):
+    return bin_statistics(df,_latbin_config(config,1,80),variables=VARIABLES)
+
+def test_coarse_means_match_direct_binning(df,fine_statsdf,config):
+    coarse_config = _latbin_config(config,4,80)
+    binneddf = bin_statistics_to_binned(coarsen_bin_statistics(fine_statsdf,1,80,4,80))
+    direct = bin_by_latitude(df,coarse_config).reindex(binneddf.index)
+    for variable in VARIABLES:
+        np.testing.assert_allclose(binneddf[variable].values,direct[variable].values,rtol=1e-12)
+    #The direct mean time is averaged as float nanoseconds
+    time_difference = binneddf['time'].values-direct['time'].values.astype('datetime64[ns]')
+    assert np.abs(time_difference.astype(np.int64)).max()<1000
+
+def test_coarse_statistics_match_direct_statistics(df,fine_statsdf,config):
+    coarse_statsdf = coarsen_bin_statistics(fine_statsdf,1,80,4,80)
+    direct = bin_statistics(df,_latbin_config(config,4,80),variables=VARIABLES)
+    assert coarse_statsdf.index.equals(direct.index)
+    pd.testing.assert_frame_equal(coarse_statsdf,direct,check_exact=False,rtol=1e-12)
+
+def test_coarse_std_matches_pandas(df,fine_statsdf):
+    binneddf = bin_statistics_to_binned(coarsen_bin_statistics(fine_statsdf,1,80,4,80))
+    codes = latbin_codes(df,4,80)
+    in_bin = codes>=0
+    latbins = pd.Categorical.from_codes(codes[in_bin],categories=latbin_categories(4,80),ordered=True)
+    std = (df[in_bin].groupby([df['orbit_start_time'][in_bin].values,latbins],observed=True)[VARIABLES]
+           .std(ddof=0))
+    for variable in VARIABLES:
+        np.testing.assert_allclose(binneddf[variable+'_std'].values,std[variable].values,
+                                   rtol=1e-6,atol=1e-9)
+
+def test_coarse_bins_must_divide_fine_bins(fine_statsdf):
+    with pytest.raises(ValueError):
+        coarsen_bin_statistics(fine_statsdf,1,80,1.5,78)
+
+def test_write_read_round_trip(fine_statsdf,tmp_path):
+    path = str(tmp_path/'stats.parquet')
+    write_bin_statistics(fine_statsdf,path,1,80)
+    statsdf,delta_lat,max_lat = read_bin_statistics(path)
+    assert (delta_lat,max_lat) == (1,80)
+    pd.testing.assert_frame_equal(statsdf,fine_statsdf)
@@ -0,0 +1,61 @@
+import datetime,glob,os
+
+import numpy as np
+import pandas as pd
+import toml
+
+from ssjlatbin.benchmark import write_synthetic_ssj_files,synthetic_ssj_day,_write_nc
+from ssjlatbin.cli import main
+from ssjlatbin.io import ssjfn
+
+DMSP_NUMBER = 16
+
+def _read_dataset(root_dir):
+    paths = sorted(glob.glob(os.path.join(root_dir,'*','*','*.parquet')))
+    return pd.concat([pd.read_parquet(path) for path in paths])
+
+def test_chunked_build_numbers_orbits_like_one_chunk(config,tmp_path):
+    write_synthetic_ssj_files(config['io']['ssj_nc_root_dir'],DMSP_NUMBER,
+                              datetime.datetime(2010,1,1),7,cadence_s=10.)
+    config_path = str(tmp_path/'config.toml')
+    with open(config_path,'w') as f:
+        toml.dump(config,f)
+
+    datasets = []
+    for chunk_days in [2,5]:
+        output = str(tmp_path/f'parquet_{chunk_days}')
+        assert main([config_path,'2010-01-02','2010-01-06','--spacecraft',str(DMSP_NUMBER),
+                     '--chunk_days',str(chunk_days),'--processes','2','--output',output]) == 0
+        datasets.append(_read_dataset(output))
+    chunked,whole = datasets
+    pd.testing.assert_frame_equal(chunked,whole)
+    orbit_numbers = chunked.groupby(level='orbit_start_time')['orbit_number'].first()
+    assert orbit_numbers.is_unique
+    assert (orbit_numbers.diff().dropna() == 1).all()
+
+def test_chunks_after_a_failed_unit_are_not_renumbered(config,tmp_path):
+    write_synthetic_ssj_files(config['io']['ssj_nc_root_dir'],DMSP_NUMBER,
+                              datetime.datetime(2010,1,1),11,cadence_s=10.)
+    #Only the second chunk (2010-01-05 to 2010-01-08) reads this day, and fails
+    bad_day = datetime.datetime(2010,1,6)
+    data = synthetic_ssj_day(np.datetime64(bad_day,'D'),cadence_s=10.,seed=DMSP_NUMBER)
+    del data['SC_AACGM_LTIME']
+    fn = ssjfn(DMSP_NUMBER,bad_day,config)
+    os.remove(fn)
+    _write_nc(fn,data)
+    config_path = str(tmp_path/'config.toml')
+    with open(config_path,'w') as f:
+        toml.dump(config,f)
+
+    output = str(tmp_path/'parquet')
+    assert main([config_path,'2010-01-02','2010-01-11','--spacecraft',str(DMSP_NUMBER),
+                 '--chunk_days','3','--processes','2','--output',output]) == 1
+    dataset = _read_dataset(output)
+    orbit_start_times = dataset.index.get_level_values('orbit_start_time')
+    first_chunk = dataset[orbit_start_times<pd.Timestamp('2010-01-05')]
+    last_chunk = dataset[orbit_start_times>=pd.Timestamp('2010-01-08')]
+    assert len(first_chunk)>0 and len(last_chunk)>0
+    assert len(first_chunk)+len(last_chunk) == len(dataset)
+    #The last chunk keeps numbering from its own start rather than
+    #continuing from the first chunk across the failed one
+    assert last_chunk['orbit_number'].min() == first_chunk['orbit_number'].min()
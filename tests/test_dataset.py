@@ -0,0 +1,72 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ssjlatbin.benchmark import write_synthetic_ssj_files
+from ssjlatbin.dataset import latbinned_dataset,latbinned_filter,load_latbinned
+from ssjlatbin.pipeline import iter_latbinned_orbits,write_latbinned_parquet
+
+DMSP_NUMBERS = [16,17]
+DT_START,DT_END = datetime.datetime(2010,1,2),datetime.datetime(2010,1,4)
+
+@pytest.fixture
+def binneddfs(config):
+    """Latitude binned orbits of each spacecraft, also written to the dataset"""
+    binneddfs = {}
+    for dmsp_number in DMSP_NUMBERS:
+        write_synthetic_ssj_files(config['io']['ssj_nc_root_dir'],dmsp_number,
+                                  datetime.datetime(2010,1,1),4,cadence_s=10.)
+        write_latbinned_parquet(dmsp_number,DT_START,DT_END,config,direction='north')
+        binneddfs[dmsp_number] = pd.concat(list(iter_latbinned_orbits(dmsp_number,DT_START,DT_END,config,
+                                                                      direction='north')))
+    return binneddfs
+
+def _latbin_columns(df):
+    labels = df.index.get_level_values('latbin').astype(str)
+    return labels.str.startswith('dawn'),labels.str.split('_').str[1].astype(float)
+
+def test_load_everything(binneddfs,config):
+    df = load_latbinned(config)
+    expected = pd.concat([binneddf.assign(dmsp_number=dmsp_number)
+                          for dmsp_number,binneddf in binneddfs.items()])
+    assert list(df.columns) == list(expected.columns)
+    df = df.sort_values('dmsp_number',kind='stable').sort_index(kind='stable')
+    expected = expected.sort_values('dmsp_number',kind='stable').sort_index(kind='stable')
+    pd.testing.assert_frame_equal(df,expected,check_dtype=False,check_index_type=False)
+
+def test_filters(binneddfs,config):
+    dt_start,dt_end = datetime.datetime(2010,1,2,12),datetime.datetime(2010,1,3,6)
+    df = load_latbinned(config,dt_start=dt_start,dt_end=dt_end,dmsp_numbers=17,
+                        variables=['ele_total_energy'],dawn_dusk='dawn',hemisphere='S',
+                        min_abs_lat=60,max_abs_lat=70)
+    expected = binneddfs[17]
+    is_dawn,bin_lat = _latbin_columns(expected)
+    orbit_start_times = expected.index.get_level_values('orbit_start_time')
+    selected = (is_dawn & (bin_lat<=-60) & (bin_lat>=-70)
+                & (orbit_start_times>=dt_start) & (orbit_start_times<dt_end))
+    assert selected.sum()>0
+    expected = expected.loc[selected,['ele_total_energy']].sort_index()
+    pd.testing.assert_frame_equal(df,expected,check_index_type=False)
+
+    df = load_latbinned(config,dmsp_numbers=16,latbins=['dusk_61.0','dawn_-79.0'])
+    assert sorted(df.index.get_level_values('latbin').unique()) == ['dawn_-79.0','dusk_61.0']
+    assert load_latbinned(config,dt_start=datetime.datetime(2011,1,1)) is None
+
+def test_filters_skip_row_groups(binneddfs,config):
+    dataset = latbinned_dataset(config)
+    expression = latbinned_filter(dt_start=DT_START,dt_end=DT_START+datetime.timedelta(days=1),
+                                  dmsp_numbers=16,dawn_dusk='dawn',min_abs_lat=60)
+    n_row_groups = sum([fragment.num_row_groups for fragment in dataset.get_fragments()])
+    scanned = [row_group for fragment in dataset.get_fragments(filter=expression)
+                for row_group in fragment.split_by_row_group(filter=expression,schema=dataset.schema)]
+    #One file with its two dawn quarters out of two days of two spacecraft
+    assert n_row_groups == 16
+    assert len(scanned) == 2
+
+def test_invalid_filters():
+    with pytest.raises(ValueError):
+        latbinned_filter(dawn_dusk='noon')
+    with pytest.raises(ValueError):
+        latbinned_filter(hemisphere='E')
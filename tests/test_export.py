@@ -0,0 +1,42 @@
+import os
+
+import numpy as np
+import pytest
+
+from ssjlatbin.benchmark import synthetic_orbit_numbered_dataframe
+from ssjlatbin.export import write_latbinned_features,load_latbinned_features
+from ssjlatbin.io import dataframe_to_latbinned_fluxes
+from ssjlatbin.latbin_pandas import bin_by_latitude
+
+FLUXVARS = ['ele_total_energy']
+
+@pytest.fixture
+def binneddfs(config):
+    df = synthetic_orbit_numbered_dataframe(1,cadence_s=10.)
+    binneddf = bin_by_latitude(df[df['orbit_number']>df['orbit_number'].min()],config)
+    orbit_start_times = binneddf.index.get_level_values('orbit_start_time').unique()
+    return [binneddf.loc[orbit_start_times[:5]],binneddf.loc[orbit_start_times[5:]]]
+
+@pytest.mark.parametrize('ext',['.npy','.arrow'])
+def test_features_round_trip(binneddfs,config,tmp_path,ext):
+    path = str(tmp_path/('features'+ext))
+    write_latbinned_features(binneddfs,FLUXVARS,config,path,float32=False)
+    t,features,metadata = load_latbinned_features(path)
+    expected = [dataframe_to_latbinned_fluxes(binneddf,FLUXVARS,config,float32=False)
+                for binneddf in binneddfs]
+    if ext == '.arrow':
+        features = np.concatenate(features)
+    np.testing.assert_array_equal(features,np.concatenate([fluxes for _,_,_,fluxes in expected]))
+    np.testing.assert_array_equal(t,np.concatenate([np.asarray(t,dtype='datetime64[ns]')
+                                                    for t,_,_,_ in expected]))
+    np.testing.assert_array_equal(metadata['lats'],expected[0][1])
+    assert not [fn for fn in os.listdir(tmp_path) if fn.endswith('.tmp')]
+
+@pytest.mark.parametrize('ext',['.npy','.arrow'])
+def test_failed_write_leaves_no_files(binneddfs,config,tmp_path,ext):
+    def failing_binneddfs():
+        yield binneddfs[0]
+        raise RuntimeError('Read failed')
+    with pytest.raises(RuntimeError):
+        write_latbinned_features(failing_binneddfs(),FLUXVARS,config,str(tmp_path/('features'+ext)))
+    assert os.listdir(tmp_path) == []
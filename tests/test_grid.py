@@ -0,0 +1,69 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ssjlatbin.benchmark import synthetic_orbit_numbered_dataframe
+from ssjlatbin.grid import grid_cells,grid_shape,bin_by_grid,merge_grid_statistics,GRID_INDEX
+
+VARIABLES = ['ele_total_energy','glats']
+
+@pytest.fixture
+def grid_config(config):
+    config = copy.deepcopy(config)
+    config['grid'] = {'delta_mlat':2,'min_mlat':50,'delta_mlt':1,'window':''}
+    return config
+
+@pytest.fixture
+def df():
+    df = synthetic_orbit_numbered_dataframe(1,cadence_s=10.)
+    df.loc[df.index[::7],'ele_total_energy'] = np.nan
+    return df
+
+def _pandas_grid(df,window):
+    """Grid statistics of VARIABLES by a pandas groupby on the cell centers"""
+    range_start = df.index[0]
+    df = df[(df['mlats'].abs()>=50) & (df['mlats'].abs()<=90)]
+    i_mlat = np.minimum(np.floor((df['mlats'].abs().values-50)/2),19)
+    keys = [np.full(len(df),range_start) if window=='' else df.index.floor(window),
+            np.where(df['mlats'].values<0,'S','N'),
+            50+(i_mlat+.5)*2,
+            np.floor(np.mod(df['mlts'].values,24.))+.5]
+    grouped = df[VARIABLES].groupby(keys)
+    griddf = pd.concat([grouped.count().add_suffix('_count'),
+                        grouped.sum().add_suffix('_sum'),
+                        (df[VARIABLES]**2).groupby(keys).sum().add_suffix('_sumsq')],axis=1)
+    griddf.index.names = GRID_INDEX
+    return griddf
+
+@pytest.mark.parametrize('window',['','6h'])
+def test_bin_by_grid_matches_pandas(df,grid_config,window):
+    griddf = bin_by_grid(df,grid_config,window=window,variables=VARIABLES)
+    expected = _pandas_grid(df,window)
+    assert griddf.index.equals(expected.index)
+    pd.testing.assert_frame_equal(griddf,expected[griddf.columns],check_exact=False,rtol=1e-12,
+                                  check_index_type=False)
+
+def test_merged_chunks_match_whole(df,grid_config):
+    half = len(df)//2
+    whole = bin_by_grid(df,grid_config,window='6h',variables=VARIABLES)
+    merged = merge_grid_statistics([bin_by_grid(df.iloc[:half],grid_config,window='6h',variables=VARIABLES),
+                                    bin_by_grid(df.iloc[half:],grid_config,window='6h',variables=VARIABLES)])
+    pd.testing.assert_frame_equal(merged,whole,check_exact=False,rtol=1e-12)
+
+def test_grid_cells_wrap_mlt(grid_config):
+    n_mlat,n_mlt = grid_shape(grid_config)
+    cells = grid_cells([60.,60.,60.,60.,60.],[0.,24.,-1.,-.5,23.5],grid_config)
+    assert cells[0]==cells[1]
+    assert cells[2]==cells[3]==cells[4]
+    assert cells[2]%n_mlt==n_mlt-1
+
+def test_grid_cells_edges(grid_config):
+    n_mlat,n_mlt = grid_shape(grid_config)
+    cells = grid_cells([90.,-90.,50.,49.9,np.nan,60.,91.],[0.,0.,0.,0.,0.,np.nan,0.],grid_config)
+    #The poles are in the last cell of each hemisphere
+    assert cells[0]==(n_mlat-1)*n_mlt
+    assert cells[1]==(2*n_mlat-1)*n_mlt
+    assert cells[2]==0
+    np.testing.assert_array_equal(cells[3:],-1)
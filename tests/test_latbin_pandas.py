@@ -0,0 +1,72 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ssjlatbin.benchmark import synthetic_orbit_numbered_dataframe
+from ssjlatbin.latbin_pandas import (bin_by_latitude,latbin_sketches,merge_latbin_sketches,
+                                     latbin_sketch_quantiles,quantile_column,
+                                     DEFAULT_RELATIVE_ACCURACY)
+
+VARIABLES = ['ele_total_energy','mlats']
+
+QUANTILES = [.1,.5,.9]
+
+def _assert_within_relative_accuracy(approx,exact,relative_accuracy):
+    #Bins with no finite samples have no quantiles either way
+    np.testing.assert_array_equal(np.isnan(approx),np.isnan(exact))
+    finite = np.isfinite(exact)
+    error = np.abs(approx[finite]-exact[finite])
+    assert np.all(error<=relative_accuracy*np.abs(exact[finite])*(1+1e-9))
+
+def _latbin_config(config,**latbin):
+    config = copy.deepcopy(config)
+    config['latbin'].update(latbin)
+    return config
+
+@pytest.fixture
+def df():
+    df = synthetic_orbit_numbered_dataframe(1,cadence_s=10.)
+    df.loc[df.index[::7],'ele_total_energy'] = np.nan
+    return df
+
+@pytest.mark.parametrize('relative_accuracy',[.01,.05])
+def test_sketch_quantiles_within_relative_accuracy(df,config,relative_accuracy):
+    sketch_config = _latbin_config(config,aggregation='quantiles',quantiles=QUANTILES,
+                                   quantile_relative_accuracy=relative_accuracy)
+    exact_config = _latbin_config(sketch_config,exact_quantiles=True)
+    approx = bin_by_latitude(df,sketch_config)
+    exact = bin_by_latitude(df,exact_config)
+    assert approx.index.equals(exact.index)
+    for variable in VARIABLES:
+        for quantile in QUANTILES:
+            column = quantile_column(variable,quantile)
+            _assert_within_relative_accuracy(approx[column].values,exact[column].values,
+                                             relative_accuracy)
+        np.testing.assert_array_equal(approx[variable+'_count'].values,exact[variable+'_count'].values)
+
+def test_sketch_median_within_relative_accuracy(df,config):
+    approx = bin_by_latitude(df,_latbin_config(config,aggregation='median'))
+    exact = bin_by_latitude(df,_latbin_config(config,aggregation='median',exact_quantiles=True))
+    assert list(approx.columns)==list(exact.columns)
+    for variable in VARIABLES:
+        _assert_within_relative_accuracy(approx[variable].values,exact[variable].values,
+                                         DEFAULT_RELATIVE_ACCURACY)
+
+def test_merged_sketches_of_halves_equal_sketch_of_whole(df,config):
+    half = len(df)//2
+    whole = latbin_sketches(df,config,variables=VARIABLES)
+    merged = merge_latbin_sketches([latbin_sketches(df.iloc[:half],config,variables=VARIABLES),
+                                    latbin_sketches(df.iloc[half:],config,variables=VARIABLES)])
+    pd.testing.assert_frame_equal(latbin_sketch_quantiles(merged,QUANTILES),
+                                  latbin_sketch_quantiles(whole,QUANTILES))
+    key = ['orbit_start_time','latbin','variable','bucket']
+    whole = whole.sort_values(key,ignore_index=True)
+    merged = merged.sort_values(key,ignore_index=True)
+    pd.testing.assert_frame_equal(merged[key+['count']],whole[key+['count']],check_dtype=False,
+                                  check_categorical=False)
+
+def test_unknown_aggregation_raises(df,config):
+    with pytest.raises(ValueError):
+        bin_by_latitude(df,_latbin_config(config,aggregation='mode'))
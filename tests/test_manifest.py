@@ -0,0 +1,59 @@
+import copy,datetime,glob,os
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.benchmark import write_synthetic_ssj_files,synthetic_ssj_day,_write_nc
+from ssjlatbin.io import ssjfn
+from ssjlatbin.manifest import Manifest,update_latbinned_parquet
+
+DMSP_NUMBER = 16
+CADENCE_S = 10.
+
+def _read_dataset(config):
+    root_dir = config['io']['parquet_root_dir']
+    return {os.path.relpath(path,root_dir):pd.read_parquet(path)
+            for path in sorted(glob.glob(os.path.join(root_dir,'*','*','*.parquet')))}
+
+def _orbit_numbers(config,days):
+    manifest = Manifest.for_config(config)
+    try:
+        rows = [manifest.get(DMSP_NUMBER,day) for day in days]
+    finally:
+        manifest.close()
+    return [(row['first_orbit_number'],row['last_orbit_number']) for row in rows]
+
+def test_stale_day_rebuild_matches_fresh_build(config,tmp_path):
+    write_synthetic_ssj_files(config['io']['ssj_nc_root_dir'],DMSP_NUMBER,
+                              datetime.datetime(2010,1,1),6,cadence_s=CADENCE_S)
+    start,end = datetime.date(2010,1,2),datetime.date(2010,1,6)
+    days = [start+datetime.timedelta(days=i) for i in range((end-start).days)]
+    update_latbinned_parquet(DMSP_NUMBER,start,end,config)
+    before = _orbit_numbers(config,days)
+
+    #Cut the last 4 hours off one day, which removes orbits
+    stale_day = datetime.datetime(2010,1,3)
+    data = synthetic_ssj_day(np.datetime64(stale_day,'D'),cadence_s=CADENCE_S,seed=DMSP_NUMBER)
+    keep = data['Epoch']<np.datetime64(stale_day+datetime.timedelta(hours=20),'ns')
+    fn = ssjfn(DMSP_NUMBER,stale_day,config)
+    os.remove(fn)
+    _write_nc(fn,{key:arr[keep] for key,arr in data.items()})
+    paths = update_latbinned_parquet(DMSP_NUMBER,start,end,config)
+    assert len(paths) == 3
+    rebuilt = _orbit_numbers(config,days)
+    #The day after the rewritten days was renumbered
+    assert rebuilt[-1] != before[-1]
+
+    fresh_config = copy.deepcopy(config)
+    fresh_config['io']['parquet_root_dir'] = str(tmp_path/'fresh_parquet')
+    update_latbinned_parquet(DMSP_NUMBER,datetime.datetime(2010,1,2),datetime.datetime(2010,1,6),
+                             fresh_config)
+    assert _orbit_numbers(fresh_config,days) == rebuilt
+    rebuilt_dataset,fresh_dataset = _read_dataset(config),_read_dataset(fresh_config)
+    assert list(rebuilt_dataset) == list(fresh_dataset)
+    for relpath,df in fresh_dataset.items():
+        pd.testing.assert_frame_equal(rebuilt_dataset[relpath],df)
+
+    #Orbit numbers continue from one day to the next
+    for (first,last),(next_first,next_last) in zip(rebuilt[:-1],rebuilt[1:]):
+        assert next_first == last+1
@@ -0,0 +1,54 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from ssjlatbin.benchmark import write_synthetic_ssj_files
+from ssjlatbin.io import ssjfn
+from ssjlatbin.online import OnlineOrbitBinner
+from ssjlatbin.pipeline import iter_latbinned_orbits
+from ssjlatbin.reader import open_ssj_file,LazySSJFile
+
+DMSP_NUMBER = 16
+
+FILE_VARIABLES = ['Epoch','SC_GEOCENTRIC_LAT','SC_GEOCENTRIC_LON','SC_AACGM_LAT','SC_AACGM_LTIME',
+                  'ELE_DIFF_ENERGY_FLUX','ELE_DIFF_ENERGY_FLUX_STD',
+                  'ION_DIFF_ENERGY_FLUX','ION_DIFF_ENERGY_FLUX_STD']
+
+def _read_variables(dts,config):
+    files = [LazySSJFile(open_ssj_file(ssjfn(DMSP_NUMBER,dt,config))) for dt in dts]
+    return {var:np.concatenate([np.asarray(file[var]) for file in files]) for var in FILE_VARIABLES}
+
+def test_random_chunks_match_iter_latbinned_orbits(config,tmp_path):
+    write_synthetic_ssj_files(config['io']['ssj_nc_root_dir'],DMSP_NUMBER,
+                              datetime.datetime(2010,1,1),6,cadence_s=10.)
+    dts = [datetime.datetime(2010,1,day) for day in range(2,6)]
+    batch = pd.concat(list(iter_latbinned_orbits(DMSP_NUMBER,dts[0],dts[-1]+datetime.timedelta(days=1),
+                                                 config,direction='north')))
+
+    data = _read_variables(dts,config)
+    n_samples = len(data['Epoch'])
+    rng = np.random.default_rng(0)
+    #Chunks of every size from one sample up
+    cuts = np.concatenate([[0,1,2],np.sort(rng.choice(np.arange(3,n_samples),300,replace=False)),
+                           [n_samples]])
+    binner = OnlineOrbitBinner(config,first_orbit_number=int(batch['orbit_number'].min()))
+    binneddfs = []
+    state_path = str(tmp_path/'binner.pkl')
+    for i_chunk,(start,end) in enumerate(zip(cuts[:-1],cuts[1:])):
+        if i_chunk == len(cuts)//2:
+            #Resume from a save, pushing some samples again
+            binner.save(state_path)
+            binner = OnlineOrbitBinner.load(state_path)
+            start = max(start-50,0)
+        binneddf = binner.push({var:arr[start:end] for var,arr in data.items()})
+        if binneddf is not None:
+            binneddfs.append(binneddf)
+    online = pd.concat(binneddfs)
+
+    #The last orbit needs the next day to complete
+    orbit_start_times = online.index.get_level_values('orbit_start_time').unique()
+    batch_orbit_start_times = batch.index.get_level_values('orbit_start_time').unique()
+    assert orbit_start_times.equals(batch_orbit_start_times[:-1])
+    pd.testing.assert_frame_equal(online,batch.loc[orbit_start_times])
+    assert 0 < binner.n_incomplete_samples < n_samples/len(orbit_start_times)*1.5